@@ -0,0 +1,199 @@
+from __future__ import annotations
+import multiprocessing
+import queue
+import time
+from typing import TYPE_CHECKING
+from sheets import log
+
+if TYPE_CHECKING:
+    from alpaca.common import RawData
+
+# Positions, buying power and equity loaded from Alpaca once and then kept up to date with the fills from the trade
+# stream, so looking them up doesn't need a request each time. Everything is loaded again every reconcileSeconds in
+# case an update was missed.
+# The stream runs in its own process, so it sends updates here through updateQueue as
+# (event, order id, symbol, side, qty, price, position qty, time received) tuples.
+# Alpaca's buying power already has the cost of open buy orders taken out, so a reload keeps their reservations, and
+# updates that the reload already counts only change orderStates
+
+reconcileSeconds = 300
+
+positions: dict[str, float] = {} # Key: symbol without a /, Value: shares
+buyingPower = 0.0
+equity = 0.0
+loadTime = 0.0 # 0 means the state has to be loaded before it's used
+
+# Key: order id, Value: (shares not filled yet, price per share) of buy orders whose cost was taken from buyingPower.
+# The price is None if the order was only seen in a reload and had no limit price, and then fills are taken as costing
+# what was reserved
+reservations: dict[str, tuple[float, float | None]] = {}
+
+# Key: order id, Value: (last event, shares filled so far), for orders seen in the stream
+orderStates: dict[str, tuple[str, float]] = {}
+
+# When the last reload started, and Key: order id, Value: shares filled of the orders that were open in it. Updates
+# received before the reload, or for fills the open orders already had, are counted in it
+snapshotTime = 0.0
+snapshotFilled: dict[str, float] = {}
+
+updateQueue = None
+lastUpdateTime = 0.0 # When an update last came through updateQueue
+
+# Request counts, to see how many requests the cache saves
+stats = {"lookups": 0, "requests": 0, "updates": 0}
+
+# Returns the queue the stream process sends updates through, creating it the first time
+def getUpdateQueue():
+    global updateQueue
+    if updateQueue is None:
+        updateQueue = multiprocessing.Queue()
+    return updateQueue
+
+# Positions are listed as BTCUSD while crypto orders use BTC/USD
+def getKey(symbol: str) -> str:
+    return symbol.replace("/", "")
+
+def refresh() -> None:
+    from api import getTradingClient
+
+    global positions, buyingPower, equity, loadTime, snapshotTime, snapshotFilled
+    startTime = time.time()
+    client = getTradingClient()
+    account = client.get_account()
+    allPositions = client.get_all_positions()
+    openOrders = client.get_orders() # Open orders by default
+    stats["requests"] += 3
+
+    positions = {getKey(position.symbol): float(position.qty) for position in allPositions}
+    buyingPower = float(account.buying_power)
+    equity = float(account.equity)
+
+    # Keep reserving what's left of open buys, since their fills will still be taken from buyingPower
+    openBuys = [order for order in openOrders if str(getattr(order.side, "value", order.side)) == "buy"]
+    previous = dict(reservations)
+    reservations.clear()
+    for order in openBuys:
+        orderId = str(order.id)
+        remaining = float(order.qty or 0) - float(order.filled_qty or 0)
+        if remaining <= 0:
+            continue
+        price = previous[orderId][1] if orderId in previous else \
+            float(order.limit_price) if getattr(order, "limit_price", None) is not None else None
+        reservations[orderId] = (remaining, price)
+
+    snapshotTime = startTime
+    snapshotFilled = {str(order.id): float(order.filled_qty or 0) for order in openOrders}
+    loadTime = time.time()
+
+# Makes the next lookup load everything again
+def invalidate() -> None:
+    global loadTime
+    loadTime = 0.0
+
+# Returns the tuple sent through updateQueue for a trade update
+def toUpdate(data: RawData) -> tuple:
+    order = data.order
+    return (str(getattr(data.event, "value", data.event)), str(order.id), order.symbol, \
+        str(getattr(order.side, "value", order.side)), float(data.qty) if data.qty is not None else None, \
+        float(data.price) if data.price is not None else None, \
+        float(data.position_qty) if data.position_qty is not None else None, time.time())
+
+def applyUpdate(update: tuple) -> None:
+    global buyingPower
+    (event, orderId, symbol, side, qty, price, positionQty, receivedTime) = update
+    stats["updates"] += 1
+
+    filledQty = orderStates.get(orderId, ("new", 0.0))[1]
+    if event in ("fill", "partial_fill") and qty is not None:
+        filledQty += qty
+    orderStates[orderId] = (event, filledQty)
+
+    # The last reload already counted this update
+    if receivedTime < snapshotTime or (orderId in snapshotFilled and event in ("fill", "partial_fill") \
+        and filledQty <= snapshotFilled[orderId]):
+        return
+
+    if event in ("fill", "partial_fill") and qty is not None and price is not None:
+        if "/" in symbol and not symbol.endswith("/USD"):
+            # Crypto to crypto fills change two positions and position qty only covers one of them
+            invalidate()
+            return
+
+        key = getKey(symbol)
+        sign = 1 if side == "buy" else -1
+        positions[key] = positionQty if positionQty is not None else positions.get(key, 0.0) + sign * qty
+        if positions[key] == 0:
+            del positions[key]
+
+        if side == "buy":
+            # The order's reserved cost was already taken from buyingPower, so only take the difference
+            (remaining, reservedPrice) = reservations.get(orderId, (0.0, 0.0))
+            filled = min(qty, remaining)
+            buyingPower += filled * (reservedPrice if reservedPrice is not None else price) - qty * price
+            if orderId in reservations:
+                reservations[orderId] = (remaining - filled, reservedPrice)
+        else:
+            buyingPower += qty * price
+
+        if event == "fill":
+            reservations.pop(orderId, None)
+    elif event in ("canceled", "expired", "rejected", "done_for_day"):
+        # Give back what's left of the order's reserved cost
+        (remaining, reservedPrice) = reservations.pop(orderId, (0.0, 0.0))
+        if reservedPrice is not None:
+            buyingPower += remaining * reservedPrice
+        else:
+            # Don't know how much Alpaca reserved, so load it again
+            invalidate()
+
+# Applies every update waiting in the queue
+def drain() -> None:
+    global lastUpdateTime
+    if updateQueue is None:
+        return
+    while True:
+        try:
+            update = updateQueue.get_nowait()
+        except queue.Empty:
+            return
+        lastUpdateTime = time.time()
+        applyUpdate(update)
+
+# Loads everything if it's never been loaded or it's been reconcileSeconds since the last load, otherwise applies new
+# updates
+def ensureFresh() -> None:
+    if time.time() - loadTime > reconcileSeconds:
+        if loadTime != 0:
+            log("Reconciling account state...")
+        # Updates still in the queue are drained after the reload, and the ones it already counts are skipped
+        refresh()
+        drain()
+    else:
+        drain()
+
+# Takes a buy order's cost from buyingPower until it's filled or cancelled, like Alpaca does
+def reserve(orderId, shares: float, price: float) -> None:
+    global buyingPower
+    if loadTime == 0:
+        return
+    reservations[str(orderId)] = (shares, price)
+    buyingPower -= shares * price
+
+def getPosition(symbol: str) -> float:
+    stats["lookups"] += 1
+    ensureFresh()
+    return positions.get(getKey(symbol), 0.0)
+
+def getBuyingPower() -> float:
+    stats["lookups"] += 1
+    ensureFresh()
+    return buyingPower
+
+def getEquity() -> float:
+    stats["lookups"] += 1
+    ensureFresh()
+    return equity
+
+def getStats() -> str:
+    return "Account lookups: " + str(stats["lookups"]) + ", Requests: " + str(stats["requests"]) + \
+        ", Stream updates: " + str(stats["updates"])
@@ -1,34 +1,69 @@
+from __future__ import annotations
 from datetime import datetime
 import math
 from multiprocessing import Process
 from multiprocessing.managers import DictProxy
 from time import sleep
-from typing import Callable
-from alpaca.trading.client import TradingClient
-from alpaca.trading.stream import TradingStream
-from alpaca.common import RawData
-from alpaca.broker.client import Asset, Order
-from alpaca.trading.requests import MarketOrderRequest
-from alpaca.trading.enums import OrderSide, TimeInForce
-import requests
-import yfinance
-from env import alpacaId, alpacaSecret
+from typing import TYPE_CHECKING, Callable
+import accountstate
+import assetindex
+import cryptoquotes
+import env
+import marketdata
 from sheets import getTransactionJournalRow, insertRowAtTop, log, logTransaction, read, sort, write
 
-# Init client
-print("Initializing Alpaca client...")
-tradingClient = TradingClient(alpacaId, alpacaSecret, paper=True)
+# The Alpaca, requests and yfinance libraries take a while to import, so they're only imported when first used
+if TYPE_CHECKING:
+    from alpaca.trading.client import TradingClient
+    from alpaca.common import RawData
+    from alpaca.broker.client import Asset, Order
+    from alpaca.trading.requests import MarketOrderRequest
+
+tradingClient: TradingClient | None = None
+
+# Returns the Alpaca client, creating it the first time it's needed
+def getTradingClient() -> TradingClient:
+    global tradingClient
+    if tradingClient is None:
+        from alpaca.trading.client import TradingClient
+
+        print("Initializing Alpaca client...")
+        tradingClient = TradingClient(env.alpacaId, env.alpacaSecret, paper=True)
+        # Retries are handled by orderexecution, with backoff and rate limits, instead of alpaca-py's fixed 3 second
+        # waits. TradingClient doesn't take retry_attempts and 0 would be ignored anyway, so it's set directly
+        tradingClient._retry = 0
+        print("Alpaca client initialized!")
+    return tradingClient
 
 tradeCallbacks: list[Callable[[RawData, DictProxy], None]] = []
+sharedData: DictProxy | None = None
+recorder = None # replay.Recorder that stream updates are saved with, if the stream is being recorded
+updateQueue = None # Where updates are sent for the account state in the process that started the stream
 
 # Set up stream
 async def updateHandler(data: RawData) -> None:
+    from alpaca.trading.enums import OrderSide
+
     print("Stream update received!")
 
-    # Trade callbacks is sometimes a single function, so we need to convert it to a list
-    # Don't know how it ends up as a single function, but it does
     global tradeCallbacks, sharedData
-    if tradeCallbacks is not list:
+    if recorder is not None:
+        try:
+            recorder.record(data, sharedData)
+        except Exception as e:
+            print("Error recording stream update: " + str(e))
+
+    # Update the account state before the callbacks so they see the fill
+    try:
+        update = accountstate.toUpdate(data)
+        accountstate.applyUpdate(update)
+        if updateQueue is not None:
+            updateQueue.put(update)
+    except Exception as e:
+        print("Error updating account state: " + str(e))
+
+    # Trade callbacks is sometimes a single function, so we need to convert it to a list
+    if type(tradeCallbacks) is not list:
         tradeCallbacks = [tradeCallbacks]
 
     # Run callbacks
@@ -120,9 +155,24 @@ async def updateHandler(data: RawData) -> None:
     except Exception as e:
         print("Error handling stream update: " + str(e))
 
-def initStream(callbacks: list[Callable[[RawData, DictProxy], None]], sharedDict: DictProxy | None) -> None:
+# Set recordPath to save every stream update to that file, for replay.py
+def initStream(callbacks: list[Callable[[RawData, DictProxy], None]], sharedDict: DictProxy | None, \
+    recordPath: str | None = None, queue=None) -> None:
     print("Initializing Alpaca stream...")
 
+    global updateQueue
+    updateQueue = queue
+    # A forked stream process inherits the account state's queue, and draining it here would take back the updates
+    # meant for the process that started the stream and apply them twice
+    accountstate.updateQueue = None
+
+    if recordPath is not None:
+        from replay import Recorder
+
+        global recorder
+        recorder = Recorder(recordPath)
+        print("Recording stream updates to " + recordPath)
+
     global tradeCallbacks
     tradeCallbacks = callbacks
     print("Trade callbacks set!")
@@ -130,7 +180,15 @@ def initStream(callbacks: list[Callable[[RawData, DictProxy], None]], sharedDict
     global sharedData
     sharedData = sharedDict
 
-    tradingStream = TradingStream(alpacaId, alpacaSecret, paper=True)
+    # Load the assets before any fills come in, so the callbacks' orders don't have to wait for them
+    if len(callbacks) > 0:
+        try:
+            assetindex.refresh()
+        except Exception as e:
+            print("Error loading assets: " + str(e))
+
+    from alpaca.trading.stream import TradingStream
+    tradingStream = TradingStream(env.alpacaId, env.alpacaSecret, paper=True)
     tradingStream.subscribe_trade_updates(updateHandler)
 
     print("Alpaca stream running...")
@@ -139,8 +197,8 @@ def initStream(callbacks: list[Callable[[RawData, DictProxy], None]], sharedDict
     print("Alpaca stream stopping...")
     tradingStream.stop()
 
-def startStreamProcess(sharedDict: DictProxy = None) -> None:
-    process = Process(target=initStream, args=(tradeCallbacks, sharedDict))
+def startStreamProcess(sharedDict: DictProxy = None, recordPath: str | None = None) -> None:
+    process = Process(target=initStream, args=(tradeCallbacks, sharedDict, recordPath, accountstate.getUpdateQueue()))
     process.start()
     print("Alpaca stream process started! Exit code:", process.exitcode)
 
@@ -155,136 +213,162 @@ if __name__ == "__main__":
             process.terminate()
             exit()
 
-print("Alpaca client initialized!")
-
+# Account values come from the cached account state, see accountstate.py
 def getBuyingPower() -> float:
-    return float(tradingClient.get_account().buying_power)
+    return accountstate.getBuyingPower()
 
 def getEquity() -> float:
-    return float(tradingClient.get_account().equity)
+    return accountstate.getEquity()
 
 def getPosition(symbol: str) -> float:
-    allPositions = tradingClient.get_all_positions()
-    for position in allPositions:
-        if(position.symbol == symbol):
-            return float(position.qty)
-    return 0
+    return accountstate.getPosition(symbol)
 
 def getSecurity(symbol: str) -> Asset | RawData:
-    return tradingClient.get_asset(symbol)
+    return getTradingClient().get_asset(symbol)
 
 def getOpenOrders() -> list[Order] | RawData:
-    return tradingClient.get_orders()
+    return getTradingClient().get_orders()
+
+# Checks a buy order and returns (order data, price), or None if it shouldn't be placed. balance is the buying power to
+# size the order with, and defaults to the account's
+def prepareBuyOrder(symbol: str, shares: float, balance: float | None = None) -> tuple[MarketOrderRequest, float] | None:
+    from alpaca.trading.requests import MarketOrderRequest
+    from alpaca.trading.enums import OrderSide, TimeInForce
+    import orderexecution
 
-def placeBuyOrder(symbol: str, shares: float) -> bool:
     log("Attempting to place buy order for " + str(shares) + " shares of " + symbol + "...")
 
     # Check if shares is valid
     if(shares <= 0):
         log("Invalid number of shares!")
-        return False
+        return None
 
     # Check if we can trade this security
-    security = getSecurity(symbol)
-    if(not security.tradable):
+    if(not assetindex.isTradable(symbol)):
         log("Security " + symbol + " is not tradable!")
-        return False
+        return None
+
+    # Only whole shares can be traded for some securities
+    fractionable = assetindex.isFractionable(symbol)
+    if(not fractionable):
+        shares = math.floor(shares)
+        if(shares <= 0):
+            log("Security " + symbol + " isn't fractionable and less than 1 share was ordered!")
+            return None
     
-    # Fetch the price from yfinance
-    price = float(yfinance.Ticker(symbol).info['ask'])
+    # Get the price from the shared quote snapshot
+    price = marketdata.getAsk(symbol)
 
     orderCost = price * shares
     print("Order cost: $" + str(round(orderCost, 2)) + " ($" + str(round(price, 2)) + " * " + str(shares) + ")")
 
     if orderCost < 1:
         log("Order cost is less than $1! Skipping...")
-        return False
+        return None
 
     # Check if we have enough money
-    balance = getBuyingPower()
+    if balance is None:
+        balance = getBuyingPower()
     print("Balance: $" + str(balance))
     if(balance < orderCost):
-        shares = balance / price
+        shares = balance / price if fractionable else math.floor(balance / price)
         orderCost = price * shares
         log("Insufficient funds! Buying " + str(shares) + " shares instead...")
     
     if orderCost < 1:
         log("Order cost is less than $1! Skipping...")
-        return False
+        return None
 
-    # Place order
     log("Placing order for " + str(shares) + " shares of " + symbol + " for a total cost of $" + str(orderCost) + "...")
     
     # Generate order data
     # GTC is Good Til Cancelled
     # We use DAY so we can have fractional orders
-    orderData = MarketOrderRequest(symbol=symbol, qty=shares, side=OrderSide.BUY, time_in_force=TimeInForce.DAY)
+    # The client order id stays the same if the order is retried, so it can't be placed twice
+    orderData = MarketOrderRequest(symbol=symbol, qty=shares, side=OrderSide.BUY, time_in_force=TimeInForce.DAY, \
+        client_order_id=orderexecution.makeClientOrderId(symbol, "buy"))
+    return (orderData, price)
 
-    # Submit order
-    order = tradingClient.submit_order(orderData)
-    
-    log("Order placed!")
-    return True
+# Checks a sell order and returns its order data, or None if it shouldn't be placed
+def prepareSellOrder(symbol: str, shares: float) -> MarketOrderRequest | None:
+    from alpaca.trading.requests import MarketOrderRequest
+    from alpaca.trading.enums import OrderSide, TimeInForce
+    import orderexecution
 
-def placeSellOrder(symbol: str, shares: float) -> bool:
     log("Attempting to place sell order for " + str(shares) + " shares of " + symbol + "...")
 
     if(shares <= 0):
         log("Invalid number of shares!")
-        return False
+        return None
 
-    security = getSecurity(symbol)
-    if(not security.tradable):
+    if(not assetindex.isTradable(symbol)):
         log("Security " + symbol + " is not tradable!")
-        return False
+        return None
+
+    if(not assetindex.isFractionable(symbol)):
+        shares = math.floor(shares)
+        if(shares <= 0):
+            log("Security " + symbol + " isn't fractionable and less than 1 share was ordered!")
+            return None
     
     # Check if we have enough shares
     position = getPosition(symbol)
     log("Position: " + str(position))
     if(position < shares):
         log("Insufficient shares!")
-        return False
+        return None
     
-    # Fetch price
-    price = int(yfinance.Ticker(symbol).info['bid'])
+    # Get the price from the shared quote snapshot
+    price = marketdata.getBid(symbol)
     
-    # Place order
     log("Placing order for " + str(object=shares) + " shares of " + symbol + " for a total value of $" + str(round(price * shares, 2)) + "...")
 
     # Generate order data
     # GTC is Good Til Cancelled
     # We use DAY so we can have fractional orders
-    orderData = MarketOrderRequest(symbol=symbol, qty=shares, side=OrderSide.SELL, time_in_force=TimeInForce.DAY)
+    return MarketOrderRequest(symbol=symbol, qty=shares, side=OrderSide.SELL, time_in_force=TimeInForce.DAY, \
+        client_order_id=orderexecution.makeClientOrderId(symbol, "sell"))
 
-    # Submit order
-    order = tradingClient.submit_order(orderData)
+# Returns the order's id, or None if it wasn't placed. Use orderexecution.placeOrders to place many at once
+def placeBuyOrder(symbol: str, shares: float) -> str | None:
+    import orderexecution
 
-    log("Order placed!")
-    return True
+    prepared = prepareBuyOrder(symbol, shares)
+    if prepared is None:
+        return None
+    (orderData, price) = prepared
 
-def getCryptoPair(paySymbol: str, receiveSymbol: str, tryFlip: bool = True) -> float | None:
-    symbol = paySymbol + "/" + receiveSymbol
+    # Submit order
+    order = orderexecution.submitOrder(orderData)
+    accountstate.reserve(order.id, orderData.qty, price)
+    
+    log("Order placed!")
+    return str(order.id)
 
-    url = "https://data.alpaca.markets/v1beta3/crypto/us/latest/quotes?symbols=" + symbol
-    headers = {"accept": "application/json"}
+# Returns the order's id, or None if it wasn't placed
+def placeSellOrder(symbol: str, shares: float) -> str | None:
+    import orderexecution
 
-    try:
-        response = requests.get(url, headers=headers)
-    except requests.exceptions.RequestException as e:
-        print("Error fetching crypto pair", symbol, ":", e)
+    orderData = prepareSellOrder(symbol, shares)
+    if orderData is None:
         return None
-    
-    json = response.json()
 
-    try:
-        return json["quotes"][symbol]["ap"]
-    except KeyError:
-        # We may want to remove this. It's unclear if we can go backwards
-        if tryFlip:
-            return 1 / getCryptoPair(receiveSymbol, paySymbol, False)
-        return None
+    # Submit order
+    order = orderexecution.submitOrder(orderData)
+
+    log("Order placed!")
+    return str(order.id)
+
+# Quotes come from the shared crypto quote snapshot, see cryptoquotes.py. fresh fetches the quote instead, for sizing
+# orders
+def getCryptoPair(paySymbol: str, receiveSymbol: str, tryFlip: bool = True, fresh: bool = False) -> float | None:
+    return cryptoquotes.getPair(paySymbol, receiveSymbol, tryFlip, fresh=fresh)
     
-def buyCrypto(buySymbol: str, paySymbol: str, payAmt: float | None = None) -> None:
+# Returns the order's id, or None if no order was placed
+def buyCrypto(buySymbol: str, paySymbol: str, payAmt: float | None = None) -> str | None:
+    from alpaca.trading.requests import MarketOrderRequest
+    from alpaca.trading.enums import OrderSide, TimeInForce
+
     if payAmt is None:
         if paySymbol == "USD":
             payAmt = getBuyingPower()
@@ -303,20 +387,20 @@ def buyCrypto(buySymbol: str, paySymbol: str, payAmt: float | None = None) -> No
         payAmt = min(payAmt, payPosition)
 
     # Find the right symbol to buy
-    symbol = buySymbol + "/" + paySymbol
-    side = OrderSide.BUY
-    try:
-        tradingClient.get_asset(symbol)
-    except:
-        symbol = paySymbol + "/" + buySymbol
-        side = OrderSide.SELL
+    direction = assetindex.getPairDirection(buySymbol, paySymbol)
+    if direction is None:
+        print("No tradable pair for", buySymbol, "and", paySymbol)
+        return None
+    symbol = direction[0]
+    side = OrderSide.BUY if direction[1] == "buy" else OrderSide.SELL
 
     # print("Using symbol", symbol)
 
-    # Convert payAmt to amt of buySymbol
-    pair = 1 / getCryptoPair(paySymbol, buySymbol) \
+    # Convert payAmt to amt of buySymbol. The order is sized from a quote fetched now, since a snapshot can be
+    # quoteTtlSeconds old and crypto to crypto orders have no buffer
+    pair = 1 / getCryptoPair(paySymbol, buySymbol, fresh=True) \
         if side == OrderSide.BUY \
-        else getCryptoPair(buySymbol, paySymbol)
+        else getCryptoPair(buySymbol, paySymbol, fresh=True)
     # print("Pair:", pair, buySymbol, "per", paySymbol)
     # print("Pay amount:", payAmt, paySymbol)
     if "USD" in symbol:
@@ -329,5 +413,8 @@ def buyCrypto(buySymbol: str, paySymbol: str, payAmt: float | None = None) -> No
     orderData = MarketOrderRequest(symbol=symbol, qty=buyAmt if side == OrderSide.BUY else payAmt, \
         side=side, time_in_force=TimeInForce.GTC)
     # print("Order data:", orderData)
-    tradingClient.submit_order(orderData)
+    order = getTradingClient().submit_order(orderData)
+    if paySymbol == "USD":
+        accountstate.reserve(order.id, buyAmt, pair)
     print("Order placed!")
+    return str(order.id)
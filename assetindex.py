@@ -0,0 +1,79 @@
+from __future__ import annotations
+import time
+from sheets import log
+
+# Every Alpaca asset loaded with one request and kept in memory, so checking whether a symbol can be traded or which
+# way a crypto pair is listed doesn't need a request each time. Loaded again every refreshSeconds for new listings
+
+refreshSeconds = 6 * 3600
+
+assets: dict[str, tuple[bool, bool]] = {} # Key: symbol, Value: (tradable, fractionable)
+loadTime = 0.0
+
+# Symbols that weren't in the index and that get_asset didn't find either, until the next refresh
+missing: set[str] = set()
+
+stats = {"lookups": 0, "requests": 0}
+
+def refresh() -> None:
+    from api import getTradingClient
+    from alpaca.trading.enums import AssetClass, AssetStatus
+    from alpaca.trading.requests import GetAssetsRequest
+
+    global assets, loadTime
+    # Without an asset class Alpaca only lists stocks, so crypto is loaded separately
+    allAssets = []
+    for assetClass in (AssetClass.US_EQUITY, AssetClass.CRYPTO):
+        allAssets += getTradingClient().get_all_assets(GetAssetsRequest(status=AssetStatus.ACTIVE, \
+            asset_class=assetClass))
+        stats["requests"] += 1
+
+    assets = {asset.symbol: (bool(asset.tradable), bool(asset.fractionable)) for asset in allAssets}
+    missing.clear()
+    loadTime = time.time()
+    log("Loaded " + str(len(assets)) + " assets")
+
+def invalidate() -> None:
+    global loadTime
+    loadTime = 0.0
+
+# Returns (tradable, fractionable), or None if there's no such asset
+def getAsset(symbol: str) -> tuple[bool, bool] | None:
+    stats["lookups"] += 1
+    if time.time() - loadTime > refreshSeconds:
+        refresh()
+
+    if symbol in assets:
+        return assets[symbol]
+    if symbol in missing:
+        return None
+
+    # Might have been listed since the last refresh
+    from api import getTradingClient
+    stats["requests"] += 1
+    try:
+        asset = getTradingClient().get_asset(symbol)
+    except Exception as e:
+        # Only remember symbols Alpaca doesn't have, not ones that failed because of a timeout or rate limit
+        if getattr(e, "status_code", None) == 404:
+            missing.add(symbol)
+        return None
+    assets[symbol] = (bool(asset.tradable), bool(asset.fractionable))
+    return assets[symbol]
+
+def isTradable(symbol: str) -> bool:
+    asset = getAsset(symbol)
+    return asset is not None and asset[0]
+
+def isFractionable(symbol: str) -> bool:
+    asset = getAsset(symbol)
+    return asset is not None and asset[1]
+
+# Returns (symbol, side) to trade to get buySymbol with paySymbol, where side is "buy" if the pair is listed as
+# buySymbol/paySymbol and "sell" if it's listed as paySymbol/buySymbol. None if neither can be traded
+def getPairDirection(buySymbol: str, paySymbol: str) -> tuple[str, str] | None:
+    if isTradable(buySymbol + "/" + paySymbol):
+        return (buySymbol + "/" + paySymbol, "buy")
+    if isTradable(paySymbol + "/" + buySymbol):
+        return (paySymbol + "/" + buySymbol, "sell")
+    return None
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import time
+from sheets import log
+
+# Latest crypto quotes for every pair we watch, fetched in one request over a pooled connection and shared until
+# they're quoteTtlSeconds old, so every triangle is compared with quotes from the same moment
+
+quotesUrl = "https://data.alpaca.markets/v1beta3/crypto/us/latest/quotes"
+timeout = (3.05, 5) # (connect, read) seconds
+quoteTtlSeconds = 10
+
+universe: list[str] = [] # Pairs fetched with every refresh, like BTC/USD
+quotes: dict[str, tuple[float, float]] = {} # Key: pair, Value: (bid, ask). Replaced, never changed, on refresh
+quoteTime = 0.0
+
+stats = {"lookups": 0, "requests": 0, "errors": 0}
+
+session = None
+
+def getSession():
+    global session
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.headers.update({"accept": "application/json"})
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return session
+
+def setUniverse(pairs: list[str]) -> None:
+    global universe
+    universe = list(pairs)
+
+# Returns {pair: (bid, ask)} for pairs, fetched in one request, or None if the request fails
+def fetchQuotes(pairs: list[str]) -> dict[str, tuple[float, float]] | None:
+    import requests
+
+    stats["requests"] += 1
+    try:
+        response = getSession().get(quotesUrl, params={"symbols": ",".join(pairs)}, timeout=timeout)
+        response.raise_for_status()
+        latest = response.json()["quotes"]
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        stats["errors"] += 1
+        log("Error fetching crypto quotes: " + str(e))
+        return None
+
+    return {pair: (float(quote["bp"]), float(quote["ap"])) for pair, quote in latest.items()}
+
+# Fetches quotes for the universe plus pairs in one request. Keeps the last snapshot if the request fails
+def refreshQuotes(pairs: list[str] | None = None) -> None:
+    global quotes, quoteTime
+    requestPairs = list(dict.fromkeys(universe + (pairs or [])))
+    if len(requestPairs) == 0:
+        return
+
+    latest = fetchQuotes(requestPairs)
+    if latest is None:
+        return
+    quotes = latest
+    quoteTime = time.time()
+
+# Returns the current {pair: (bid, ask)} snapshot, refreshing it first if it's too old
+def getSnapshot() -> dict[str, tuple[float, float]]:
+    if time.time() - quoteTime > quoteTtlSeconds:
+        refreshQuotes()
+    return quotes
+
+# Returns the ask of paySymbol/receiveSymbol, or 1 / the ask of receiveSymbol/paySymbol if the pair is only listed the
+# other way, like api.getCryptoPair always has. snapshot defaults to the current one. fresh fetches the pair's quote
+# instead of using any snapshot, for sizing orders
+def getPair(paySymbol: str, receiveSymbol: str, tryFlip: bool = True, \
+    snapshot: dict[str, tuple[float, float]] | None = None, fresh: bool = False) -> float | None:
+    global quotes
+    stats["lookups"] += 1
+
+    pair = paySymbol + "/" + receiveSymbol
+    flipped = receiveSymbol + "/" + paySymbol
+    if fresh:
+        snapshot = fetchQuotes([pair, flipped] if tryFlip else [pair]) or {}
+    elif snapshot is None:
+        snapshot = getSnapshot()
+        if pair not in snapshot and (not tryFlip or flipped not in snapshot):
+            # Add the pair to the snapshot without dropping the others or making them look newer
+            fetched = fetchQuotes([pair, flipped] if tryFlip else [pair])
+            if fetched is not None:
+                quotes = {**quotes, **fetched}
+            snapshot = quotes
+
+    if pair in snapshot and snapshot[pair][1] > 0:
+        return snapshot[pair][1]
+    # We may want to remove this. It's unclear if we can go backwards
+    if tryFlip and flipped in snapshot and snapshot[flipped][1] > 0:
+        return 1 / snapshot[flipped][1]
+    return None
+
+def getStats() -> str:
+    return "Crypto quote lookups: " + str(stats["lookups"]) + ", Requests: " + str(stats["requests"]) + \
+        ", Errors: " + str(stats["errors"])
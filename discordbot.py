@@ -3,7 +3,7 @@ import discord
 import threading
 import datetime
 import psutil
-from env import botToken, botChannelId
+import env
 
 class MyBot(discord.Client):
     async def on_ready(self):
@@ -12,7 +12,7 @@ class MyBot(discord.Client):
         self.startTime = datetime.datetime.now()
 
     async def createStatusMessage(self):
-        channel = self.get_channel(int(botChannelId))
+        channel = self.get_channel(int(env.botChannelId))
         msg = await channel.send('Starting...')
         self.msg = msg
 
@@ -38,7 +38,7 @@ class MyBot(discord.Client):
         await self.msg.edit(content=text)
 
 async def runBot(exitFlag):
-    task = asyncio.create_task(bot.start(botToken))
+    task = asyncio.create_task(bot.start(env.botToken))
 
     while True:
         await asyncio.sleep(10)
@@ -1,17 +1,36 @@
 # Read environment variables
-envFile = open(".env", "r")
+# .env is only read the first time a variable is used, so importing this module is free
+names = {
+    "ALPACA_ID": "alpacaId",
+    "ALPACA_SECRET": "alpacaSecret",
+    "SHEETS_ID": "sheetsId",
+    "BOT_TOKEN": "botToken",
+    "BOT_CHANNEL_ID": "botChannelId"
+}
 
-for line in envFile:
-    splitLine = line.split("=")
-    if splitLine[0] == "ALPACA_ID":
-        alpacaId = splitLine[1].strip()
-    elif splitLine[0] == "ALPACA_SECRET":
-        alpacaSecret = splitLine[1].strip()
-    elif splitLine[0] == "SHEETS_ID":
-        sheetsId = splitLine[1].strip()
-    elif splitLine[0] == "BOT_TOKEN":
-        botToken = splitLine[1].strip()
-    elif splitLine[0] == "BOT_CHANNEL_ID":
-        botChannelId = splitLine[1].strip()
+values: dict[str, str] | None = None
 
-envFile.close()
\ No newline at end of file
+def loadEnv() -> dict[str, str]:
+    global values
+    if values is not None:
+        return values
+
+    # Only saved once the whole file has been read, so a missing .env keeps failing the same way
+    loadedValues = {}
+    envFile = open(".env", "r")
+
+    for line in envFile:
+        splitLine = line.split("=")
+        if splitLine[0] in names:
+            loadedValues[names[splitLine[0]]] = splitLine[1].strip()
+
+    envFile.close()
+    values = loadedValues
+    return values
+
+# Lets variables still be used as env.alpacaId
+def __getattr__(name: str) -> str:
+    loadedValues = loadEnv()
+    if name in loadedValues:
+        return loadedValues[name]
+    raise AttributeError("module 'env' has no attribute '" + name + "'")
@@ -0,0 +1,68 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures how long it takes a fresh Python process to import each module, like a worker or CLI run would.
+# Run from the repo root: python importbench.py [runs]
+
+modules = ["env", "sheets", "api", "predicting", "modelregistry", "trading", "testing", "triangle.main"]
+heavyModules = ["tensorflow", "keras", "sklearn", "matplotlib", "googleapiclient", "discord", "yfinance", "alpaca"]
+
+script = """
+import json, sys, time
+startTime = time.perf_counter()
+import {module}
+timeTaken = time.perf_counter() - startTime
+heavy = [name for name in {heavyModules} if name in sys.modules]
+print(json.dumps({{"time": timeTaken, "heavy": heavy}}))
+"""
+
+def timeImport(module: str) -> dict:
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([root, os.path.join(root, "ml")])
+
+    code = script.format(module=module, heavyModules=heavyModules)
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+
+    # Modules can print while importing, so the result is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def benchmark(runs: int = 3) -> dict[str, dict]:
+    results = {}
+    for module in modules:
+        times = []
+        heavy = []
+        error = None
+        for i in range(runs):
+            result = timeImport(module)
+            if "error" in result:
+                error = result["error"]
+                break
+            times.append(result["time"])
+            heavy = result["heavy"]
+
+        if error is not None:
+            results[module] = {"error": error}
+        else:
+            results[module] = {"median": statistics.median(times), "min": min(times), "heavy": heavy}
+
+    return results
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    results = benchmark(runs)
+
+    for module, result in results.items():
+        if "error" in result:
+            print(module.ljust(16), "Error:", result["error"])
+        else:
+            print(module.ljust(16), str(round(result["median"], 3)).ljust(8), "seconds", \
+                "Heavy imports: " + (", ".join(result["heavy"]) if len(result["heavy"]) > 0 else "none"))
+
+    with open("importbench.json", "w") as file:
+        json.dump(results, file, indent=4)
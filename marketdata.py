@@ -0,0 +1,78 @@
+from __future__ import annotations
+import time
+import env
+from sheets import log
+
+# Latest bid/ask quotes for every symbol we trade, fetched in one request and shared until they're quoteTtlSeconds old.
+# Sizing and order placement both read from the same snapshot instead of looking up each price separately
+
+quoteTtlSeconds = 30
+
+universe: list[str] = [] # Symbols fetched with every refresh
+quotes: dict[str, tuple[float, float]] = {} # Key: symbol, Value: (bid, ask)
+quoteTime = 0.0
+
+# Request counts, to see how many requests the cache saves
+stats = {"lookups": 0, "requests": 0, "fallbacks": 0}
+
+dataClient = None
+
+def getDataClient():
+    global dataClient
+    if dataClient is None:
+        from alpaca.data.historical import StockHistoricalDataClient
+        dataClient = StockHistoricalDataClient(env.alpacaId, env.alpacaSecret)
+    return dataClient
+
+def setUniverse(symbols: list[str]) -> None:
+    global universe
+    universe = list(symbols)
+
+# Fetches quotes for the universe plus symbols in one request
+def refreshQuotes(symbols: list[str] | None = None) -> None:
+    from alpaca.data.requests import StockLatestQuoteRequest
+
+    global quotes, quoteTime
+    requestSymbols = list(dict.fromkeys(universe + (symbols or [])))
+    if len(requestSymbols) == 0:
+        return
+
+    log("Fetching quotes for " + str(len(requestSymbols)) + " symbols...")
+    latest = getDataClient().get_stock_latest_quote(StockLatestQuoteRequest(symbol_or_symbols=requestSymbols))
+    stats["requests"] += 1
+
+    quotes = {symbol: (float(quote.bid_price), float(quote.ask_price)) for symbol, quote in latest.items()}
+    quoteTime = time.time()
+
+# Returns (bid, ask), refreshing every quote if the snapshot is too old or doesn't have symbol
+def getQuote(symbol: str) -> tuple[float, float]:
+    stats["lookups"] += 1
+
+    if time.time() - quoteTime > quoteTtlSeconds or symbol not in quotes:
+        try:
+            refreshQuotes([symbol])
+        except Exception as e:
+            log("Error fetching quotes: " + str(e))
+
+    (bid, ask) = quotes.get(symbol, (0, 0))
+
+    # Quotes can be empty outside market hours, so fall back to the last price
+    if bid <= 0 or ask <= 0:
+        import yfinance
+        stats["fallbacks"] += 1
+        lastPrice = float(yfinance.Ticker(symbol).fast_info["last_price"])
+        bid = bid if bid > 0 else lastPrice
+        ask = ask if ask > 0 else lastPrice
+
+    return (bid, ask)
+
+def getBid(symbol: str) -> float:
+    return getQuote(symbol)[0]
+
+def getAsk(symbol: str) -> float:
+    return getQuote(symbol)[1]
+
+def getStats() -> str:
+    return "Quote lookups: " + str(stats["lookups"]) + ", Requests: " + str(stats["requests"]) + \
+        ", Fallbacks: " + str(stats["fallbacks"]) + ", Requests saved: " + \
+        str(stats["lookups"] - stats["requests"] - stats["fallbacks"])
@@ -0,0 +1,119 @@
+from typing import Callable
+import numpy
+
+from metrics import RunningMetrics
+
+class TestResults:
+    def __init__(self, money: float, shares: dict[str, float], netWorth: list[float], profitBySymbol: dict[str, float], \
+                holdings: dict[str, list[float]], wins: int = 0, losses: int = 0, metrics: RunningMetrics | None = None):
+        self.money = money
+        self.shares = shares
+        self.netWorth = netWorth
+        self.profitBySymbol = profitBySymbol
+        self.holdings = holdings
+        self.wins = wins
+        self.losses = losses
+        self.metrics = metrics
+
+# Backtests with prices, signals, positions and cash held in (days x symbols) arrays instead of stepping through
+# each day. Gives the same results as testing.testModel
+
+# Returns the % of equity to hold in each symbol each day, like generateBuyAndSellLists: symbols with a change >= 0
+# get their change as a share of the total, and everything else is sold. Changes is (days x symbols)
+def proportionalWeights(changes: numpy.ndarray) -> numpy.ndarray:
+    positive = numpy.where(changes >= 0, changes, 0.0)
+    total = positive.sum(axis=1, keepdims=True)
+    return numpy.divide(positive, total, out=numpy.zeros_like(positive), where=total != 0)
+
+# Returns each day's equity after rebalancing. Since every day is rebalanced to weights, equity only depends on how
+# the previous day's holdings changed in value
+def getEquity(weights: numpy.ndarray, prices: numpy.ndarray, startingMoney: float) -> numpy.ndarray:
+    if len(prices) == 0:
+        return numpy.empty(0)
+
+    priceRatios = prices[1:] / prices[:-1]
+    growth = (weights[:-1] * priceRatios).sum(axis=1) + (1 - weights[:-1].sum(axis=1))
+    return startingMoney * numpy.concatenate([[1.0], numpy.cumprod(growth)])
+
+# Goes through each symbol's trades to work out buy prices, profit, wins and losses. This is the only part that
+# depends on the order of trades, so it's a loop. Returns (profitBySymbol, wins, losses)
+def getTradeStats(symbols: list[str], shares: numpy.ndarray, prices: numpy.ndarray, finalPrices: numpy.ndarray) \
+    -> tuple[dict[str, float], int, int]:
+    deltas = numpy.diff(shares, axis=0, prepend=0)
+
+    profitBySymbol = {}
+    wins = 0
+    losses = 0
+    for column, symbol in enumerate(symbols):
+        held = 0.0
+        buyPrice = None
+        profit = 0.0
+        for day in numpy.flatnonzero(deltas[:, column]):
+            delta = deltas[day, column]
+            price = prices[day, column]
+
+            if delta < 0:
+                # Sell
+                priceDiff = price - buyPrice
+                if priceDiff > 0:
+                    wins += 1
+                elif priceDiff < 0:
+                    losses += 1
+                profit += -delta * priceDiff
+            elif buyPrice is None or held == 0:
+                buyPrice = price
+            else:
+                # Weighted average of the buy prices
+                buyPrice = (price * delta + buyPrice * held) / (delta + held)
+            held += delta
+
+        if buyPrice is not None:
+            # Sell everything at the end
+            profit += shares[-1, column] * (finalPrices[column] - buyPrice)
+            profitBySymbol[symbol] = profit
+
+    return (profitBySymbol, wins, losses)
+
+# changes and prices are (days x symbols). finalPrices are the prices everything is sold at after the last day.
+# allocate turns changes into the % of equity to hold in each symbol, so different allocation rules can be tested.
+# Set trackTrades to False to skip profitBySymbol, wins and losses when only the equity curve is needed
+def runBacktest(symbols: list[str], changes: numpy.ndarray, prices: numpy.ndarray, finalPrices: numpy.ndarray, \
+    startingMoney: float = 100.0, allocate: Callable[[numpy.ndarray], numpy.ndarray] = proportionalWeights, \
+    trackTrades: bool = True) -> TestResults:
+    changes = numpy.asarray(changes, dtype=float)
+    prices = numpy.asarray(prices, dtype=float)
+    finalPrices = numpy.asarray(finalPrices, dtype=float)
+
+    weights = allocate(changes)
+    equity = getEquity(weights, prices, startingMoney)
+
+    holdingValues = weights * equity[:, numpy.newaxis]
+    shares = holdingValues / prices
+    money = equity - holdingValues.sum(axis=1)
+
+    finalMoney = float(money[-1] + (shares[-1] * finalPrices).sum()) if len(equity) > 0 else startingMoney
+
+    holdings = {symbol: holdingValues[:, column].tolist() for column, symbol in enumerate(symbols)}
+    holdings["Money"] = money.tolist()
+
+    (profitBySymbol, wins, losses) = getTradeStats(symbols, shares, prices, finalPrices) if trackTrades else ({}, 0, 0)
+
+    # Every day, then selling everything at finalPrices
+    metrics = RunningMetrics(symbols, startingMoney)
+    metrics.updateMany(equity, prices, shares)
+    if len(equity) > 0:
+        metrics.update(finalMoney, finalPrices, numpy.zeros(len(symbols)))
+
+    return TestResults(finalMoney, {symbol: 0 for symbol in symbols}, equity.tolist(), profitBySymbol, holdings, \
+        wins, losses, metrics)
+
+# Converts testModel's arguments into arrays and runs them through runBacktest
+def runBacktestFromLists(symbols: list[str], predictedChanges: dict[str, list[float]], \
+    realPrices: dict[str, list[float]], **kwargs) -> TestResults:
+    days = len(predictedChanges[symbols[0]]) - 1
+
+    changes = numpy.column_stack([numpy.asarray(predictedChanges[symbol][:days], dtype=float) for symbol in symbols])
+    prices = numpy.column_stack([numpy.asarray(realPrices[symbol][:days], dtype=float) for symbol in symbols])
+    finalPrices = numpy.array([realPrices[symbol][-1] for symbol in symbols], dtype=float)
+
+    return runBacktest(symbols, changes, prices, finalPrices, **kwargs)
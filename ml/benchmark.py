@@ -0,0 +1,190 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable
+import numpy
+import pandas
+
+# Only run on the CPU, even if there's a GPU, so results can be compared between machines
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+import modelconfig
+from numpymodel import NumpyModel
+from portfolio import BacktestRun
+from predicting import getChange, getChanges, historyDays, predictPrices
+from trading import generateBuyAndSellLists
+from windowing import trainingWindows
+
+# Times each stage of a backtest on synthetic prices, so performance can be measured without downloading data or
+# training real models. Results are saved as JSON to compare between commits.
+# Run from the ml folder: python benchmark.py [quick] [notrain]
+
+resultsPath = "benchmark.json"
+
+# Each scale is run separately
+scales = [
+    {"years": 1, "symbols": 2, "timesteps": 10},
+    {"years": 5, "symbols": 10, "timesteps": 40},
+    {"years": 10, "symbols": 50, "timesteps": 40}
+]
+
+repeats = 5 # Each stage is timed this many times and the median is kept
+trainEpochs = 2 # Epochs to time training for. The first epoch is timed separately since it includes compiling
+getChangeDays = 20 # Days to time the single day getChange on, since running it on every day would take too long
+seed = 0
+endDate = pandas.Timestamp("2024-01-01")
+
+# Returns deterministic OHLCV bars for symbol number symbolNum, one per business day
+def makeSyntheticData(symbolNum: int, days: int) -> pandas.DataFrame:
+    rng = numpy.random.default_rng([seed, symbolNum])
+    dates = pandas.bdate_range(end=endDate, periods=days, name="Date")
+
+    # Random walk with a little drift and a different volatility for each symbol
+    volatility = rng.uniform(0.01, 0.03)
+    closes = 10 * (1 + symbolNum % 10) * numpy.exp(numpy.cumsum(rng.normal(0.0002, volatility, days)))
+    opens = closes * numpy.exp(rng.normal(0, volatility / 4, days))
+    highs = numpy.maximum(opens, closes) * (1 + rng.uniform(0, volatility, days))
+    lows = numpy.minimum(opens, closes) * (1 - rng.uniform(0, volatility, days))
+    volumes = rng.integers(100000, 10000000, days).astype(float)
+
+    return pandas.DataFrame({"Open": opens, "High": highs, "Low": lows, "Close": closes, "Volume": volumes}, \
+        index=dates)
+
+# Returns a NumpyModel shaped like training.buildModel's models with random weights, for timing without training
+def makeRandomModel() -> NumpyModel:
+    rng = numpy.random.default_rng(seed)
+    layers = []
+    inputSize = 1
+    for i, (units, dropout) in enumerate(modelconfig.lstmLayers):
+        layers.append({
+            "type": "LSTM",
+            "kernel": rng.normal(0, 0.1, (inputSize, units * 4)).astype(numpy.float32),
+            "recurrentKernel": rng.normal(0, 0.1, (units, units * 4)).astype(numpy.float32),
+            "bias": numpy.zeros(units * 4, dtype=numpy.float32),
+            "activation": "tanh",
+            "recurrentActivation": "sigmoid",
+            "returnSequences": i < len(modelconfig.lstmLayers) - 1
+        })
+        inputSize = units
+    layers.append({
+        "type": "Dense",
+        "kernel": rng.normal(0, 0.1, (inputSize, 1)).astype(numpy.float32),
+        "bias": numpy.zeros(1, dtype=numpy.float32),
+        "activation": "linear"
+    })
+    return NumpyModel(layers)
+
+# Returns {"median", "min"} seconds of running function repeats times
+def timeStage(function: Callable, repeatCount: int = repeats) -> dict[str, float]:
+    times = []
+    for i in range(repeatCount):
+        startTime = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - startTime)
+    return {"median": statistics.median(times), "min": min(times)}
+
+# Returns (model, {stage: times}) after training a model on data for trainEpochs epochs
+def benchmarkTraining(data: pandas.DataFrame, timesteps: int) -> tuple[object, dict]:
+    import keras
+    import training
+    from sklearn.preprocessing import MinMaxScaler
+
+    trainData = modelconfig.getTrainingData(data)
+    scaled = MinMaxScaler(feature_range=(0, 1)).fit_transform(trainData[["Close"]])
+    (xTrain, yTrain) = trainingWindows(scaled[:, 0], timesteps)
+
+    keras.backend.clear_session()
+    model = training.buildModel(timesteps)
+
+    results = {}
+    results["trainFirstEpoch"] = timeStage(lambda: model.fit(xTrain, yTrain, epochs=1, \
+        batch_size=modelconfig.batchSize, verbose=0), 1)
+    if trainEpochs > 1:
+        epochTimes = timeStage(lambda: model.fit(xTrain, yTrain, epochs=1, batch_size=modelconfig.batchSize, \
+            verbose=0), trainEpochs - 1)
+        results["trainEpoch"] = epochTimes
+
+    testData = data[-historyDays:]
+    results["predictPricesKeras"] = timeStage(lambda: predictPrices(model, testData, timesteps))
+
+    return (model, results)
+
+def benchmarkScale(years: int, symbolCount: int, timesteps: int, train: bool) -> dict:
+    days = years * 252
+    symbols = ["SYN" + str(i) for i in range(symbolCount)]
+    data = {symbol: makeSyntheticData(i, days) for i, symbol in enumerate(symbols)}
+    firstData = data[symbols[0]]
+    closes = firstData["Close"].values
+
+    results = {}
+
+    # Windowing, including copying the windows like model.fit does
+    results["windowing"] = timeStage(lambda: numpy.ascontiguousarray(trainingWindows(closes, timesteps)[0]))
+
+    if train:
+        (kerasModel, trainingResults) = benchmarkTraining(firstData, timesteps)
+        results.update(trainingResults)
+        model = NumpyModel.fromModel(kerasModel)
+    else:
+        model = makeRandomModel()
+
+    testData = firstData[-historyDays:]
+    results["predictPrices"] = timeStage(lambda: predictPrices(model, testData, timesteps))
+
+    # Change series over the testing part of the data, like testing.getPredictedChangesAndRealPrices
+    trainingLength = int(days * modelconfig.trainingRatio)
+    testingData = firstData[trainingLength - timesteps:]
+    results["getChanges"] = timeStage(lambda: getChanges(model, testingData, timesteps, timesteps, \
+        len(testingData) - 1), 1)
+
+    sampleDays = range(timesteps + 2, min(timesteps + 2 + getChangeDays, len(testingData)))
+    getChangeTimes = timeStage(lambda: [getChange(model, testingData[:i], timesteps) for i in sampleDays], 1)
+    results["getChangePerDay"] = {name: value / max(len(sampleDays), 1) for name, value in getChangeTimes.items()}
+
+    # Backtest on random changes so every symbol doesn't need a model
+    rng = numpy.random.default_rng(seed)
+    testDays = days - trainingLength
+    predictedChanges = {symbol: rng.normal(0, 0.01, testDays).tolist() for symbol in symbols}
+    realPrices = {symbol: data[symbol]["Close"].values[trainingLength:] for symbol in symbols}
+    results["testModel"] = timeStage(lambda: BacktestRun(symbols, predictedChanges, realPrices).run(), 1)
+    results["testModelVectorized"] = timeStage( \
+        lambda: BacktestRun(symbols, predictedChanges, realPrices, vectorized=True).run())
+
+    dayChanges = [{symbol: predictedChanges[symbol][i] for symbol in symbols} for i in range(testDays)]
+    listTimes = timeStage(lambda: [generateBuyAndSellLists(changes, True) for changes in dayChanges], 1)
+    results["generateBuyAndSellListsPerDay"] = {name: value / max(testDays, 1) for name, value in listTimes.items()}
+
+    return results
+
+def benchmark(scaleList: list[dict] = scales, train: bool = True) -> dict:
+    results = {
+        "time": str(pandas.Timestamp.now()),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "train": train,
+        "scales": []
+    }
+
+    for scale in scaleList:
+        print("Benchmarking", scale, "...")
+        startTime = time.perf_counter()
+        stages = benchmarkScale(scale["years"], scale["symbols"], scale["timesteps"], train)
+        results["scales"].append({**scale, "stages": stages, "totalTime": time.perf_counter() - startTime})
+
+        for stage, times in stages.items():
+            print("\t" + stage.ljust(32), str(round(times["median"] * 1000, 3)).rjust(12), "ms")
+
+    return results
+
+if __name__ == "__main__":
+    scaleList = scales[:1] if "quick" in sys.argv else scales
+    results = benchmark(scaleList, "notrain" not in sys.argv)
+
+    with open(resultsPath, "w") as file:
+        json.dump(results, file, indent=4)
+    print("Results saved to", resultsPath)
@@ -0,0 +1,224 @@
+from __future__ import annotations
+import heapq
+from collections import deque
+from typing import Iterator
+import numpy
+import pandas
+
+import pricestore
+from backtest import TestResults
+from metrics import RunningMetrics
+from portfolio import Portfolio
+from predicting import getChange, historyDays
+from trading import generateBuyAndSellLists
+
+# Event driven backtest on intraday bars. Bars are read from the price store's memory maps in chunks and merged across
+# symbols in time order, so only one chunk per symbol is in memory no matter how many years are tested.
+# Orders are filled by later bars instead of straight away, and buys are only sent sellBuyGap after sells, like
+# dailyTrade's wait between selling and buying
+
+chunkSize = 100000 # Bars read from the price store at a time for each symbol
+
+fillDelay = pandas.Timedelta(minutes=1) # How long after being sent an order is filled
+sellBuyGap = pandas.Timedelta(minutes=10) # How long after the sell orders the buy orders are sent
+decisionInterval = pandas.Timedelta(days=1) # How often the strategy decides what to hold
+
+# Yields (time, price) for each of symbol's bars from start up to end, with time in nanoseconds
+def streamBars(symbol: str, start: pandas.Timestamp, end: pandas.Timestamp, interval: str = "1m", \
+    column: str = "Close") -> Iterator[tuple[int, float]]:
+    meta = pricestore.loadMeta(symbol, interval)
+    arrays = pricestore.loadArrays(symbol, interval, meta) if meta is not None else None
+    if meta is None or arrays is None:
+        return
+    (dates, values) = arrays
+    columnIndex = meta["columns"].index(column)
+
+    startIndex = int(numpy.searchsorted(dates, pandas.Timestamp(start).value, side="left"))
+    endIndex = int(numpy.searchsorted(dates, pandas.Timestamp(end).value, side="left"))
+
+    for chunkStart in range(startIndex, endIndex, chunkSize):
+        chunkStop = min(chunkStart + chunkSize, endIndex)
+
+        # Only this chunk is read from disk
+        chunkDates = numpy.array(dates[chunkStart:chunkStop])
+        chunkPrices = numpy.array(values[chunkStart:chunkStop, columnIndex])
+        keep = ~numpy.isnan(chunkPrices)
+        yield from zip(chunkDates[keep].tolist(), chunkPrices[keep].tolist())
+
+def tagBars(column: int, bars: Iterator[tuple[int, float]]) -> Iterator[tuple[int, int, float]]:
+    for (time, price) in bars:
+        yield (time, column, price)
+
+# Yields (time, column, price) for every symbol's bars in time order, where column is the symbol's index in symbols
+def streamEvents(symbols: list[str], start: pandas.Timestamp, end: pandas.Timestamp, interval: str = "1m") \
+    -> Iterator[tuple[int, int, float]]:
+    streams = [tagBars(column, streamBars(symbol, start, end, interval)) for column, symbol in enumerate(symbols)]
+    return heapq.merge(*streams)
+
+# Strategies are told about every bar with onBar, and decide returns {symbol: expected change} like getChange,
+# or None to hold
+
+# Predicts each symbol's change with its model from the last historyBars closes
+class ModelStrategy:
+    def __init__(self, symbols: list[str], models: dict, timesteps: int = 40, historyBars: int = historyDays):
+        self.symbols = symbols
+        self.models = models # Key: symbol, Value: model
+        self.timesteps = timesteps
+        self.history = [deque(maxlen=historyBars) for symbol in symbols]
+
+    def onBar(self, time: int, column: int, price: float) -> None:
+        self.history[column].append(price)
+
+    def decide(self, time: int, prices: numpy.ndarray) -> dict[str, float] | None:
+        changes = {}
+        for column, symbol in enumerate(self.symbols):
+            if len(self.history[column]) < self.timesteps + 2:
+                continue
+            data = pandas.DataFrame({"Close": list(self.history[column])})
+            change = getChange(self.models[symbol], data, self.timesteps)
+            if change is not None:
+                changes[symbol] = change
+        return changes
+
+# Expects each symbol to keep moving the way it moved over the last lookback bars. Doesn't need a model, so it's
+# useful for testing the backtest itself
+class MomentumStrategy:
+    def __init__(self, symbols: list[str], lookback: int = 60):
+        self.symbols = symbols
+        self.history = [deque(maxlen=lookback) for symbol in symbols]
+
+    def onBar(self, time: int, column: int, price: float) -> None:
+        self.history[column].append(price)
+
+    def decide(self, time: int, prices: numpy.ndarray) -> dict[str, float] | None:
+        return {symbol: self.history[column][-1] / self.history[column][0] - 1 \
+            for column, symbol in enumerate(self.symbols) if len(self.history[column]) > 1}
+
+class IntradayBacktest:
+    def __init__(self, symbols: list[str], strategy, startingMoney: float = 100.0, \
+        fillDelay: pandas.Timedelta = fillDelay, sellBuyGap: pandas.Timedelta = sellBuyGap, \
+        decisionInterval: pandas.Timedelta = decisionInterval):
+        self.symbols = list(symbols)
+        self.strategy = strategy
+        self.startingMoney = startingMoney
+        self.fillDelay = pandas.Timedelta(fillDelay).value
+        self.sellBuyGap = pandas.Timedelta(sellBuyGap).value
+        self.decisionInterval = pandas.Timedelta(decisionInterval).value
+
+        self.portfolio = Portfolio(self.symbols, startingMoney)
+        self.prices = numpy.full(len(self.symbols), numpy.nan) # Last price of each symbol
+        self.orders = [deque() for symbol in self.symbols] # Each symbol's (fillTime, shares) orders, negative to sell
+        self.nextDecision = None
+        self.day = None
+
+        # One entry per day
+        self.netWorth: list[float] = []
+        self.holdings: list[numpy.ndarray] = []
+        self.metrics = RunningMetrics(self.symbols, startingMoney)
+
+        self.bars = 0
+        self.fills = 0
+
+    def fillOrders(self, time: int, column: int, price: float) -> None:
+        orders = self.orders[column]
+        while len(orders) > 0 and orders[0][0] <= time:
+            (fillTime, shares) = orders.popleft()
+            if shares < 0:
+                shares = min(-shares, self.portfolio.shares[column])
+                if shares > 0:
+                    self.portfolio.sell(column, shares, price)
+                    self.metrics.addTrade(column, -shares, price)
+                    self.fills += 1
+            else:
+                # Prices can move before buys are filled, so only buy what there's money for
+                shares = min(shares, max(self.portfolio.money, 0) / price)
+                if shares > 0:
+                    self.portfolio.buy(column, shares, price)
+                    self.metrics.addTrade(column, shares, price)
+                    self.fills += 1
+
+    # Sends orders to get to what the strategy wants, like dailyTrade does
+    def placeOrders(self, time: int, changes: dict[str, float]) -> None:
+        # Cancel orders that haven't been filled yet
+        for orders in self.orders:
+            orders.clear()
+
+        (buyList, sellList) = generateBuyAndSellLists(changes, True)
+        sellTime = time + self.fillDelay
+        buyTime = time + self.sellBuyGap + self.fillDelay
+
+        for symbol in sellList:
+            column = self.portfolio.columns[symbol]
+            if self.portfolio.shares[column] > 0:
+                self.orders[column].append((sellTime, -self.portfolio.shares[column]))
+
+        equity = self.portfolio.getEquity(self.prices)
+        for symbol, percentage in buyList.items():
+            column = self.portfolio.columns[symbol]
+            adjustment = percentage * equity / self.prices[column] - self.portfolio.shares[column]
+            if adjustment < 0:
+                self.orders[column].append((sellTime, adjustment))
+            elif adjustment > 0:
+                self.orders[column].append((buyTime, adjustment))
+
+    # Records the equity and holdings at the end of each day
+    def recordDay(self) -> None:
+        prices = numpy.nan_to_num(self.prices)
+        equity = self.portfolio.getEquity(prices)
+        self.netWorth.append(equity)
+        self.holdings.append(numpy.append(self.portfolio.getHoldingValues(prices), self.portfolio.money))
+        self.metrics.update(equity, prices, self.portfolio.shares)
+
+    def onEvent(self, time: int, column: int, price: float) -> None:
+        self.bars += 1
+
+        day = time // (24 * 3600 * 10 ** 9)
+        if self.day is not None and day != self.day:
+            self.recordDay()
+        self.day = day
+
+        self.fillOrders(time, column, price)
+        self.prices[column] = price
+        self.strategy.onBar(time, column, price)
+
+        if self.nextDecision is None or time >= self.nextDecision:
+            # Wait until every symbol has a price
+            if numpy.isnan(self.prices).any():
+                return
+
+            changes = self.strategy.decide(time, self.prices)
+            if changes is not None:
+                self.placeOrders(time, changes)
+            self.nextDecision = (time // self.decisionInterval + 1) * self.decisionInterval
+
+    def run(self, events: Iterator[tuple[int, int, float]]) -> TestResults:
+        for (time, column, price) in events:
+            self.onEvent(time, column, price)
+
+        if self.day is not None:
+            self.recordDay()
+
+        # Sell everything at the last prices
+        finalPrices = numpy.nan_to_num(self.prices)
+        self.portfolio.liquidate(finalPrices)
+        if len(self.netWorth) > 0:
+            self.metrics.update(self.portfolio.money, finalPrices, self.portfolio.shares)
+
+        holdingValues = numpy.array(self.holdings).reshape(-1, len(self.symbols) + 1)
+        holdings = {symbol: holdingValues[:, column].tolist() for column, symbol in enumerate(self.symbols)}
+        holdings["Money"] = holdingValues[:, -1].tolist()
+
+        return TestResults(float(self.portfolio.money), self.portfolio.getShares(), self.netWorth, \
+            self.portfolio.getProfitBySymbol(), holdings, self.portfolio.wins, self.portfolio.losses, self.metrics)
+
+# Backtests strategy on symbols' interval bars from start to end. Set download to get bars that aren't stored yet
+# first. Yahoo only has the last 30 days of 1m bars, so longer tests need bars that were stored over time
+def testIntraday(symbols: list[str], strategy, start: pandas.Timestamp, end: pandas.Timestamp, interval: str = "1m", \
+    download: bool = False, **kwargs) -> TestResults:
+    if download:
+        pricestore.updateMany(symbols, start, end, interval)
+
+    backtest = IntradayBacktest(symbols, strategy, **kwargs)
+    results = backtest.run(streamEvents(symbols, start, end, interval))
+    print("Bars:", backtest.bars, "Fills:", backtest.fills, "Days:", len(results.netWorth))
+    return results
@@ -5,11 +5,13 @@ import sys
 sys.path.append('../AlgoTrader')
 from sheets import log
 from api import startStreamProcess
-from discordbot import startBot
 from exitflag import exitFlag
 
 
 def main():
+    # Imported here so worker processes that re-import this module don't have to import discord
+    from discordbot import startBot
+
     log("Starting main process...")
     botThread = startBot(exitFlag)
     startStreamProcess()
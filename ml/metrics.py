@@ -0,0 +1,241 @@
+from __future__ import annotations
+import json
+import math
+import os
+import numpy
+import pandas
+
+# Performance and risk metrics that are updated one bar at a time, so they can be read at any point of a backtest or
+# live run without going back over the whole equity history
+
+periodsPerYear = 252 # Bars per year, for annualizing Sharpe and Sortino
+riskFreeRate = 0.0 # Per year
+
+# Live equity snapshots are added to the metrics saved here, so they carry over between runs
+liveMetricsPath = "livemetrics.json"
+
+class RunningMetrics:
+    __slots__ = ("symbols", "startingEquity", "equity", "peak", "maxDrawdown", "count", "mean", "m2", \
+        "downsideSquares", "turnover", "exposure", "bars", "shares", "prices", "attribution", "tradeShares", \
+        "tradeValues")
+
+    def __init__(self, symbols: list[str] | None = None, startingEquity: float | None = None):
+        self.symbols = list(symbols or [])
+        self.startingEquity = startingEquity
+        self.equity = startingEquity # Equity at the last bar
+        self.peak = startingEquity if startingEquity is not None else 0.0
+        self.maxDrawdown = 0.0
+
+        # Mean and sum of squared differences from the mean of every bar's return, updated with Welford's algorithm
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.downsideSquares = 0.0 # Sum of squared returns below the risk free rate, for Sortino
+
+        # Sums of each bar's value traded / equity and value held / equity, over bars that had holdings
+        self.turnover = 0.0
+        self.exposure = 0.0
+        self.bars = 0
+
+        # Holdings at the last bar, and the profit from each symbol's price changes so far
+        self.shares = numpy.zeros(len(self.symbols))
+        self.prices: numpy.ndarray | None = None
+        self.attribution = numpy.zeros(len(self.symbols))
+
+        # Shares and value traded since the last bar by addTrade
+        self.tradeShares = numpy.zeros(len(self.symbols))
+        self.tradeValues = numpy.zeros(len(self.symbols))
+
+    # Records a trade between bars at a different price than the bar's, so attribution counts the profit from the
+    # price it was actually traded at. shares is negative for sells
+    def addTrade(self, column: int, shares: float, price: float) -> None:
+        self.tradeShares[column] += shares
+        self.tradeValues[column] += shares * price
+
+    # Adds one bar. prices and shares are each symbol's price and shares held after the bar's trades
+    def update(self, equity: float, prices: numpy.ndarray | None = None, shares: numpy.ndarray | None = None) -> None:
+        equity = float(equity)
+
+        if self.equity is not None and self.equity != 0:
+            periodReturn = equity / self.equity - 1
+            self.count += 1
+            delta = periodReturn - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (periodReturn - self.mean)
+            self.downsideSquares += min(periodReturn - riskFreeRate / periodsPerYear, 0) ** 2
+
+        if self.startingEquity is None:
+            self.startingEquity = equity
+            self.peak = equity
+        self.equity = equity
+
+        self.peak = max(self.peak, equity)
+        if self.peak > 0:
+            self.maxDrawdown = max(self.maxDrawdown, 1 - equity / self.peak)
+
+        if prices is not None and shares is not None:
+            prices = numpy.asarray(prices, dtype=float)
+            shares = numpy.asarray(shares, dtype=float)
+
+            if self.prices is not None:
+                self.attribution += self.shares * (prices - self.prices)
+            self.attribution += self.tradeShares * prices - self.tradeValues
+            self.tradeShares[:] = 0
+            self.tradeValues[:] = 0
+            if equity > 0:
+                self.turnover += float(numpy.abs(shares - self.shares) @ prices) / equity
+                self.exposure += float(numpy.abs(shares) @ prices) / equity
+            self.bars += 1
+
+            self.shares = shares.copy()
+            self.prices = prices.copy()
+
+    # Same as calling update for each row, but with array operations. equity is (bars), prices and shares are
+    # (bars x symbols)
+    def updateMany(self, equity: numpy.ndarray, prices: numpy.ndarray | None = None, \
+        shares: numpy.ndarray | None = None) -> None:
+        equity = numpy.asarray(equity, dtype=float)
+        if len(equity) == 0:
+            return
+
+        if self.startingEquity is None:
+            self.startingEquity = float(equity[0])
+            self.peak = float(equity[0])
+            previous = equity
+        else:
+            previous = numpy.concatenate([[self.equity], equity])
+
+        # Returns, skipping bars that start from 0 equity
+        starts = previous[:-1]
+        returns = numpy.divide(previous[1:], starts, out=numpy.ones(len(starts)), where=starts != 0)[starts != 0] - 1
+        if len(returns) > 0:
+            # Combine this batch's mean and m2 with the running ones
+            batchMean = float(returns.mean())
+            batchM2 = float(((returns - batchMean) ** 2).sum())
+            total = self.count + len(returns)
+            delta = batchMean - self.mean
+            self.mean += delta * len(returns) / total
+            self.m2 += batchM2 + delta ** 2 * self.count * len(returns) / total
+            self.count = total
+            self.downsideSquares += float((numpy.minimum(returns - riskFreeRate / periodsPerYear, 0) ** 2).sum())
+
+        peaks = numpy.maximum.accumulate(numpy.concatenate([[self.peak], equity]))[1:]
+        drawdowns = numpy.divide(equity, peaks, out=numpy.ones(len(equity)), where=peaks > 0)
+        self.maxDrawdown = max(self.maxDrawdown, float(1 - drawdowns.min()))
+        self.peak = float(peaks[-1])
+        self.equity = float(equity[-1])
+
+        if prices is not None and shares is not None:
+            prices = numpy.asarray(prices, dtype=float).reshape(len(equity), -1)
+            shares = numpy.asarray(shares, dtype=float).reshape(len(equity), -1)
+
+            allShares = numpy.vstack([self.shares, shares])
+            allPrices = numpy.vstack([self.prices if self.prices is not None else prices[0], prices])
+            self.attribution += (allShares[:-1] * numpy.diff(allPrices, axis=0)).sum(axis=0)
+            self.attribution += self.tradeShares * prices[0] - self.tradeValues
+            self.tradeShares[:] = 0
+            self.tradeValues[:] = 0
+
+            traded = (numpy.abs(numpy.diff(allShares, axis=0)) * prices).sum(axis=1)
+            held = (numpy.abs(shares) * prices).sum(axis=1)
+            positive = equity > 0
+            self.turnover += float((traded[positive] / equity[positive]).sum())
+            self.exposure += float((held[positive] / equity[positive]).sum())
+            self.bars += len(equity)
+
+            self.shares = shares[-1].copy()
+            self.prices = prices[-1].copy()
+
+    def getTotalReturn(self) -> float:
+        if self.startingEquity is None or self.startingEquity == 0:
+            return 0.0
+        return self.equity / self.startingEquity - 1
+
+    def getVolatility(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def getSharpe(self) -> float:
+        volatility = self.getVolatility()
+        if volatility == 0:
+            return 0.0
+        return (self.mean - riskFreeRate / periodsPerYear) / volatility * math.sqrt(periodsPerYear)
+
+    def getSortino(self) -> float:
+        if self.count == 0 or self.downsideSquares == 0:
+            return 0.0
+        downsideDeviation = math.sqrt(self.downsideSquares / self.count)
+        return (self.mean - riskFreeRate / periodsPerYear) / downsideDeviation * math.sqrt(periodsPerYear)
+
+    # Average value traded per bar, as a % of equity
+    def getTurnover(self) -> float:
+        return self.turnover / self.bars if self.bars > 0 else 0.0
+
+    # Average value held per bar, as a % of equity
+    def getExposure(self) -> float:
+        return self.exposure / self.bars if self.bars > 0 else 0.0
+
+    # Key: symbol, Value: profit from that symbol's price changes
+    def getAttribution(self) -> dict[str, float]:
+        return {symbol: float(self.attribution[column]) for column, symbol in enumerate(self.symbols)}
+
+    def getSummary(self) -> dict:
+        return {
+            "equity": self.equity,
+            "totalReturn": self.getTotalReturn(),
+            "sharpe": self.getSharpe(),
+            "sortino": self.getSortino(),
+            "volatility": self.getVolatility(),
+            "maxDrawdown": self.maxDrawdown,
+            "turnover": self.getTurnover(),
+            "exposure": self.getExposure(),
+            "bars": self.count
+        }
+
+    def toDict(self) -> dict:
+        values = {name: getattr(self, name) for name in self.__slots__}
+        for name in ["shares", "prices", "attribution", "tradeShares", "tradeValues"]:
+            values[name] = values[name].tolist() if values[name] is not None else None
+        return values
+
+    @staticmethod
+    def fromDict(values: dict) -> RunningMetrics:
+        metrics = RunningMetrics(values["symbols"])
+        for name in RunningMetrics.__slots__:
+            if name in values: # Files saved by older versions can be missing newer values
+                setattr(metrics, name, values[name])
+        for name in ["shares", "prices", "attribution", "tradeShares", "tradeValues"]:
+            if values.get(name) is not None:
+                setattr(metrics, name, numpy.array(values[name], dtype=float))
+        return metrics
+
+def formatSummary(summary: dict) -> str:
+    return "Return: " + str(round(summary["totalReturn"] * 100, 2)) + "%, Sharpe: " + \
+        str(round(summary["sharpe"], 2)) + ", Sortino: " + str(round(summary["sortino"], 2)) + ", Max Drawdown: " + \
+        str(round(summary["maxDrawdown"] * 100, 2)) + "%, Turnover: " + str(round(summary["turnover"] * 100, 2)) + \
+        "%, Exposure: " + str(round(summary["exposure"] * 100, 2)) + "%"
+
+def loadLiveMetrics() -> tuple[RunningMetrics, str | None]:
+    try:
+        with open(liveMetricsPath, "r") as file:
+            saved = json.load(file)
+        return (RunningMetrics.fromDict(saved["metrics"]), saved["lastDate"])
+    except (OSError, ValueError, KeyError):
+        return (RunningMetrics(), None)
+
+def saveLiveMetrics(metrics: RunningMetrics, lastDate: str) -> None:
+    tempPath = liveMetricsPath + "." + str(os.getpid()) + ".tmp"
+    with open(tempPath, "w") as file:
+        json.dump({"metrics": metrics.toDict(), "lastDate": lastDate}, file)
+    os.replace(tempPath, liveMetricsPath)
+
+# Adds today's account equity to the live metrics and returns their summary. Only the first snapshot each day is
+# added, so restarting doesn't count the same day twice
+def recordLiveEquity(equity: float, date: pandas.Timestamp | None = None) -> dict:
+    date = str((pandas.Timestamp.today() if date is None else pandas.Timestamp(date)).date())
+    (metrics, lastDate) = loadLiveMetrics()
+
+    if lastDate != date:
+        metrics.update(equity)
+        saveLiveMetrics(metrics, date)
+
+    return metrics.getSummary()
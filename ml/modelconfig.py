@@ -0,0 +1,24 @@
+import pandas
+
+# Settings for the models built in training.py. Kept separate so code that only loads trained models doesn't have
+# to import Keras
+
+epochs = 100 # Most epochs to train for. Training usually stops earlier, see trainingcontrol
+fineTuneEpochs = 5 # Epochs to run when fine tuning an already trained model on new data
+batchSize = 32
+trainingRatio = 0.8 # What % of data to use for training
+
+# (units, dropout) for each LSTM layer
+lstmLayers = [(50, 0.2), (50, 0.2), (50, 0.2)]
+
+# Describes the layers training.buildModel creates, so saved models can be matched to the code that built them
+def getArchitecture() -> str:
+    layers = []
+    for (units, dropout) in lstmLayers:
+        layers.append("LSTM" + str(units))
+        layers.append("Dropout" + str(dropout))
+    layers.append("Dense1")
+    return ",".join(layers)
+
+def getTrainingData(data: pandas.DataFrame) -> pandas.DataFrame:
+    return data[:int(len(data) * trainingRatio)]
@@ -0,0 +1,271 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from typing import TYPE_CHECKING
+import pandas
+
+import modelconfig
+import trainingcontrol
+from numpymodel import NumpyModel
+from sheets import log
+
+# training imports Keras, so it's only imported once a model actually has to be trained or loaded into Keras
+if TYPE_CHECKING:
+    from keras import Sequential
+    from sklearn.preprocessing import MinMaxScaler
+
+# Trained models are saved here, one folder per model
+registryPath = "modelregistry"
+
+# Least recently used models are deleted once the registry is bigger than this or they haven't been used in this long
+maxRegistryBytes = 2 * 1024 ** 3
+maxModelAgeDays = 30
+
+# When enabled, a symbol's latest model is fine tuned on new rows instead of training a new model from scratch.
+# Models are still fully retrained once their last full training is fullRetrainDays old
+incrementalTraining = True
+fullRetrainDays = 7
+
+# Predict with the NumPy copy of each model instead of Keras. See numpymodel.py
+numpyInference = True
+
+weightsFile = "model.weights.h5"
+numpyFile = "model.npz"
+scalerFile = "scaler.pkl"
+metaFile = "meta.json"
+
+# Wraps a model in the registry. The model and scaler are only loaded from disk the first time they're used
+class ModelHandle:
+    def __init__(self, key: str, meta: dict, model: Sequential | None = None, scaler: MinMaxScaler | None = None):
+        self.key = key
+        self.meta = meta
+        self.path = getEntryPath(key)
+        self._model = model
+        self._numpyModel = None
+        self._scaler = scaler
+
+    @property
+    def model(self) -> Sequential:
+        if self._model is None:
+            import training
+            model = training.buildModel(self.meta["timesteps"])
+            model.load_weights(os.path.join(self.path, weightsFile))
+            self._model = model
+        return self._model
+
+    @property
+    def numpyModel(self) -> NumpyModel:
+        if self._numpyModel is None:
+            path = os.path.join(self.path, numpyFile)
+            if os.path.exists(path):
+                self._numpyModel = NumpyModel.load(path)
+            else:
+                # Saved before models were exported to NumPy
+                self._numpyModel = NumpyModel.fromModel(self.model)
+        return self._numpyModel
+
+    # The model to predict with
+    @property
+    def predictor(self) -> Sequential | NumpyModel:
+        return self.numpyModel if numpyInference else self.model
+
+    @property
+    def scaler(self) -> MinMaxScaler:
+        if self._scaler is None:
+            with open(os.path.join(self.path, scalerFile), "rb") as file:
+                self._scaler = pickle.load(file)
+        return self._scaler
+
+# Returns a hash of the values and dates in data
+def hashData(data: pandas.DataFrame) -> str:
+    hash = hashlib.sha256()
+    hash.update(",".join(str(column) for column in data.columns).encode())
+    hash.update(pandas.util.hash_pandas_object(data, index=True).values.tobytes())
+    return hash.hexdigest()
+
+# Models are keyed by everything that changes the trained weights. maxEpochs is the most epochs the model is trained
+# for, see trainingcontrol.getMaxEpochs, and defaults to modelconfig.epochs
+def getKey(symbol: str, trainData: pandas.DataFrame, timesteps: int, maxEpochs: int | None = None) -> str:
+    if maxEpochs is None:
+        maxEpochs = modelconfig.epochs
+    keyData = json.dumps([symbol, hashData(trainData), timesteps, modelconfig.getArchitecture(), maxEpochs, \
+        trainingcontrol.getSettings()])
+    return symbol.replace("/", "-") + "-" + hashlib.sha256(keyData.encode()).hexdigest()[:16]
+
+def getEntryPath(key: str) -> str:
+    return os.path.join(registryPath, key)
+
+def loadModel(key: str) -> ModelHandle | None:
+    path = os.path.join(getEntryPath(key), metaFile)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r") as file:
+            meta = json.load(file)
+    except (OSError, ValueError) as e:
+        log("Error reading model " + key + " from registry: " + str(e))
+        return None
+
+    # Mark as recently used
+    os.utime(path)
+
+    return ModelHandle(key, meta)
+
+def saveModel(key: str, model: Sequential, scaler: MinMaxScaler, meta: dict) -> ModelHandle:
+    path = getEntryPath(key)
+
+    # Write to a temporary folder first so other processes never see a half-written model
+    tempPath = path + "-" + str(os.getpid()) + ".tmp"
+    os.makedirs(tempPath, exist_ok=True)
+    model.save_weights(os.path.join(tempPath, weightsFile))
+    NumpyModel.fromModel(model).save(os.path.join(tempPath, numpyFile))
+    with open(os.path.join(tempPath, scalerFile), "wb") as file:
+        pickle.dump(scaler, file)
+    with open(os.path.join(tempPath, metaFile), "w") as file:
+        json.dump(meta, file)
+
+    try:
+        os.replace(tempPath, path)
+    except OSError:
+        # Another process saved the same model first
+        shutil.rmtree(tempPath, ignore_errors=True)
+
+    return ModelHandle(key, meta, model, scaler)
+
+def getEntrySize(path: str) -> int:
+    size = 0
+    for file in os.listdir(path):
+        size += os.path.getsize(os.path.join(path, file))
+    return size
+
+# Deletes models that are too old, then the least recently used models until the registry fits in maxRegistryBytes
+def evict() -> None:
+    if not os.path.isdir(registryPath):
+        return
+
+    entries = [] # (lastUsed, size, path)
+    for key in os.listdir(registryPath):
+        path = getEntryPath(key)
+        metaPath = os.path.join(path, metaFile)
+        if not os.path.exists(metaPath):
+            continue
+        entries.append((os.path.getmtime(metaPath), getEntrySize(path), path))
+
+    entries.sort()
+    totalSize = sum(entry[1] for entry in entries)
+    oldest = time.time() - maxModelAgeDays * 24 * 60 * 60
+    for (lastUsed, size, path) in entries:
+        if lastUsed >= oldest and totalSize <= maxRegistryBytes:
+            break
+
+        log("Evicting model " + os.path.basename(path) + " from registry...")
+        shutil.rmtree(path, ignore_errors=True)
+        totalSize -= size
+
+# Returns the most recent model for symbol that was built with the current architecture and timesteps
+def findLatestModel(symbol: str, timesteps: int) -> ModelHandle | None:
+    if not os.path.isdir(registryPath):
+        return None
+
+    latest = None
+    for key in os.listdir(registryPath):
+        path = os.path.join(getEntryPath(key), metaFile)
+        if not os.path.exists(path):
+            continue
+
+        try:
+            with open(path, "r") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            continue
+
+        if meta["symbol"] != symbol or meta["timesteps"] != timesteps \
+            or meta["architecture"] != modelconfig.getArchitecture():
+            continue
+
+        if latest is None or pandas.Timestamp(meta["dataEnd"]) > pandas.Timestamp(latest.meta["dataEnd"]):
+            latest = ModelHandle(key, meta)
+
+    return latest
+
+# Returns how many rows at the end of trainData came after previous was trained, or None if previous can't be fine tuned
+def getNewRows(previous: ModelHandle, trainData: pandas.DataFrame, timesteps: int) -> int | None:
+    # Fully retrain every fullRetrainDays
+    if time.time() - previous.meta.get("fullTrainTime", 0) >= fullRetrainDays * 24 * 60 * 60:
+        return None
+
+    # The new data has to continue on from the data previous was trained on
+    dataEnd = pandas.Timestamp(previous.meta["dataEnd"])
+    if dataEnd not in trainData.index:
+        return None
+
+    newRows = int((trainData.index > dataEnd).sum())
+    if newRows == 0 or newRows + timesteps > len(trainData):
+        return None
+
+    return newRows
+
+# Returns the model trained on data, only training it if it isn't in the registry already.
+# If incremental is true and the symbol has a recent model, that model is fine tuned on the new rows instead.
+# Otherwise the model is trained reproducibly, see training.trainWithScaler
+def getModel(data: pandas.DataFrame, timesteps: int = 40, label: str = "Unknown", \
+    incremental: bool | None = None) -> ModelHandle | None:
+    if incremental is None:
+        incremental = incrementalTraining
+
+    trainData = modelconfig.getTrainingData(data)
+    maxEpochs = trainingcontrol.getMaxEpochs(label, modelconfig.epochs, not incremental)
+    key = getKey(label, trainData, timesteps, maxEpochs)
+
+    handle = loadModel(key)
+    if handle is not None:
+        log("Using saved model " + key + " for " + label + "!")
+        return handle
+
+    import training
+
+    startTime = time.time()
+    result = None
+    fullTrainTime = startTime
+
+    # Try to fine tune the previous model
+    if incremental:
+        previous = findLatestModel(label, timesteps)
+        newRows = getNewRows(previous, trainData, timesteps) if previous is not None else None
+        if newRows is not None:
+            log("Fine tuning saved model " + previous.key + " for " + label + "...")
+            model = training.fineTune(previous.model, previous.scaler, data, newRows, timesteps, label)
+            if model is not None:
+                result = (model, previous.scaler)
+                fullTrainTime = previous.meta["fullTrainTime"]
+
+    # Train from scratch
+    if result is None:
+        result = training.trainWithScaler(data, timesteps, label, not incremental)
+        if result is None:
+            return None
+    (model, scaler) = result
+
+    meta = {
+        "symbol": label,
+        "timesteps": timesteps,
+        "architecture": modelconfig.getArchitecture(),
+        "epochs": maxEpochs,
+        "dataHash": hashData(trainData),
+        "dataStart": str(trainData.index[0]),
+        "dataEnd": str(trainData.index[-1]),
+        "rows": len(trainData),
+        "created": time.time(),
+        "fullTrainTime": fullTrainTime,
+        "trainingTime": time.time() - startTime
+    }
+
+    handle = saveModel(key, model, scaler, meta)
+    evict()
+
+    return handle
@@ -0,0 +1,145 @@
+import json
+import numpy
+
+# Runs models built by training.buildModel with only NumPy, so processes that just predict don't need TensorFlow
+
+def sigmoid(x: numpy.ndarray) -> numpy.ndarray:
+    return 1 / (1 + numpy.exp(-x))
+
+def hardSigmoid(x: numpy.ndarray) -> numpy.ndarray:
+    return numpy.clip(x / 6 + 0.5, 0, 1)
+
+activations = {
+    "linear": lambda x: x,
+    "relu": lambda x: numpy.maximum(x, 0),
+    "tanh": numpy.tanh,
+    "sigmoid": sigmoid,
+    "hard_sigmoid": hardSigmoid
+}
+
+# Returns the weights and settings of each layer in a Sequential LSTM/Dropout/Dense model as plain NumPy arrays.
+# Dropout does nothing when predicting, so it's left out
+def exportLayers(model) -> list[dict]:
+    layers = []
+    for layer in model.layers:
+        layerType = layer.__class__.__name__
+        config = layer.get_config()
+
+        if layerType == "LSTM":
+            (kernel, recurrentKernel, bias) = layer.get_weights()
+            layers.append({
+                "type": "LSTM",
+                "kernel": kernel,
+                "recurrentKernel": recurrentKernel,
+                "bias": bias,
+                "activation": config["activation"],
+                "recurrentActivation": config["recurrent_activation"],
+                "returnSequences": config["return_sequences"]
+            })
+        elif layerType == "Dense":
+            (kernel, bias) = layer.get_weights()
+            layers.append({
+                "type": "Dense",
+                "kernel": kernel,
+                "bias": bias,
+                "activation": config["activation"]
+            })
+        elif layerType == "Dropout":
+            continue
+        else:
+            raise ValueError("Can't export layer of type " + layerType)
+
+    return layers
+
+def saveLayers(layers: list[dict], path: str) -> None:
+    arrays = {}
+    settings = []
+    for i, layer in enumerate(layers):
+        layerSettings = {}
+        for name, value in layer.items():
+            if isinstance(value, numpy.ndarray):
+                arrays[str(i) + "_" + name] = value
+            else:
+                layerSettings[name] = value
+        settings.append(layerSettings)
+
+    arrays["settings"] = numpy.array(json.dumps(settings))
+    with open(path, "wb") as file:
+        numpy.savez(file, **arrays)
+
+def loadLayers(path: str) -> list[dict]:
+    with numpy.load(path, allow_pickle=False) as arrays:
+        layers = json.loads(str(arrays["settings"]))
+        for i, layer in enumerate(layers):
+            for name in ("kernel", "recurrentKernel", "bias"):
+                key = str(i) + "_" + name
+                if key in arrays:
+                    layer[name] = arrays[key]
+    return layers
+
+class NumpyModel:
+    def __init__(self, layers: list[dict]):
+        self.layers = layers
+
+    @classmethod
+    def fromModel(cls, model) -> "NumpyModel":
+        return cls(exportLayers(model))
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyModel":
+        return cls(loadLayers(path))
+
+    def save(self, path: str) -> None:
+        saveLayers(self.layers, path)
+
+    # Same arguments as keras.Model.predict. Input is (samples, timesteps, features), output is (samples, 1)
+    def predict(self, x: numpy.ndarray, batch_size: int | None = None, verbose: int = 0) -> numpy.ndarray:
+        x = numpy.asarray(x, dtype=numpy.float32)
+        if batch_size is None:
+            batch_size = 4096
+
+        outputs = []
+        for start in range(0, len(x), batch_size):
+            outputs.append(self.forward(x[start:start + batch_size]))
+
+        if len(outputs) == 0:
+            return numpy.empty((0, self.layers[-1]["kernel"].shape[1]), dtype=numpy.float32)
+        return numpy.concatenate(outputs)
+
+    def forward(self, x: numpy.ndarray) -> numpy.ndarray:
+        for layer in self.layers:
+            if layer["type"] == "LSTM":
+                x = lstmForward(layer, x)
+            else:
+                x = activations[layer["activation"]](x @ layer["kernel"] + layer["bias"])
+        return x
+
+# Runs an LSTM layer over every sample at once. Keras stores the gates in the order input, forget, cell, output
+def lstmForward(layer: dict, x: numpy.ndarray) -> numpy.ndarray:
+    activation = activations[layer["activation"]]
+    recurrentActivation = activations[layer["recurrentActivation"]]
+    recurrentKernel = layer["recurrentKernel"]
+    units = recurrentKernel.shape[0]
+
+    # The input part of every gate doesn't depend on the previous step, so do it for all timesteps in one go
+    inputs = x @ layer["kernel"] + layer["bias"]
+
+    hidden = numpy.zeros((x.shape[0], units), dtype=numpy.float32)
+    cell = numpy.zeros((x.shape[0], units), dtype=numpy.float32)
+    sequence = []
+    for step in range(x.shape[1]):
+        gates = inputs[:, step] + hidden @ recurrentKernel
+        inputGate = recurrentActivation(gates[:, :units])
+        forgetGate = recurrentActivation(gates[:, units:2 * units])
+        cellGate = activation(gates[:, 2 * units:3 * units])
+        outputGate = recurrentActivation(gates[:, 3 * units:])
+
+        cell = forgetGate * cell + inputGate * cellGate
+        hidden = outputGate * activation(cell)
+
+        if layer["returnSequences"]:
+            sequence.append(hidden)
+
+    if layer["returnSequences"]:
+        return numpy.stack(sequence, axis=1)
+    return hidden
@@ -0,0 +1,177 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+
+from backtest import TestResults, runBacktestFromLists
+from metrics import RunningMetrics
+from trading import generateBuyAndSellLists
+import workerpool
+
+# Backtest state kept in objects instead of module globals, so any number of backtests can run at once in the same
+# process, in threads or in worker processes
+
+# Cash and shares for one backtest. Per-symbol values are arrays in the same order as symbols
+class Portfolio:
+    __slots__ = ("symbols", "columns", "money", "shares", "buyPrices", "profit", "traded", "wins", "losses")
+
+    def __init__(self, symbols: list[str], money: float = 100.0):
+        self.symbols = list(symbols)
+        self.columns = {symbol: column for column, symbol in enumerate(self.symbols)} # Key: symbol, Value: column
+        self.money = money
+        self.shares = numpy.zeros(len(self.symbols))
+        self.buyPrices = numpy.full(len(self.symbols), numpy.nan) # Weighted average price the held shares were bought at
+        self.profit = numpy.zeros(len(self.symbols))
+        self.traded = numpy.zeros(len(self.symbols), dtype=bool) # Whether each symbol has any profit recorded
+        self.wins = 0
+        self.losses = 0
+
+    def getEquity(self, prices: numpy.ndarray) -> float:
+        return self.money + float(self.shares @ prices)
+
+    def getHoldingValues(self, prices: numpy.ndarray) -> numpy.ndarray:
+        return self.shares * prices
+
+    def sell(self, column: int, shareCount: float, price: float) -> None:
+        priceDiff = price - self.buyPrices[column]
+        if priceDiff > 0:
+            self.wins += 1
+        elif priceDiff < 0:
+            self.losses += 1
+
+        self.profit[column] += shareCount * priceDiff
+        self.traded[column] = True
+        self.money += shareCount * price
+        self.shares[column] -= shareCount
+
+    def buy(self, column: int, shareCount: float, price: float) -> None:
+        held = self.shares[column]
+
+        # Generate buy price by weighted average
+        if numpy.isnan(self.buyPrices[column]) or held == 0 or shareCount + held == 0:
+            self.buyPrices[column] = price
+        else:
+            self.buyPrices[column] = (price * shareCount + self.buyPrices[column] * held) / (shareCount + held)
+
+        self.shares[column] += shareCount
+        self.money -= shareCount * price
+
+    # Trades to the holdings generateBuyAndSellLists wants for changes, like trading.dailyTrade does
+    def rebalance(self, changes: dict[str, float], prices: numpy.ndarray) -> None:
+        (buyList, sellList) = generateBuyAndSellLists(changes, True)
+
+        # Key: column, Value: number of shares
+        sells = {self.columns[symbol]: max(self.shares[self.columns[symbol]], 0) for symbol in sellList}
+        buys = {}
+
+        totalEquity = self.getEquity(prices)
+        for symbol, weight in buyList.items():
+            column = self.columns[symbol]
+            # Convert from % of total equity to shares
+            target = weight * totalEquity / prices[column]
+
+            if self.shares[column] <= target:
+                buys[column] = target - self.shares[column]
+            else:
+                sells[column] = self.shares[column] - target
+
+        for column, shareCount in sells.items():
+            if shareCount > 0:
+                self.sell(column, shareCount, prices[column])
+
+        for column, shareCount in buys.items():
+            if shareCount != 0:
+                self.buy(column, shareCount, prices[column])
+
+    # Sells everything at finalPrices
+    def liquidate(self, finalPrices: numpy.ndarray) -> None:
+        bought = ~numpy.isnan(self.buyPrices)
+        self.profit[bought] += self.shares[bought] * (finalPrices[bought] - self.buyPrices[bought])
+        self.traded |= bought
+        self.money += float(self.shares @ finalPrices)
+        self.shares[:] = 0
+
+    def getShares(self) -> dict[str, float]:
+        return {symbol: float(self.shares[column]) for column, symbol in enumerate(self.symbols)}
+
+    def getProfitBySymbol(self) -> dict[str, float]:
+        return {symbol: float(self.profit[column]) for column, symbol in enumerate(self.symbols) \
+            if self.traded[column]}
+
+# One backtest of predictedChanges against realPrices. Set vectorized to run it with backtest.runBacktest instead of
+# stepping through each day
+class BacktestRun:
+    __slots__ = ("symbols", "predictedChanges", "realPrices", "startingMoney", "vectorized", "portfolio", "netWorth", \
+        "holdings", "metrics")
+
+    def __init__(self, symbols: list[str], predictedChanges: dict[str, list[float]], \
+        realPrices: dict[str, list[float]], startingMoney: float = 100.0, vectorized: bool = False):
+        self.symbols = list(symbols)
+        self.predictedChanges = predictedChanges
+        self.realPrices = realPrices
+        self.startingMoney = startingMoney
+        self.vectorized = vectorized
+        self.portfolio = Portfolio(self.symbols, startingMoney)
+        self.netWorth: list[float] = []
+        self.holdings: list[numpy.ndarray] = [] # Value of each symbol's shares then money, each day
+        self.metrics = RunningMetrics(self.symbols, startingMoney) # Can be read while the backtest is running
+
+    def getPrices(self, i: int) -> numpy.ndarray:
+        return numpy.array([self.realPrices[symbol][i] for symbol in self.symbols], dtype=float)
+
+    # Trades day i
+    def step(self, i: int) -> None:
+        symbol = self.symbols[0]
+        if len(self.predictedChanges[symbol]) <= i + 1 or len(self.realPrices[symbol]) <= i + 1:
+            return
+
+        changes = {}
+        for symbol in self.symbols:
+            if len(self.predictedChanges[symbol]) <= i + 1 or len(self.realPrices[symbol]) <= i + 1:
+                continue
+            changes[symbol] = self.predictedChanges[symbol][i]
+
+        prices = self.getPrices(i)
+        self.portfolio.rebalance(changes, prices)
+
+        self.netWorth.append(self.portfolio.getEquity(prices))
+        self.holdings.append(numpy.append(self.portfolio.getHoldingValues(prices), self.portfolio.money))
+        self.metrics.update(self.netWorth[-1], prices, self.portfolio.shares)
+
+    def run(self) -> TestResults:
+        if self.vectorized:
+            return runBacktestFromLists(self.symbols, self.predictedChanges, self.realPrices, \
+                startingMoney=self.startingMoney)
+
+        for i in range(0, len(self.predictedChanges[self.symbols[0]]) - 1):
+            self.step(i)
+
+        finalPrices = numpy.array([self.realPrices[symbol][-1] for symbol in self.symbols], dtype=float)
+        self.portfolio.liquidate(finalPrices)
+        if len(self.netWorth) > 0:
+            self.metrics.update(self.portfolio.money, finalPrices, self.portfolio.shares)
+        return self.getResults()
+
+    def getResults(self) -> TestResults:
+        holdingValues = numpy.array(self.holdings).reshape(-1, len(self.symbols) + 1)
+        holdings = {symbol: holdingValues[:, column].tolist() for column, symbol in enumerate(self.symbols)}
+        holdings["Money"] = holdingValues[:, -1].tolist()
+
+        return TestResults(float(self.portfolio.money), self.portfolio.getShares(), self.netWorth, \
+            self.portfolio.getProfitBySymbol(), holdings, self.portfolio.wins, self.portfolio.losses, self.metrics)
+
+def runBacktestRun(run: BacktestRun) -> TestResults:
+    return run.run()
+
+# Runs every backtest in runs and returns their results in the same order. Threads are enough for vectorized runs,
+# which spend most of their time in NumPy. Set useProcesses to run each backtest in a worker process instead
+def runBacktests(runs: list[BacktestRun], workerCount: int = 4, useProcesses: bool = False) \
+    -> list[TestResults | None]:
+    if len(runs) == 0:
+        return []
+
+    if useProcesses:
+        results = workerpool.runPool(runBacktestRun, runs, workerCount)
+        return [results.get(run) for run in runs]
+
+    with ThreadPoolExecutor(max_workers=workerCount, thread_name_prefix="Backtest") as pool:
+        return list(pool.map(runBacktestRun, runs))
@@ -1,9 +1,20 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
 import numpy
 import pandas
-from keras import Sequential
-from sklearn.preprocessing import MinMaxScaler
+from windowing import slidingWindows
+
+# Models can be Keras models or NumpyModels, which both have the same predict method.
+# scikit-learn takes over a second to import, so it's only imported by predictPrices
+if TYPE_CHECKING:
+    from keras import Sequential
+    from sklearn.preprocessing import MinMaxScaler
+
+historyDays = 2 * 365 # How many days of history getChangeTuple predicts over
 
 def predictPrices(model: Sequential, data: pandas.DataFrame, timesteps: int = 40) -> numpy.ndarray:
+    from sklearn.preprocessing import MinMaxScaler
+
     datasetTotal = data["Close"]
     inputs = datasetTotal.values
 
@@ -11,25 +22,24 @@ def predictPrices(model: Sequential, data: pandas.DataFrame, timesteps: int = 40
     scaler = MinMaxScaler(feature_range=(0, 1))
     inputs = scaler.fit_transform(inputs)
 
-    xTest = [[0] * timesteps] * timesteps
-    for i in range(timesteps, len(inputs)):
-        xTest.append(inputs[i - timesteps:i, 0])
-
-    xTest = numpy.array(xTest)
-    xTest = numpy.reshape(xTest, (xTest.shape[0], xTest.shape[1], 1))
-
-    # xTest is a 3D array
+    # xTest is a 3D array of every window except the one ending on the last day
+    xTest = slidingWindows(inputs[:-1, 0], timesteps)
 
     # Predict
     # print("Predicting...")
-    predictedPrice = model.predict(xTest, verbose=0)
+    # The first timesteps predictions are for windows of all 0s, so predict one and repeat it instead of
+    # building the padding
+    padding = model.predict(numpy.zeros((1, timesteps, 1)), verbose=0)
+    predictedPrice = numpy.repeat(padding, timesteps, axis=0)
+    if len(xTest) > 0:
+        predictedPrice = numpy.concatenate([predictedPrice, model.predict(xTest, verbose=0)])
     predictedPrice = scaler.inverse_transform(predictedPrice)
 
     return predictedPrice
 
 # Returns (todayPrice, predictedPriceToday, predictedPriceTmr)
 def getChangeTuple(model: Sequential, data: pandas.DataFrame, timesteps: int = 40) -> tuple:
-    data = data[-(2 * 365):] # Only predict the last 2 years
+    data = data[-historyDays:] # Only predict the last 2 years
 
     predictions = predictPrices(model, data, timesteps)
     predictedPriceToday = predictions[-2][0] # It's possible this is actually yesterday's price
@@ -48,4 +58,51 @@ def getChange(model: Sequential, data: pandas.DataFrame, timesteps: int = 40) ->
         return diff
     except Exception as e:
         print("Error getting predicted prices: " + str(e))
-        return None
\ No newline at end of file
+        return None
+
+# Walk-forward version of getChange. Returns an array where element k is equal to
+# getChange(model, data[:start + k], timesteps), but only runs model.predict on the 2 windows each day actually uses,
+# batched across every day instead of once per day.
+# By default each day is scaled exactly like predictPrices does it: a MinMaxScaler fit on the last historyDays closes
+# before that day. Passing a fitted scaler instead scales every day with it (e.g. one fit on the training data), which
+# keeps the series causal and makes days comparable with each other.
+def getChanges(model: Sequential, data: pandas.DataFrame, timesteps: int = 40, start: int | None = None, \
+    stop: int | None = None, scaler: MinMaxScaler | None = None, batchSize: int = 1024) -> numpy.ndarray:
+    closes = numpy.asarray(data["Close"].values, dtype=float).reshape(-1)
+
+    if start is None:
+        start = timesteps
+    if stop is None:
+        stop = len(closes) + 1
+    days = numpy.arange(start, stop)
+    if len(days) == 0:
+        return numpy.empty(0)
+
+    # Get the min and max of the closes each day's scaler would be fit on
+    if scaler is None:
+        lows = pandas.Series(closes).rolling(historyDays, min_periods=1).min().values[days - 1]
+        highs = pandas.Series(closes).rolling(historyDays, min_periods=1).max().values[days - 1]
+    else:
+        lows = numpy.full(len(days), scaler.data_min_[0])
+        highs = numpy.full(len(days), scaler.data_max_[0])
+
+    # MinMaxScaler treats a range of 0 as 1
+    ranges = highs - lows
+    ranges[ranges == 0] = 1
+
+    # predictPrices pads the start of its input with timesteps rows of 0, so when a day doesn't have enough
+    # history for a window, use the padding instead
+    rows = numpy.minimum(days, historyDays) # Length of the data predictPrices would have seen
+    windows = slidingWindows(closes, timesteps)[:, :, 0]
+    xTest = numpy.zeros((len(days), 2, timesteps))
+    for column, back in enumerate((2, 1)): # Column 0 is predictions[-2], column 1 is predictions[-1]
+        hasWindow = rows - back >= timesteps
+        windowStarts = days[hasWindow] - back - timesteps
+        xTest[hasWindow, column] = (windows[windowStarts] - lows[hasWindow, None]) / ranges[hasWindow, None]
+
+    # Predict every window in one go
+    predictions = model.predict(xTest.reshape(-1, timesteps, 1), batch_size=batchSize, verbose=0)
+    predictions = predictions.reshape(len(days), 2)
+    predictions = predictions * ranges[:, None] + lows[:, None]
+
+    return (predictions[:, 1] - predictions[:, 0]) / predictions[:, 0]
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+import numpy
+import pandas
+
+import modelregistry
+import workerpool
+from predicting import getChanges
+
+# Spreads getChanges over a pool of processes that stays running between symbols.
+# Closes are passed to workers through shared memory and models by their key in the model registry, so the only
+# things pickled for each task are a few names and numbers. Works with any start method
+
+workerCount = 3
+workerThreads = 1
+startMethod = None # None uses the platform's default
+maxWorkerModels = 4 # How many models each worker keeps loaded
+
+# Worker state
+models: OrderedDict = OrderedDict() # Key: model key, Value: model
+
+# Numpy array in shared memory. Only (name, shape, dtype) is sent to workers, which map the same memory
+class SharedArray:
+    def __init__(self, shape: tuple, dtype=numpy.float64):
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        size = int(numpy.prod(self.shape)) * self.dtype.itemsize
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1)) # Size can't be 0
+        self.array = numpy.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+    @staticmethod
+    def fromArray(values: numpy.ndarray) -> SharedArray:
+        shared = SharedArray(values.shape, values.dtype)
+        shared.array[:] = values
+        return shared
+
+    def getHandle(self) -> tuple:
+        return (self.memory.name, self.shape, self.dtype.str)
+
+    def free(self) -> None:
+        del self.array
+        self.memory.close()
+        self.memory.unlink()
+
+# Returns (memory, array) for a handle from SharedArray.getHandle. Close memory once array isn't used anymore
+def attach(handle: tuple) -> tuple[shared_memory.SharedMemory, numpy.ndarray]:
+    (name, shape, dtype) = handle
+    memory = shared_memory.SharedMemory(name=name)
+    return (memory, numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=memory.buf))
+
+def initPredictionWorker(threads: int, registryPath: str, numpyInference: bool) -> None:
+    workerpool.initWorker(threads, None, None, ())
+
+    # Settings changed in the main process aren't copied over with spawn
+    modelregistry.registryPath = registryPath
+    modelregistry.numpyInference = numpyInference
+
+# Loads a model from the registry, keeping the last few loaded
+def getWorkerModel(key: str):
+    if key in models:
+        models.move_to_end(key)
+        return models[key]
+
+    handle = modelregistry.loadModel(key)
+    if handle is None:
+        raise ValueError("Model " + key + " isn't in the registry!")
+
+    models[key] = handle.predictor
+    while len(models) > maxWorkerModels:
+        models.popitem(last=False)
+    return models[key]
+
+# Runs in a worker. Writes getChanges for days start to stop into output, which starts at day outputStart
+def predictChunk(key: str, closesHandle: tuple, outputHandle: tuple, timesteps: int, start: int, stop: int, \
+    outputStart: int) -> None:
+    (closesMemory, closes) = attach(closesHandle)
+    (outputMemory, output) = attach(outputHandle)
+    try:
+        data = pandas.DataFrame({"Close": closes}, copy=False)
+        output[start - outputStart:stop - outputStart] = getChanges(getWorkerModel(key), data, timesteps, start, stop)
+        del data
+    finally:
+        # The arrays have to be gone before the memory can be closed
+        del closes, output
+        closesMemory.close()
+        outputMemory.close()
+
+class PredictionPool:
+    def __init__(self, workerCount: int = workerCount, threads: int = workerThreads, \
+        startMethod: str | None = startMethod):
+        self.workerCount = workerCount
+        context = multiprocessing.get_context(startMethod)
+        self.pool = ProcessPoolExecutor(max_workers=workerCount, mp_context=context, initializer=initPredictionWorker, \
+            initargs=(threads, modelregistry.registryPath, modelregistry.numpyInference))
+
+    # Same as predicting.getChanges(model, data, timesteps, start, stop) for the model saved in the registry as key
+    def getChanges(self, key: str, data: pandas.DataFrame, timesteps: int = 40, start: int | None = None, \
+        stop: int | None = None) -> numpy.ndarray:
+        closes = numpy.asarray(data["Close"].values, dtype=float).reshape(-1)
+        if start is None:
+            start = timesteps
+        if stop is None:
+            stop = len(closes) + 1
+        if stop <= start:
+            return numpy.empty(0)
+
+        sharedCloses = SharedArray.fromArray(closes)
+        output = SharedArray((stop - start, ))
+        try:
+            # Split the days into one chunk per worker
+            bounds = numpy.linspace(start, stop, min(self.workerCount, stop - start) + 1).astype(int)
+            futures = [self.pool.submit(predictChunk, key, sharedCloses.getHandle(), output.getHandle(), timesteps, \
+                int(chunkStart), int(chunkStop), start) for chunkStart, chunkStop in zip(bounds[:-1], bounds[1:])]
+
+            # Wait for every chunk before checking for errors so no worker is still using the memory when it's freed
+            wait(futures)
+            for future in futures:
+                future.result()
+
+            return output.array.copy()
+        finally:
+            sharedCloses.free()
+            output.free()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+pool: PredictionPool | None = None
+
+# Returns the pool shared by every caller in this process, starting it the first time
+def getPool() -> PredictionPool:
+    global pool
+    if pool is None:
+        pool = PredictionPool()
+    return pool
@@ -0,0 +1,291 @@
+import json
+import os
+import time
+from typing import Callable
+import numpy
+import pandas
+
+from sheets import log
+
+# Keeps a local copy of each symbol's price history so only bars that are missing have to be downloaded.
+# Each symbol is saved as 2 .npy files (dates and values) that are memory mapped when read, plus a small .json file.
+# Every save writes the arrays under a new version and then points the .json file at it, so a reader that loads the
+# .json file first always gets dates and values from the same save
+
+storePath = "pricestore"
+
+# How many times to retry a failed download, waiting retryDelay seconds and doubling it each time
+retries = 3
+retryDelay = 5
+
+# Newer versions of yfinance return (Price, Ticker) columns even for 1 symbol
+def flattenColumns(data: pandas.DataFrame) -> pandas.DataFrame:
+    if isinstance(data.columns, pandas.MultiIndex):
+        data = data.copy()
+        data.columns = data.columns.get_level_values(0)
+    return data
+
+# Downloads from Yahoo Finance
+class YahooProvider:
+    def download(self, symbol: str, start: pandas.Timestamp, end: pandas.Timestamp, interval: str) \
+        -> pandas.DataFrame:
+        import yfinance
+        data = yfinance.download(symbol, start=start, end=end, interval=interval, progress=False)
+        return flattenColumns(pandas.DataFrame(data))
+
+    # Downloads every symbol in one request. Returns {symbol: data}
+    def downloadMany(self, symbols: list[str], start: pandas.Timestamp, end: pandas.Timestamp, interval: str) \
+        -> dict[str, pandas.DataFrame]:
+        import yfinance
+        data = yfinance.download(symbols, start=start, end=end, interval=interval, group_by="ticker", progress=False)
+
+        results = {}
+        for symbol in symbols:
+            if symbol in data.columns.get_level_values(0):
+                # Symbols can trade on different days, so drop the rows this symbol doesn't have
+                results[symbol] = data[symbol].dropna(how="all")
+        return results
+
+# Reads prices from <path>/<symbol>.csv files instead of downloading them, for running offline
+class FixtureProvider:
+    def __init__(self, path: str):
+        self.path = path
+
+    def download(self, symbol: str, start: pandas.Timestamp, end: pandas.Timestamp, interval: str) \
+        -> pandas.DataFrame:
+        data = pandas.read_csv(os.path.join(self.path, symbol + ".csv"), index_col=0, parse_dates=True)
+        return data[(data.index >= start) & (data.index < end)]
+
+    def downloadMany(self, symbols: list[str], start: pandas.Timestamp, end: pandas.Timestamp, interval: str) \
+        -> dict[str, pandas.DataFrame]:
+        return {symbol: self.download(symbol, start, end, interval) for symbol in symbols}
+
+provider = YahooProvider()
+
+def setProvider(newProvider) -> None:
+    global provider
+    provider = newProvider
+
+# Returns (dates path, values path, meta path). Stores saved before arrays were versioned have no version
+def getPaths(symbol: str, interval: str, version: str | None = None) -> tuple[str, str, str]:
+    path = os.path.join(storePath, interval, symbol.replace("/", "-"))
+    arrayPath = path if version is None else path + "." + version
+    return (arrayPath + ".dates.npy", arrayPath + ".values.npy", path + ".json")
+
+def loadMeta(symbol: str, interval: str) -> dict | None:
+    try:
+        with open(getPaths(symbol, interval)[2], "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+# Returns (dates, values) as read-only memory maps, or None if symbol isn't stored. Pass the meta that was already
+# loaded so the arrays are from the same save
+def loadArrays(symbol: str, interval: str, meta: dict | None = None) \
+    -> tuple[numpy.ndarray, numpy.ndarray] | None:
+    if meta is None:
+        meta = loadMeta(symbol, interval)
+    if meta is None:
+        return None
+
+    (datesPath, valuesPath, metaPath) = getPaths(symbol, interval, meta.get("version"))
+    try:
+        return (numpy.load(datesPath, mmap_mode="r"), numpy.load(valuesPath, mmap_mode="r"))
+    except OSError:
+        return None
+
+def saveArrays(symbol: str, interval: str, dates: numpy.ndarray, values: numpy.ndarray, meta: dict) -> None:
+    previous = loadMeta(symbol, interval)
+    version = str(time.time_ns()) + "-" + str(os.getpid())
+    meta = dict(meta, version=version)
+    (datesPath, valuesPath, metaPath) = getPaths(symbol, interval, version)
+    os.makedirs(os.path.dirname(datesPath), exist_ok=True)
+
+    # Write to temporary files first so readers never see half-written data. The new arrays aren't used until the
+    # meta file points at them, and it's replaced last
+    suffix = ".tmp"
+    with open(datesPath + suffix, "wb") as file:
+        numpy.save(file, dates)
+    with open(valuesPath + suffix, "wb") as file:
+        numpy.save(file, values)
+    with open(metaPath + "." + str(os.getpid()) + suffix, "w") as file:
+        json.dump(meta, file)
+
+    os.replace(datesPath + suffix, datesPath)
+    os.replace(valuesPath + suffix, valuesPath)
+    os.replace(metaPath + "." + str(os.getpid()) + suffix, metaPath)
+
+    # Keep the previous version for readers that loaded its meta just before it was replaced
+    removeVersions(symbol, interval, [version, previous.get("version") if previous is not None else None])
+
+# Deletes every saved version of symbol's arrays except keep. None in keep is the unversioned files
+def removeVersions(symbol: str, interval: str, keep: list[str | None]) -> None:
+    directory = os.path.join(storePath, interval)
+    name = symbol.replace("/", "-")
+    for file in os.listdir(directory):
+        for extension in (".dates.npy", ".values.npy"):
+            if not file.startswith(name) or not file.endswith(extension):
+                continue
+            version = file[len(name):-len(extension)]
+            if version == "":
+                version = None
+            elif version.startswith(".") and version[1:].replace("-", "").isdigit():
+                version = version[1:]
+            else:
+                continue # Another symbol's file or a temporary file
+
+            if version not in keep:
+                try:
+                    os.remove(os.path.join(directory, file))
+                except OSError:
+                    pass
+
+# Dates are stored as UTC without a timezone
+def toDates(index: pandas.Index) -> numpy.ndarray:
+    index = pandas.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert(None)
+    return index.values.astype("datetime64[ns]").astype(numpy.int64)
+
+# Runs download(), retrying with a longer wait each time it fails
+def withRetries(download: Callable, description: str):
+    delay = retryDelay
+    for attempt in range(retries + 1):
+        try:
+            log("Downloading " + description + "...")
+            return download()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            log("Error downloading " + description + ": " + str(e) + ". Retrying in " + str(delay) + " seconds...")
+            time.sleep(delay)
+            delay *= 2
+
+def download(symbol: str, start: pandas.Timestamp, end: pandas.Timestamp, interval: str) -> pandas.DataFrame:
+    return withRetries(lambda: provider.download(symbol, start, end, interval), \
+        symbol + " from " + start.strftime("%Y-%m-%d") + " to " + end.strftime("%Y-%m-%d"))
+
+# Adds new rows to what's stored for symbol. Rows in new replace stored rows with the same date
+def merge(symbol: str, interval: str, new: list[pandas.DataFrame], fetchedFrom: pandas.Timestamp, \
+    fetchedTo: pandas.Timestamp) -> None:
+    meta = loadMeta(symbol, interval)
+    arrays = loadArrays(symbol, interval, meta) if meta is not None else None
+    new = [data for data in new if len(data) > 0]
+
+    if meta is None or arrays is None or len(meta["columns"]) == 0:
+        columns = [str(column) for column in new[0].columns] if len(new) > 0 else []
+        dates = numpy.empty(0, dtype=numpy.int64)
+        values = numpy.empty((0, len(columns)))
+    else:
+        columns = meta["columns"]
+        (dates, values) = (numpy.array(arrays[0]), numpy.array(arrays[1]))
+    del arrays # Close the memory maps before the files are replaced
+
+    for data in new:
+        newDates = toDates(data.index)
+        newValues = data.reindex(columns=columns).values.astype(float)
+
+        keep = ~numpy.isin(dates, newDates)
+        dates = numpy.concatenate([dates[keep], newDates])
+        values = numpy.concatenate([values[keep], newValues])
+
+    order = numpy.argsort(dates, kind="stable")
+    meta = {
+        "columns": columns,
+        "fetchedFrom": str(fetchedFrom),
+        "fetchedTo": str(fetchedTo)
+    }
+    saveArrays(symbol, interval, dates[order], values[order], meta)
+
+# Downloads whatever part of start to end isn't stored yet
+def update(symbol: str, start: pandas.Timestamp, end: pandas.Timestamp, interval: str = "1d") -> None:
+    meta = loadMeta(symbol, interval)
+
+    if meta is None:
+        merge(symbol, interval, [download(symbol, start, end, interval)], start, end)
+        return
+
+    fetchedFrom = pandas.Timestamp(meta["fetchedFrom"])
+    fetchedTo = pandas.Timestamp(meta["fetchedTo"])
+    new = []
+
+    if start < fetchedFrom:
+        new.append(download(symbol, start, fetchedFrom, interval))
+        fetchedFrom = start
+
+    if end > fetchedTo:
+        # Download the last stored bar again too in case it wasn't finished when it was downloaded
+        arrays = loadArrays(symbol, interval, meta)
+        lastDate = pandas.Timestamp(int(arrays[0][-1])) if arrays is not None and len(arrays[0]) > 0 else fetchedTo
+        del arrays
+        new.append(download(symbol, min(lastDate, fetchedTo), end, interval))
+        fetchedTo = end
+
+    if len(new) > 0:
+        merge(symbol, interval, new, fetchedFrom, fetchedTo)
+
+# Like update, but downloads the new bars of every symbol in one request
+def updateMany(symbols: list[str], start: pandas.Timestamp, end: pandas.Timestamp, interval: str = "1d") -> None:
+    (start, end) = normalizeRange(start, end, interval)
+
+    # Find where each symbol needs new bars from
+    fetchStarts = {}
+    for symbol in symbols:
+        meta = loadMeta(symbol, interval)
+        if meta is None:
+            fetchStarts[symbol] = start
+            continue
+
+        if start < pandas.Timestamp(meta["fetchedFrom"]):
+            # Older bars are rarely missing, so just get them separately
+            update(symbol, start, end, interval)
+            continue
+
+        fetchedTo = pandas.Timestamp(meta["fetchedTo"])
+        if end > fetchedTo:
+            arrays = loadArrays(symbol, interval, meta)
+            lastDate = pandas.Timestamp(int(arrays[0][-1])) if arrays is not None and len(arrays[0]) > 0 else fetchedTo
+            del arrays
+            fetchStarts[symbol] = min(lastDate, fetchedTo)
+
+    if len(fetchStarts) == 0:
+        return
+
+    fetchSymbols = list(fetchStarts.keys())
+    fetchStart = min(fetchStarts.values())
+    results = withRetries(lambda: provider.downloadMany(fetchSymbols, fetchStart, end, interval), \
+        str(len(fetchSymbols)) + " symbols from " + fetchStart.strftime("%Y-%m-%d") + " to " + end.strftime("%Y-%m-%d"))
+
+    for symbol in fetchSymbols:
+        if symbol not in results:
+            log("No data downloaded for " + symbol + "!")
+            continue
+
+        meta = loadMeta(symbol, interval)
+        fetchedFrom = pandas.Timestamp(meta["fetchedFrom"]) if meta is not None else start
+        merge(symbol, interval, [results[symbol]], fetchedFrom, end)
+
+# Daily bars only change once a day, so daily ranges are rounded to the day so running twice in a day doesn't
+# download again
+def normalizeRange(start: pandas.Timestamp, end: pandas.Timestamp, interval: str) \
+    -> tuple[pandas.Timestamp, pandas.Timestamp]:
+    start = pandas.Timestamp(start)
+    end = pandas.Timestamp(end)
+    if interval == "1d":
+        start = start.normalize()
+        end = end.normalize()
+    return (start, end)
+
+# Returns symbol's bars from start up to end, downloading any that aren't stored yet
+def getData(symbol: str, start: pandas.Timestamp, end: pandas.Timestamp, interval: str = "1d") -> pandas.DataFrame:
+    (start, end) = normalizeRange(start, end, interval)
+    update(symbol, start, end, interval)
+
+    meta = loadMeta(symbol, interval)
+    (dates, values) = loadArrays(symbol, interval, meta)
+
+    startIndex = numpy.searchsorted(dates, start.value, side="left")
+    endIndex = numpy.searchsorted(dates, end.value, side="left")
+
+    return pandas.DataFrame(values[startIndex:endIndex], columns=meta["columns"], \
+        index=pandas.DatetimeIndex(dates[startIndex:endIndex].astype("datetime64[ns]"), name="Date"))
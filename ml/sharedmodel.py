@@ -0,0 +1,186 @@
+import time
+from typing import Callable
+import numpy
+import pandas
+import keras
+import tensorflow
+from keras.layers import Concatenate, Dense, Dropout, Embedding, Flatten, Input, LSTM
+from keras.models import Model
+
+import modelconfig
+import trainingcontrol
+from sheets import log
+from training import BudgetCallback, ModelCallback
+from windowing import slidingWindows
+
+# Trains one model for every symbol instead of one model per symbol. Each symbol's closes are scaled by their own
+# min and max, and the model is told which symbol a window is from through a small embedding.
+# Only each symbol's scaled closes are kept in memory, and training windows are streamed to Keras in batches
+
+embeddingSize = 4 # Size of the vector each symbol is turned into
+
+# The scaled closes of every symbol, joined end to end
+class SharedSeries:
+    def __init__(self):
+        self.symbols: list[str] = []
+        self.closes: list[numpy.ndarray] = []
+        self.lows: list[float] = []
+        self.ranges: list[float] = []
+
+    def add(self, symbol: str, closes: numpy.ndarray) -> None:
+        # Scale by the training part of the data only
+        trainCloses = closes[:int(len(closes) * modelconfig.trainingRatio)]
+        low = float(trainCloses.min())
+        priceRange = float(trainCloses.max()) - low
+        if priceRange == 0:
+            priceRange = 1
+
+        self.symbols.append(symbol)
+        self.closes.append(((closes - low) / priceRange).astype(numpy.float32))
+        self.lows.append(low)
+        self.ranges.append(priceRange)
+
+    # Returns (flat, targets, symbolIds, validationTargets, validationSymbolIds) where flat is every symbol's closes
+    # joined together and targets are indexes in flat that have a full window before them
+    def getTrainingSamples(self, timesteps: int) -> tuple:
+        flat = numpy.concatenate(self.closes)
+
+        targets = []
+        validationTargets = []
+        symbolIds = []
+        validationSymbolIds = []
+        offset = 0
+        for symbolId, closes in enumerate(self.closes):
+            trainLength = int(len(closes) * modelconfig.trainingRatio)
+            symbolTargets = offset + numpy.arange(timesteps, trainLength)
+
+            # Hold out the last few windows of each symbol for validation
+            validationCount = int(len(symbolTargets) * trainingcontrol.validationSplit)
+            splitAt = len(symbolTargets) - validationCount
+            targets.append(symbolTargets[:splitAt])
+            validationTargets.append(symbolTargets[splitAt:])
+            symbolIds.append(numpy.full(splitAt, symbolId, dtype=numpy.int32))
+            validationSymbolIds.append(numpy.full(validationCount, symbolId, dtype=numpy.int32))
+
+            offset += len(closes)
+
+        return (flat, numpy.concatenate(targets), numpy.concatenate(symbolIds), \
+            numpy.concatenate(validationTargets), numpy.concatenate(validationSymbolIds))
+
+def generateBatches(flat: numpy.ndarray, targets: numpy.ndarray, symbolIds: numpy.ndarray, timesteps: int, \
+    batchSize: int, shuffle: bool):
+    windows = slidingWindows(flat, timesteps)
+    order = numpy.random.permutation(len(targets)) if shuffle else numpy.arange(len(targets))
+
+    for start in range(0, len(order), batchSize):
+        batch = order[start:start + batchSize]
+        yield ((windows[targets[batch] - timesteps], symbolIds[batch, numpy.newaxis]), flat[targets[batch]])
+
+def makeDataset(flat: numpy.ndarray, targets: numpy.ndarray, symbolIds: numpy.ndarray, timesteps: int, \
+    shuffle: bool) -> tensorflow.data.Dataset:
+    signature = (
+        (tensorflow.TensorSpec(shape=(None, timesteps, 1), dtype=tensorflow.float32),
+            tensorflow.TensorSpec(shape=(None, 1), dtype=tensorflow.int32)),
+        tensorflow.TensorSpec(shape=(None, ), dtype=tensorflow.float32)
+    )
+    dataset = tensorflow.data.Dataset.from_generator( \
+        lambda: generateBatches(flat, targets, symbolIds, timesteps, modelconfig.batchSize, shuffle), \
+        output_signature=signature)
+    return dataset.prefetch(tensorflow.data.AUTOTUNE)
+
+def buildSharedModel(timesteps: int, symbolCount: int) -> Model:
+    prices = Input(shape=(timesteps, 1))
+    symbol = Input(shape=(1, ), dtype="int32")
+
+    x = prices
+    for i, (units, dropout) in enumerate(modelconfig.lstmLayers):
+        x = LSTM(units=units, return_sequences=i < len(modelconfig.lstmLayers) - 1)(x)
+        x = Dropout(dropout)(x)
+
+    # Add which symbol this is before condensing
+    embedding = Flatten()(Embedding(symbolCount, embeddingSize)(symbol))
+    x = Concatenate()([x, embedding])
+    output = Dense(units=1)(x)
+
+    model = Model(inputs=[prices, symbol], outputs=output)
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+def trainShared(series: SharedSeries, timesteps: int = 40, label: str = "Shared") -> Model | None:
+    try:
+        (flat, targets, symbolIds, validationTargets, validationSymbolIds) = series.getTrainingSamples(timesteps)
+        log("Training shared model on " + str(len(targets)) + " windows from " + str(len(series.symbols)) + " symbols...")
+
+        keras.backend.clear_session()
+        model = buildSharedModel(timesteps, len(series.symbols))
+
+        trainDataset = makeDataset(flat, targets, symbolIds, timesteps, True)
+        validationDataset = makeDataset(flat, validationTargets, validationSymbolIds, timesteps, False) \
+            if len(validationTargets) > 0 else None
+
+        callbacks = [ModelCallback(label), BudgetCallback(trainingcontrol.getDeadline(), label)]
+        if validationDataset is not None:
+            callbacks.append(keras.callbacks.EarlyStopping(monitor="val_loss", patience=trainingcontrol.patience, \
+                restore_best_weights=True))
+
+        startTime = time.time()
+        maxEpochs = trainingcontrol.getEpochs(label, modelconfig.epochs)
+        history = model.fit(trainDataset, validation_data=validationDataset, epochs=maxEpochs, callbacks=callbacks)
+
+        timeTaken = time.time() - startTime
+        log("Done! Training time: " + str(pandas.Timedelta(seconds=timeTaken)))
+        trainingcontrol.recordTraining(label, history.history, timeTaken)
+
+        return model
+    except Exception as e:
+        log("Error Training Shared Model: " + str(e))
+        return None
+
+# Returns {symbol: predicted change} like getChange does for each symbol's own model
+def predictSharedChanges(model: Model, series: SharedSeries, timesteps: int = 40) -> dict[str, float]:
+    # Like getChangeTuple, use the windows ending the day before yesterday and yesterday
+    xTest = []
+    symbolIds = []
+    for symbolId, closes in enumerate(series.closes):
+        windows = slidingWindows(closes[:-1], timesteps)
+        xTest.append(windows[-2:])
+        symbolIds += [symbolId] * 2
+    xTest = numpy.concatenate(xTest)
+    symbolIds = numpy.array(symbolIds, dtype=numpy.int32)[:, numpy.newaxis]
+
+    predictions = model.predict([xTest, symbolIds], verbose=0).reshape(-1, 2)
+
+    changes = {}
+    for symbolId, symbol in enumerate(series.symbols):
+        (today, tomorrow) = predictions[symbolId] * series.ranges[symbolId] + series.lows[symbolId]
+        changes[symbol] = float((tomorrow - today) / today)
+    return changes
+
+# Downloads each symbol with getData, trains one model on all of them and returns {symbol: expected change}.
+# Symbols that fail to download get an expected change of 0
+def getSharedExpectedChanges(symbols: list[str], getData: Callable[[str], pandas.DataFrame], timesteps: int = 40) \
+    -> dict[str, float]:
+    series = SharedSeries()
+    for symbol in symbols:
+        try:
+            data = getData(symbol)
+            closes = numpy.asarray(data["Close"].values, dtype=float).reshape(-1)
+            del data # Only keep the closes
+
+            if len(closes) < timesteps + 2:
+                log("Not enough data for " + symbol + "!")
+                continue
+            series.add(symbol, closes)
+        except Exception as e:
+            log("Error downloading data for " + symbol + ": " + str(e))
+
+    changes = {symbol: 0 for symbol in symbols}
+    if len(series.symbols) == 0:
+        return changes
+
+    model = trainShared(series, timesteps)
+    if model is None:
+        return changes
+
+    changes.update(predictSharedChanges(model, series, timesteps))
+    return changes
@@ -0,0 +1,139 @@
+from __future__ import annotations
+import itertools
+import math
+import sys
+import time
+import pandas
+
+import pricestore
+import testing
+import workerpool
+from portfolio import BacktestRun
+from sheets import log
+
+# Runs testMultiStock's backtest for every combination of timesteps, trainingDays, days and offsetDays and writes the
+# results to a table, instead of editing the testMultiStock call and rerunning it for each one.
+# Grid points run in a process pool. Prices are downloaded once up front, models are reused through the model registry
+# and predictions through testing.predictionCachePath, so running a sweep again only computes what changed
+
+workerCount = 2
+workerThreads = 2
+workerRamLimitMb = 4096
+
+resultsPath = "sweepresults.csv"
+
+# With successive halving, each round keeps the best 1 / halvingRate of the grid points and tests them on
+# halvingRate times as many symbols
+halvingRate = 2
+
+# Returns (timesteps, trainingDays, days, offsetDays) for each combination, skipping ones with no testing days
+def getGrid(timesteps: list[int], trainingDays: list[int], days: list[int], offsetDays: list[int]) \
+    -> list[tuple[int, int, int, int]]:
+    return [point for point in itertools.product(timesteps, trainingDays, days, offsetDays) if point[1] < point[2]]
+
+# Runs in a worker. item is (timesteps, trainingDays, days, offsetDays, symbols, endDate)
+def evaluatePoint(item: tuple) -> dict:
+    (timesteps, trainingDays, days, offsetDays, symbols, endDate) = item
+    symbols = list(symbols)
+
+    startTime = time.time()
+    (predictedChanges, realPrices) = testing.getPredictedChangesAndRealPrices(symbols, timesteps, days, \
+        trainingDays / days, offsetDays, pandas.Timestamp(endDate))
+    symbols = list(predictedChanges) # Without the symbols whose model couldn't be trained
+    if len(symbols) == 0:
+        raise ValueError("No models could be trained")
+    results = BacktestRun(symbols, predictedChanges, realPrices, vectorized=True).run()
+
+    row = {
+        "timesteps": timesteps,
+        "trainingDays": trainingDays,
+        "days": days,
+        "offsetDays": offsetDays,
+        "symbols": len(symbols)
+    }
+    row.update(testing.summarizeResults(results, len(predictedChanges[symbols[0]])))
+    row["time"] = time.time() - startTime
+    return row
+
+# Downloads every symbol's prices for the whole sweep in one go, so workers only read from the price store
+def prefetch(symbols: list[str], points: list[tuple], endDate: pandas.Timestamp) -> None:
+    earliest = min(endDate - pandas.Timedelta(days=days + offsetDays) for (_, _, days, offsetDays) in points)
+    pricestore.updateMany(symbols, earliest, endDate)
+
+# Returns a row for each point that finished, in the same order as points
+def runPoints(points: list[tuple], symbols: list[str], endDate: pandas.Timestamp) -> list[dict]:
+    items = [point + (tuple(symbols), str(endDate)) for point in points]
+    log("Testing " + str(len(items)) + " grid points on " + str(len(symbols)) + " symbols...")
+
+    results = workerpool.runPool(evaluatePoint, items, workerCount, workerThreads, workerRamLimitMb)
+
+    rows = []
+    for item in items:
+        if item in results:
+            rows.append(results[item])
+        else:
+            log("Grid point " + str(item[:4]) + " failed!")
+    return rows
+
+# Tests every point on the first minSymbols symbols, then keeps testing the best points on more symbols until
+# they're tested on all of them. Returns the rows from every round
+def successiveHalving(points: list[tuple], symbols: list[str], endDate: pandas.Timestamp, minSymbols: int = 1) \
+    -> list[dict]:
+    allRows = []
+    symbolCount = min(max(minSymbols, 1), len(symbols))
+    roundNum = 0
+    while True:
+        rows = runPoints(points, symbols[:symbolCount], endDate)
+        for row in rows:
+            row["round"] = roundNum
+        allRows += rows
+
+        if symbolCount >= len(symbols) or len(rows) <= 1:
+            break
+
+        # Keep the best points
+        rows.sort(key=lambda row: row["annualizedReturn"], reverse=True)
+        keepCount = math.ceil(len(rows) / halvingRate)
+        points = [(row["timesteps"], row["trainingDays"], row["days"], row["offsetDays"]) for row in rows[:keepCount]]
+        log("Round " + str(roundNum) + " done! Keeping " + str(keepCount) + " of " + str(len(rows)) + " grid points")
+
+        symbolCount = min(symbolCount * halvingRate, len(symbols))
+        roundNum += 1
+
+    return allRows
+
+def sweep(symbols: list[str], timesteps: list[int] = [5, 10, 20, 30, 40], trainingDays: list[int] = [365], \
+    days: list[int] = [365 * 2], offsetDays: list[int] = [0], halving: bool = False, minSymbols: int = 1, \
+    endDate: pandas.Timestamp | None = None) -> pandas.DataFrame:
+    startTime = time.time()
+
+    # Every worker uses the same end date, even if the sweep runs past midnight
+    endDate = pandas.Timestamp.today().normalize() if endDate is None else pandas.Timestamp(endDate).normalize()
+
+    points = getGrid(timesteps, trainingDays, days, offsetDays)
+    if len(points) == 0:
+        log("No grid points to test!")
+        return pandas.DataFrame()
+
+    prefetch(symbols, points, endDate)
+
+    if halving:
+        rows = successiveHalving(points, symbols, endDate, minSymbols)
+    else:
+        rows = runPoints(points, symbols, endDate)
+
+    table = pandas.DataFrame(rows)
+    if len(table) > 0:
+        table = table.sort_values("annualizedReturn", ascending=False)
+    table.to_csv(resultsPath, index=False)
+
+    log("Sweep done! Tested " + str(len(rows)) + " grid points in " + \
+        str(pandas.Timedelta(seconds=time.time() - startTime)) + ". Results saved to " + resultsPath)
+    return table
+
+if __name__ == "__main__":
+    # python sweep.py BAC INTC
+    symbols = sys.argv[1:] if len(sys.argv) > 1 else ["BAC", "INTC"]
+    table = sweep(symbols, timesteps=[5, 10, 20, 30, 40], trainingDays=[365, 365 * 3, 365 * 5], \
+        days=[365 * 2, 365 * 6, 365 * 10], halving=True)
+    print(table.to_string(index=False))
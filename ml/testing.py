@@ -1,31 +1,63 @@
+from __future__ import annotations
 import gc
-from matplotlib import pyplot as plt
+import hashlib
+import json
+import os
 import numpy
 import pandas
-import yfinance
-from multiprocessing import Array, Process, connection
 import multiprocessing
-from keras import Sequential
-from predicting import getChange
-from trading import generateBuyAndSellLists
-from training import train
-
-processCount = 3
-
-def predictChangesProcess(\
-    symbol: str, changes: list[float], offset: int, timesteps: int, testingData: pandas.DataFrame, model: Sequential) -> None:
-    print("Started process", offset, "on other process")
-    for i in range(timesteps + offset, len(testingData) - 1, processCount):
-        if i % 100 == 0:
-            print("Predicting " + symbol + " day " + str(i - timesteps) + \
-                "/" + str(len(testingData) - timesteps) + "...")
-        changes[i - timesteps] = getChange(model, testingData[:i], timesteps)
-
-# Returns (predictedChanges, realPrices)
+import modelconfig
+import pricestore
+from backtest import TestResults
+from metrics import formatSummary
+from portfolio import BacktestRun
+import predicting
+from predicting import getChanges
+import predictionpool
+import modelregistry
+from modelregistry import getKey, getModel, hashData
+import trainingcontrol
+
+# Matplotlib is only imported when it's used so backtest workers start quickly
+
+walkForward = True # Predict every test day in this process. Otherwise the days are split over predictionpool's workers
+vectorizedBacktest = True # Run testModel with the array based engine in backtest.py instead of day by day
+
+# Predicted changes are saved here, keyed by the model, the testing data and the settings used to predict, so running
+# the same test again doesn't have to load the model or predict anything. Set to None to always predict
+predictionCachePath = "predictioncache"
+
+def getPredictionCachePath(symbol: str, trainingData: pandas.DataFrame, testingData: pandas.DataFrame, \
+    timesteps: int) -> str:
+    # Backtest models are trained reproducibly, see getPredictedChangesAndRealPrices
+    maxEpochs = trainingcontrol.getMaxEpochs(symbol, modelconfig.epochs, True)
+    modelKey = getKey(symbol, modelconfig.getTrainingData(trainingData), timesteps, maxEpochs)
+
+    predictionData = json.dumps([hashData(testingData), modelregistry.numpyInference, predicting.historyDays])
+    return os.path.join(predictionCachePath, modelKey + "-" + hashlib.sha256(predictionData.encode()).hexdigest()[:16] \
+        + ".npy")
+
+def loadPredictions(path: str) -> list[float] | None:
+    try:
+        return numpy.load(path).tolist()
+    except (OSError, ValueError):
+        return None
+
+def savePredictions(path: str, changes: list[float]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so other processes never read half a file
+    tempPath = path + "." + str(os.getpid()) + ".tmp"
+    with open(tempPath, "wb") as file:
+        numpy.save(file, numpy.asarray(changes, dtype=float))
+    os.replace(tempPath, path)
+
+# Returns (predictedChanges, realPrices). endDate defaults to today. Symbols whose model couldn't be trained are left
+# out
 def getPredictedChangesAndRealPrices( \
-    symbols: list[str], timesteps: int = 40, days: int = 365 * 10, trainingRatio: float = 0.8, offsetDays: int = 0) \
-    -> tuple[dict[str, list[float]], dict[str, list[float]]]:
-    today = pandas.Timestamp.today()
+    symbols: list[str], timesteps: int = 40, days: int = 365 * 10, trainingRatio: float = 0.8, offsetDays: int = 0, \
+    endDate: pandas.Timestamp | None = None) -> tuple[dict[str, list[float]], dict[str, list[float]]]:
+    today = pandas.Timestamp.today() if endDate is None else pandas.Timestamp(endDate)
     today = today - pandas.Timedelta(days=offsetDays)
     startDate = today - pandas.Timedelta(days=days)
 
@@ -35,35 +67,47 @@ def getPredictedChangesAndRealPrices( \
     for symbol in symbols:
         print("Getting predicted prices for " + symbol + "...")
 
-        print("Downloading data from " + startDate.strftime("%Y-%m-%d") + " to " + today.strftime("%Y-%m-%d") + "...")
-        data = pandas.DataFrame(yfinance.download(symbol, start=startDate, end=today))
+        print("Getting data from " + startDate.strftime("%Y-%m-%d") + " to " + today.strftime("%Y-%m-%d") + "...")
+        data = pricestore.getData(symbol, startDate, today)
         print("Done!")
 
         trainingData = data[:int(len(data) * trainingRatio)]
         testingData = data[int(len(data) * trainingRatio) - timesteps:]
+        realPrices[symbol] = data["Close"].values[len(trainingData):]
+
+        cachePath = None
+        if predictionCachePath is not None:
+            cachePath = getPredictionCachePath(symbol, trainingData, testingData, timesteps)
+            cached = loadPredictions(cachePath)
+            if cached is not None:
+                print("Using saved predictions for " + symbol + "!")
+                predictedChanges[symbol] = cached
+                continue
 
         # Be really careful with : placement here!
-        model = train(trainingData, timesteps, symbol)
+        # Backtests always use fully trained models so results can be reproduced
+        handle = getModel(trainingData, timesteps, symbol, incremental=False)
+        if handle is None:
+            print("Couldn't train a model for " + symbol + "! Skipping it...")
+            del realPrices[symbol]
+            continue
 
         # Get predictions from model
         predictedChanges[symbol] = []
         startTime = pandas.Timestamp.now()
 
-        # Start processes
-        changes = Array("d", len(testingData) - timesteps - 1)
-        processes = []
-        for i in range(processCount):
-            print("Starting process", i)
-            proc = Process(target=predictChangesProcess, args=(symbol, changes, i, timesteps, testingData, model))
-            proc.start()
-            processes.append(proc)
-            print("Started process", i)
-        
-        # Wait for processes to finish
-        connection.wait(proc.sentinel for proc in processes)
-        print("All processes finished!")
+        if walkForward:
+            # Predict all days at once
+            changes = getChanges(handle.predictor, testingData, timesteps, timesteps, len(testingData) - 1)
+        else:
+            # Workers load the model from the registry themselves
+            changes = predictionpool.getPool().getChanges(handle.key, testingData, timesteps, timesteps, \
+                len(testingData) - 1)
         predictedChanges[symbol] = list(changes)
 
+        if cachePath is not None:
+            savePredictions(cachePath, predictedChanges[symbol])
+
         # Log time stats
         timeTaken = pandas.Timestamp.now() - startTime
         print("Time to predict", symbol + ": ", timeTaken)
@@ -73,230 +117,28 @@ def getPredictedChangesAndRealPrices( \
         # predictedPrices[symbol] = \
         #     predictPrices(model, testingData, timesteps)
 
-        realPrices[symbol] = data["Close"].values[len(trainingData):]
-
-        del data, model
+        del data, handle
         gc.collect()
 
     return (predictedChanges, realPrices)
 
-class TestResults:
-    def __init__(self, money: float, shares: dict[str, float], netWorth: list[float], profitBySymbol: dict[str, float], \
-                holdings: dict[str, list[float]]):
-        self.money = money
-        self.shares = shares
-        self.netWorth = netWorth
-        self.profitBySymbol = profitBySymbol
-        self.holdings = holdings
-
-def sellShares(sellList: dict[str, float], realPrices: dict[str, list[float]], i: int) -> None:
-    global money, shares, buyPrices, profitBySymbol, wins, losses
-
-    for symbol, shareCount in sellList.items():
-        if shareCount <= 0:
-            continue
-
-        # Sell shares
-        priceDiff = realPrices[symbol][i] - buyPrices[symbol]
-
-        if priceDiff > 0:
-            wins += 1
-        elif priceDiff < 0:
-            losses += 1
-
-        tradeProfit = shareCount * priceDiff
-        tradeValue = shareCount * realPrices[symbol][i]
-        
-        # Update profit by symbol
-        if symbol not in profitBySymbol:
-            profitBySymbol[symbol] = 0
-        profitBySymbol[symbol] += tradeProfit
-
-        # Update money and shares
-        money += tradeValue
-        shares[symbol] -= shareCount
-
-def buyShares(buyList: dict[str, float], realPrices: dict[str, list[float]], i: int) -> None:
-    global money, shares, buyPrices
-
-    purchaseValue = 0
-    buyingPower = money
-    for symbol, shareCount in buyList.items():
-        if shareCount == 0:
-            continue
-
-        if symbol not in shares:
-            shares[symbol] = 0
-
-        realPrice = realPrices[symbol][i]
-
-        # Generate buy price by weighted average
-        if shareCount + shares[symbol] == 0:
-            print("Error: shareCount + shares[symbol] == 0")
-
-        if symbol not in buyPrices or shares[symbol] == 0 or shareCount + shares[symbol] == 0:
-            buyPrices[symbol] = realPrice
-        else:
-            buyPrices[symbol] = (realPrice * shareCount \
-                + (buyPrices[symbol] * shares[symbol])) \
-                / (shareCount + shares[symbol])
-
-        sharesBought = buyList[symbol]
-        shares[symbol] += sharesBought
-        money -= sharesBought * realPrice
-        purchaseValue += sharesBought * realPrice
-
-    if purchaseValue - buyingPower > 1:
-        print("Error: purchaseValue > buyingPower")
-        print("\tpurchaseValue:", purchaseValue)
-        print("\tbuyingPower:", buyingPower)
-        print("\tbuyList:", buyList)
-        
-        # Adjust buylist by real price
-        for symbol in buyList:
-            buyList[symbol] *= realPrices[symbol][i]
-        print("\tbuyList adjusted:", buyList)
-
-def getTotalEquity(symbols: list[str], realPrices: dict[str, list[float]], i: int) -> float:
-    global money, shares
-
-    totalEquity = money
-    for symbol in symbols:
-        totalEquity += shares[symbol] * realPrices[symbol][i]
-    return totalEquity
-
-def testDay(symbols: list[str], predictedChanges: dict[str, list[float]], realPrices: dict[str, list[float]], \
-    dayNum: int, i: int, timesteps: int = 40) -> None:
-    global money, shares, netWorth, buyPrices, profitBySymbol, holdings
-
-    if dayNum % 100 == 0:
-        print("Day " + str(i-timesteps) + "/" + str(len(predictedChanges[symbols[0]])) + "...")
-
-    if len(predictedChanges[symbols[0]]) <= i + 1 or len(realPrices[symbols[0]]) <= i + 1:
-        return
-
-    changes = {}
-    for symbol in symbols:
-        if len(predictedChanges[symbol]) <= i + 1 or len(realPrices[symbol]) <= i + 1:
-            continue
-
-        diff = predictedChanges[symbol][i]
-        changes[symbol] = diff
-        
-    (buyList, sellList) = generateBuyAndSellLists(changes, True)
-
-    # Convert sellList to a dict, where key is symbol and value is number of shares to sell
-    sellList = {symbol: shares[symbol] if shares[symbol] > 0 else 0 for symbol in sellList}
-
-    # Caculate total equity
-    totalEquity = getTotalEquity(symbols, realPrices, i)
-
-    # Calculate adjustment to each stock based on total equity
-    for symbol in buyList:
-        buyList[symbol] *= totalEquity # Convert from % of total equity to USD
-        # Convert from USD to shares
-        buyList[symbol] /= realPrices[symbol][i]
-
-        # Determine adjustment
-        # print(symbol, "buyList:", buyList[symbol], "shares:", shares[symbol])
-        if shares[symbol] <= buyList[symbol]:
-            buyList[symbol] -= shares[symbol]
-        else:
-            sellList[symbol] = shares[symbol] - buyList[symbol]
-            buyList[symbol] = 0
-
-    # Sell everything in sellList
-    sellShares(sellList, realPrices, i)
-
-    # Calculate money required for buyList
-    moneyRequired = 0
-    for symbol in buyList:
-        moneyRequired += buyList[symbol] * realPrices[symbol][i]
-    if moneyRequired - money > 1:
-        print("Error: moneyRequired > money")
-        print("\tmoneyRequired:", moneyRequired)
-        print("\tmoney:", money)
-        print("\tsellList:", sellList)
-        print("\tbuyList:", buyList)
-
-        print("\ttotalEquity:", totalEquity)
-        shareValues = {}
-        for symbol in symbols:
-            shareValues[symbol] = shares[symbol] * realPrices[symbol][i]
-        print("\tshareValues:", shareValues)
-
-    # Buy shares
-    buyShares(buyList, realPrices, i)
-
-    # Calculate net worth
-    netWorthToday = money
-    for symbol in symbols:
-        netWorthToday += shares[symbol] \
-            * realPrices[symbol][i]
-    netWorth.append(netWorthToday)
-
-    # Log value of each holding
-    for symbol in symbols:
-        holdings[symbol].append(shares[symbol] * realPrices[symbol][i])
-    holdings["Money"].append(money)
-
-    if money < -0.1:
-        input("Money is negative: " + str(money) + ". Press Enter to continue...")
-
 def testModel(symbols: list[str], predictedChanges: dict[list[float]], realPrices: dict[list[float]], timesteps: int = 40) \
     -> TestResults:
-    # Initialize variables for testing
-    print("Preparing variables for testing...")
-
-    # Declare global variables
-    global money, shares, netWorth, buyPrices, profitBySymbol, holdings, wins, losses
-
-    money = 100.0
-    shares = {}
-
-    wins = 0
-    losses = 0
-
-    for symbol in symbols:
-        shares[symbol] = 0
-
-    netWorth = []
-
-    # Test model
     print("Testing model...")
-    buyPrices = {}
-    profitBySymbol = {}
-    holdings = {symbol: [] for symbol in symbols}
-    holdings["Money"] = []
-
     startTime = pandas.Timestamp.now()
-    for i in range(0, len(predictedChanges[symbols[0]]) - 1):
-        dayNum = i - timesteps
-        testDay(symbols, predictedChanges, realPrices, dayNum, i, timesteps)
+    results = BacktestRun(symbols, predictedChanges, realPrices, vectorized=vectorizedBacktest).run()
 
     # Log time stats
-    endTime = pandas.Timestamp.now()
-    timeTaken = endTime - startTime
+    timeTaken = pandas.Timestamp.now() - startTime
     print("Time to test:", timeTaken)
-    timePerDay = timeTaken.total_seconds() / (len(predictedChanges[symbols[0]]) - timesteps)
+    timePerDay = timeTaken.total_seconds() / max(len(predictedChanges[symbols[0]]) - timesteps, 1)
     print("Time per day:", timePerDay, "seconds")
 
-    # Sell all shares
-    for symbol in symbols:
-        if symbol in buyPrices:
-            # Calculate profit from this trade
-            tradeProfit = shares[symbol] * (realPrices[symbol][-1] - buyPrices[symbol])
-            if symbol not in profitBySymbol:
-                profitBySymbol[symbol] = 0
-            profitBySymbol[symbol] += tradeProfit
-        print("Selling", shares[symbol], "shares of", symbol, "for", realPrices[symbol][-1] * shares[symbol], \
-            "USD - Profit:", tradeProfit, "USD")
-        money += shares[symbol] * realPrices[symbol][-1]
-        shares[symbol] = 0
-
-    return TestResults(money, shares, netWorth, profitBySymbol, holdings)
+    return results
 
 def graphMultiStockTest(results: TestResults, days: int, realPrices: dict[str, list[float]]) -> None:
+    from matplotlib import pyplot as plt
+
     # Plot results
     print("Plotting results...")
 
@@ -331,6 +173,38 @@ def graphMultiStockTest(results: TestResults, days: int, realPrices: dict[str, l
     plt.legend()
     plt.show()
 
+# Returns the stats testMultiStock prints for results, over days days
+def summarizeResults(results: TestResults, days: int, startingMoney: float = 100.0) -> dict[str, float]:
+    # Calculate % profit and annualized return
+    profit = results.money - startingMoney
+    profitPercent = profit / startingMoney
+
+    years = days / 365
+    annualizedReturn = (1 + profitPercent) ** (1 / years) - 1 if years > 0 else 0.0
+
+    # Calculate win rate
+    trades = results.wins + results.losses
+    winRate = results.wins / trades if trades > 0 else 0.0
+
+    summary = {
+        "years": years,
+        "money": results.money,
+        "profit": profit,
+        "profitPercent": profitPercent,
+        "annualizedReturn": annualizedReturn,
+        "wins": results.wins,
+        "losses": results.losses,
+        "trades": trades,
+        "winRate": winRate
+    }
+
+    if results.metrics is not None:
+        metricsSummary = results.metrics.getSummary()
+        for name in ["sharpe", "sortino", "volatility", "maxDrawdown", "turnover", "exposure"]:
+            summary[name] = metricsSummary[name]
+
+    return summary
+
 def testMultiStock(symbols: list[str], timesteps: int = 40, days: int = 365 * 10, trainingRatio: float = 0.8, offsetDays: int = 0, \
         trainingDays: int = 0) -> None:
     overallStartTime = pandas.Timestamp.now()
@@ -342,29 +216,28 @@ def testMultiStock(symbols: list[str], timesteps: int = 40, days: int = 365 * 10
     # Get predicted and real prices for each stock
     (predictedChanges, realPrices) = \
         getPredictedChangesAndRealPrices(symbols, timesteps, days, trainingRatio, offsetDays)
+    symbols = list(predictedChanges)
+    if len(symbols) == 0:
+        print("No models could be trained!")
+        return
     
     # Test model
     testResults = testModel(symbols, predictedChanges, realPrices, timesteps)
 
-    # Calculate % profit and annualized return
-    profit = testResults.money - 100
-    profitPercent = profit / 100
-
     days = len(predictedChanges[symbols[0]])
-    years = days / 365
-    annualizedReturn = (1 + profitPercent) ** (1 / years) - 1
+    summary = summarizeResults(testResults, days)
+    profit = summary["profit"]
 
     print("Days Elapsed:", days)
-    print("Years Elapsed:", years)
+    print("Years Elapsed:", summary["years"])
     print("Shares:", testResults.shares)
     print("Money:", testResults.money)
     print("Profit:", round(profit, 2))
-    print("Profit %:", round(profitPercent * 100, 2))
-    print("Annualized Return %:", round(annualizedReturn * 100, 2))
-
-    # Calculate win rate
-    totalTrades = wins + losses
-    print("Win Rate:", wins, "/", totalTrades, "=", str(round(wins / totalTrades, 3) * 100) + "%")
+    print("Profit %:", round(summary["profitPercent"] * 100, 2))
+    print("Annualized Return %:", round(summary["annualizedReturn"] * 100, 2))
+    print("Win Rate:", testResults.wins, "/", summary["trades"], "=", str(round(summary["winRate"], 3) * 100) + "%")
+    if testResults.metrics is not None:
+        print(formatSummary(testResults.metrics.getSummary()))
 
     # Log profit by symbol
     print("Profit by Symbol:")
@@ -387,22 +260,3 @@ if __name__ == "__main__" and multiprocessing.current_process().name == "MainPro
     # testMultiStock(["BAC", "INTC"], days=365*10, trainingDays=365*5, timesteps=10)
     testMultiStock(["BAC", "INTC"], days=365*8, trainingDays=365*4, timesteps=10)
 
-# Testing done on 2/18/24
-
-# 5 years of training, 5 years of testing
-# 20: 2.95, -5.17
-# 10: -7.33
-
-# 3 years of training, 3 years of testing 
-# Timesteps: Annualized Return
-# 20: -6.21, -17.74
-# 10: -13.68, -9.59
-# 5: -14.61, -15.46
-
-# 1 year of training, 1 year of testing
-# Timesteps: Annualized Return
-# 40: 4.88, 3.29
-# 30: 19.96, 11.74, 9.84
-# 20: 7.01, 16.42, 24.5
-# 10: 17.96, 20.78, 34.09
-# 5: 14.89, 17.67, 11.88
\ No newline at end of file
@@ -4,22 +4,38 @@ import platform
 import time
 from pandas import DataFrame
 import pandas
-import yfinance
 from numpy import float64
 
 import sys
 sys.path.append('../AlgoTrader')
-from api import getEquity, getOpenOrders, getPosition, placeBuyOrder, placeSellOrder, tradingClient
+from api import getEquity, getOpenOrders, getPosition, getTradingClient
 from sheets import log, logTransaction
 from predicting import getChange, getChangeTuple, predictPrices
-from training import train
+from modelregistry import getModel
+import modelconfig
+import trainingcontrol
 from stocklist import stocklist
+import marketdata
+import metrics
+import pricestore
+from workerpool import runPool
+import accountstate
+from ordersequencer import runSequence
 from exitflag import exitFlag
 
 symbols = stocklist
 days = 365 * 10 # 10 years works well
 timesteps = 40
 
+# Symbols are predicted in parallel in workerCount processes, each limited to workerThreads TensorFlow threads
+# and workerRamLimitMb of RAM. A workerCount of 1 predicts symbols one at a time in this process
+workerCount = 4
+workerThreads = 2
+workerRamLimitMb = 4096
+
+# Train one model across every symbol instead of one model per symbol. See sharedmodel.py
+sharedModel = False
+
 est = datetime.timezone(datetime.timedelta(hours=-5))
 
 def keyboardExit():
@@ -72,8 +88,8 @@ def getData(symbol: str) -> DataFrame:
     today = pandas.Timestamp.today()
     start_date = today - pandas.Timedelta(days=days)
 
-    log("Downloading data from " + start_date.strftime("%Y-%m-%d") + " to " + today.strftime("%Y-%m-%d") + "...")
-    data = pandas.DataFrame(yfinance.download(symbol, start=start_date, end=today))
+    log("Getting data from " + start_date.strftime("%Y-%m-%d") + " to " + today.strftime("%Y-%m-%d") + "...")
+    data = pricestore.getData(symbol, start_date, today)
     log("Done!")
 
     return data
@@ -81,14 +97,43 @@ def getData(symbol: str) -> DataFrame:
 def dailyTrade() -> None:
     expectedChanges = {}
 
+    # Download new bars for every symbol at once, so getData can read them from the price store
+    today = pandas.Timestamp.today()
+    try:
+        pricestore.updateMany(symbols, today - pandas.Timedelta(days=days), today)
+    except Exception as e:
+        log("Error downloading data for all symbols: " + str(e))
+
+    # Fetch quotes for every symbol together
+    marketdata.setUniverse(symbols)
+
     # Get expected changes for each symbol
     startTime = datetime.datetime.now()
-    for symbol in symbols:
-        try:
-            expectedChanges[symbol] = getExpectedChange(symbol)
-        except Exception as e:
-            log("Error Predicting Symbol (" + symbol + "):" + str(e))
-            expectedChanges[symbol] = 0
+    deadline = trainingcontrol.startRun()
+    if sharedModel:
+        # Only imported when used since it needs TensorFlow
+        from sharedmodel import getSharedExpectedChanges
+        expectedChanges = getSharedExpectedChanges(symbols, getData, timesteps)
+    elif workerCount > 1:
+        # Start the slowest symbols first
+        orderedSymbols = trainingcontrol.orderSymbols(symbols, modelconfig.epochs)
+        results = runPool(getExpectedChange, orderedSymbols, workerCount, workerThreads, workerRamLimitMb, \
+            setup=trainingcontrol.setRunDeadline, setupArgs=(deadline, ))
+        for symbol in symbols:
+            if symbol in results:
+                expectedChanges[symbol] = results[symbol]
+            else:
+                log("Error Predicting Symbol (" + symbol + "): Worker failed")
+                expectedChanges[symbol] = 0
+    else:
+        for symbol in symbols:
+            try:
+                expectedChanges[symbol] = getExpectedChange(symbol)
+            except Exception as e:
+                log("Error Predicting Symbol (" + symbol + "):" + str(e))
+                expectedChanges[symbol] = 0
+
+    trainingcontrol.setRunDeadline(None)
 
     endTime = datetime.datetime.now()
     timeTaken = endTime - startTime
@@ -98,6 +143,9 @@ def dailyTrade() -> None:
 
     cancelOpenOrders()
 
+    # Load the account after cancelling so the cancelled orders' buying power is counted
+    accountstate.refresh()
+
     (buyList, sellList) = generateBuyAndSellLists(expectedChanges)
 
     # Key: symbol, Value: shares
@@ -112,12 +160,13 @@ def dailyTrade() -> None:
 
     # Compute target # of shares
     equity = getEquity()
+    log("Live " + metrics.formatSummary(metrics.recordLiveEquity(equity)))
     buyOrders = {} # Key: symbol, Value: shares
     for symbol, percentage in buyList.items():
         targetValue = percentage * equity
 
         # Get current price
-        price = yfinance.Ticker(symbol).info['bid']
+        price = marketdata.getBid(symbol)
         targetShares = targetValue / price
 
         # Determine adjustment
@@ -140,21 +189,11 @@ def dailyTrade() -> None:
     log("Sell Orders:" + str(sellOrders))
     log("Buy Orders:" + str(buyOrders))
 
-    # Place sell orders
-    for symbol in sellOrders:
-        log("Selling " + str(sellOrders[symbol]) + " shares of " + symbol + "...")
-        placeSellOrder(symbol, sellOrders[symbol])
+    # Place sell orders, then place each buy once the sells have freed up enough buying power
+    runSequence(sellOrders, buyOrders)
 
-    # Wait for a few minutes to allow sell orders to complete
-    log("Waiting for 10 minutes to allow sell orders to be processed...")
-    for i in range(10):
-        time.sleep(60)
-        print("Time remaining: " + str(10 - i) + " minutes...")
-
-    # Place buy orders
-    for symbol in buyOrders:
-        log("Buying " + str(buyOrders[symbol]) + " shares of " + symbol + "...")
-        placeBuyOrder(symbol, buyOrders[symbol])
+    log(marketdata.getStats())
+    log(accountstate.getStats())
 
 def getExpectedChange(symbol: str) -> float:
     log("Getting expected change for " + symbol + "...")
@@ -173,33 +212,27 @@ def getPredictedChange(symbol: str) -> float | None:
     try:
         log("Getting predicted prices for " + symbol + "...")
 
-        # Get data, repeat until data is defined
-        while not 'data' in locals():
-            try:
-                data = getData(symbol)
-            except KeyboardInterrupt:
-                keyboardExit()
-            except Exception as e:
-                log("Error downloading data for " + symbol + ": " + str(e))
-                time.sleep(60)
+        # Get data. The price store retries failed downloads itself
+        data = getData(symbol)
 
         # Train model
         log("Training model for " + symbol + "...")
-        model = train(data, timesteps, symbol)
+        handle = getModel(data, timesteps, symbol)
 
-        if(model == None):
+        if(handle == None):
             log("Model is None!")
-            del data, model
+            del data, handle
             gc.collect()
             return 0
 
+        model = handle.predictor
         log("Done!")
 
         # Get predicted prices
         diff = getChange(model, data[int(len(data) * 0.8):], timesteps)
 
         # Delete unneeded variables to free up ram
-        del model, data
+        del model, handle, data
         gc.collect()
 
         return diff
@@ -215,7 +248,7 @@ def cancelOpenOrders() -> None:
     for order in openOrders:
         # Only cancel orders for symbols we are tracking
         if order.symbol in symbols:
-            tradingClient.cancel_order_by_id(order.id)
+            getTradingClient().cancel_order_by_id(order.id)
             logTransaction(order.symbol, order.id, "CANCEL-" + order.side, order.qty, order.filled_avg_price)
 
 # Returns (buyList, sellList). Buylist is a dict with symbols as keys and percentage as values. SellList is a list of symbols
@@ -1,5 +1,5 @@
 import multiprocessing
-import numpy
+import time
 import pandas
 import psutil
 import yfinance
@@ -8,7 +8,11 @@ import keras
 from keras.models import Sequential
 from keras.layers import Dense, LSTM, Dropout
 
+import modelconfig
+import trainingcontrol
+from modelconfig import getTrainingData
 from sheets import log
+from windowing import trainingWindows
 
 class ModelCallback(keras.callbacks.Callback):
     def __init__(self, label = "Unknown"):
@@ -22,6 +26,18 @@ class ModelCallback(keras.callbacks.Callback):
         if(epoch % 10 == 0):
             print("Epoch " + str(epoch) + " done!")
 
+# Stops training once deadline (from time.time()) has passed
+class BudgetCallback(keras.callbacks.Callback):
+    def __init__(self, deadline: float, label = "Unknown"):
+        super().__init__()
+        self.deadline = deadline
+        self.label = label
+
+    def on_epoch_end(self, epoch, logs=None):
+        if time.time() >= self.deadline:
+            log("Out of training time for " + self.label + "! Stopping after epoch " + str(epoch) + "...")
+            self.model.stop_training = True
+
 def train(symbol: str, days: int, interval: str = "1d", timesteps: int = 60) -> Sequential:
     # Get historical data
     today = pandas.Timestamp.today()
@@ -33,14 +49,39 @@ def train(symbol: str, days: int, interval: str = "1d", timesteps: int = 60) ->
 
     return train(data, timesteps)
 
+def buildModel(timesteps: int) -> Sequential:
+    model = Sequential()
+    for i, (units, dropout) in enumerate(modelconfig.lstmLayers):
+        # All but the last LSTM layer return the full sequence for the next layer
+        returnSequences = i < len(modelconfig.lstmLayers) - 1
+        if i == 0:
+            model.add(LSTM(units=units, return_sequences=returnSequences, input_shape=(timesteps, 1))) # Expand data into 50 neurons
+        else:
+            model.add(LSTM(units=units, return_sequences=returnSequences))
+        model.add(Dropout(dropout)) # Randomly turn off 20% of neurons to prevent overfitting
+    model.add(Dense(units=1)) # Condense data back into 1 piece of data
+
+    # Compile model
+    print("Compiling model...")
+    model.compile(optimizer='adam', loss='mean_squared_error')
+
+    return model
+
 def train(data: pandas.DataFrame, timesteps: int = 40, label: str = "Unknown") -> Sequential | None:
+    result = trainWithScaler(data, timesteps, label)
+    if result is None:
+        return None
+    return result[0]
+
+# Returns (model, scaler), where scaler is the MinMaxScaler fit on the training data. Reproducible training runs for
+# the full modelconfig.epochs without a time budget and doesn't use or save training stats
+def trainWithScaler(data: pandas.DataFrame, timesteps: int = 40, label: str = "Unknown", reproducible: bool = False) \
+    -> tuple[Sequential, MinMaxScaler] | None:
     try:
         # Configure model
         log("Configuring model... Process:", multiprocessing.current_process().name)
 
-        trainingRatio = 0.8 # What % of data to use for training
-
-        trainData = data[:int(len(data) * trainingRatio)]
+        trainData = getTrainingData(data)
 
         # Scale data
         scaler = MinMaxScaler(feature_range=(0, 1))
@@ -48,45 +89,64 @@ def train(data: pandas.DataFrame, timesteps: int = 40, label: str = "Unknown") -
 
         # Add timesteps
         print("Adding timesteps...")
-        xTrain = []
-        yTrain = []
-        for i in range(timesteps, len(scaled_data)):
-            xTrain.append(scaled_data[i - timesteps:i, 0])
-            yTrain.append(scaled_data[i, 0])
-        xTrain, yTrain = numpy.array(xTrain), numpy.array(yTrain)
-        xTrain = numpy.reshape(xTrain, (xTrain.shape[0], xTrain.shape[1], 1))
+        (xTrain, yTrain) = trainingWindows(scaled_data[:, 0], timesteps)
 
         # Clear session to maintain performance
         keras.backend.clear_session()
 
         # Configure layers
         print("Configuring layers...")
-        model = Sequential()
-        model.add(LSTM(units=50, return_sequences=True, input_shape=(xTrain.shape[1], 1))) # Expand data into 50 neurons
-        model.add(Dropout(0.2)) # Randomly turn off 20% of neurons to prevent overfitting
-        model.add(LSTM(units=50, return_sequences=True))
-        model.add(Dropout(0.2))
-        model.add(LSTM(units=50))
-        model.add(Dropout(0.2))
-        model.add(Dense(units=1)) # Condense data back into 1 piece of data
-
-        # Compile model
-        print("Compiling model...")
-        model.compile(optimizer='adam', loss='mean_squared_error')
+        model = buildModel(timesteps)
 
         # Record starting time
         startTime = pandas.Timestamp.today()
 
-        # Train model
-        log("Training model...")
-        model.fit(xTrain, yTrain, epochs=100, batch_size=32, callbacks=[ModelCallback(label)])
+        # Train model until validation loss stops improving or we run out of time
+        maxEpochs = trainingcontrol.getMaxEpochs(label, modelconfig.epochs, reproducible)
+        log("Training model for up to " + str(maxEpochs) + " epochs...")
+        earlyStopping = keras.callbacks.EarlyStopping(monitor="val_loss", patience=trainingcontrol.patience, \
+            restore_best_weights=True)
+        callbacks = [ModelCallback(label), earlyStopping]
+        if not reproducible:
+            callbacks.append(BudgetCallback(trainingcontrol.getDeadline(), label))
+        history = model.fit(xTrain, yTrain, epochs=maxEpochs, batch_size=modelconfig.batchSize, \
+            validation_split=trainingcontrol.validationSplit, callbacks=callbacks)
 
         # Log training time
         endTime = pandas.Timestamp.today()
         timeTaken = endTime - startTime
-        log("Done! Training time: " +  str(timeTaken))
+        log("Done! Training time: " +  str(timeTaken) + " Epochs: " + str(len(history.history["loss"])))
+        if not reproducible:
+            trainingcontrol.recordTraining(label, history.history, timeTaken.total_seconds())
 
-        return model
+        return (model, scaler)
     except Exception as e:
         log("Error Training Model: " + str(e))
-        return None
\ No newline at end of file
+        return None
+
+# Continues training an already trained model on only the last newRows rows of the training data
+def fineTune(model: Sequential, scaler: MinMaxScaler, data: pandas.DataFrame, newRows: int, timesteps: int = 40, \
+    label: str = "Unknown") -> Sequential | None:
+    try:
+        log("Fine tuning model on " + str(newRows) + " new rows... Process: " + multiprocessing.current_process().name)
+
+        trainData = getTrainingData(data)
+
+        # Scale data using the scaler the model was originally trained with
+        scaled_data = scaler.transform(trainData)
+
+        # Only use the windows that end on a new row
+        (xTrain, yTrain) = trainingWindows(scaled_data[-(newRows + timesteps):, 0], timesteps)
+
+        startTime = pandas.Timestamp.today()
+
+        model.fit(xTrain, yTrain, epochs=modelconfig.fineTuneEpochs, batch_size=modelconfig.batchSize, \
+            callbacks=[ModelCallback(label), BudgetCallback(trainingcontrol.getDeadline(), label)])
+
+        timeTaken = pandas.Timestamp.today() - startTime
+        log("Done! Fine tuning time: " + str(timeTaken))
+
+        return model
+    except Exception as e:
+        log("Error Fine Tuning Model: " + str(e))
+        return None
@@ -0,0 +1,103 @@
+import json
+import os
+import time
+
+# How many epochs each symbol needed last time is saved here, one file per symbol
+statsPath = "trainingstats"
+
+# Stop training once validation loss hasn't improved for patience epochs. The validation set is the last
+# validationSplit of the training windows
+validationSplit = 0.1
+patience = 10
+
+# Once a symbol has stats, only run this many times the epochs it needed last time (plus patience)
+epochMargin = 1.5
+
+# Wall clock limits for training a single symbol and for a whole run of dailyTrade
+symbolBudgetSeconds = 15 * 60
+runBudgetSeconds = 2 * 60 * 60
+
+# time.time() when the current run has to be done by, or None if there's no run going
+runDeadline: float | None = None
+
+def startRun() -> float:
+    global runDeadline
+    runDeadline = time.time() + runBudgetSeconds
+    return runDeadline
+
+def setRunDeadline(deadline: float | None) -> None:
+    global runDeadline
+    runDeadline = deadline
+
+# Returns when training a symbol that starts now has to stop
+def getDeadline() -> float:
+    deadline = time.time() + symbolBudgetSeconds
+    if runDeadline is not None:
+        deadline = min(deadline, runDeadline)
+    return deadline
+
+def getSettings() -> str:
+    return "validationSplit=" + str(validationSplit) + ",patience=" + str(patience) + ",epochMargin=" + str(epochMargin)
+
+def getStatsPath(label: str) -> str:
+    return os.path.join(statsPath, label.replace("/", "-") + ".json")
+
+def loadStats(label: str) -> dict | None:
+    try:
+        with open(getStatsPath(label), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+# Saves how training went so the next run can plan around it
+def recordTraining(label: str, history: dict, timeTaken: float) -> None:
+    epochsRun = len(history["loss"])
+    if epochsRun == 0:
+        return
+
+    if "val_loss" in history:
+        valLoss = history["val_loss"]
+        bestEpoch = valLoss.index(min(valLoss)) + 1
+    else:
+        bestEpoch = epochsRun
+
+    stats = {
+        "epochsRun": epochsRun,
+        "bestEpoch": bestEpoch,
+        "secondsPerEpoch": timeTaken / epochsRun,
+        "trainingTime": timeTaken,
+        "time": time.time()
+    }
+
+    os.makedirs(statsPath, exist_ok=True)
+    tempPath = getStatsPath(label) + "." + str(os.getpid()) + ".tmp"
+    with open(tempPath, "w") as file:
+        json.dump(stats, file)
+    os.replace(tempPath, getStatsPath(label))
+
+# Returns how many epochs to train label for, based on how many it needed last time
+def getEpochs(label: str, maxEpochs: int) -> int:
+    stats = loadStats(label)
+    if stats is None:
+        return maxEpochs
+    return max(1, min(maxEpochs, int(stats["bestEpoch"] * epochMargin) + patience))
+
+# Returns the most epochs label will be trained for. Reproducible training always uses maxEpochs, so the model doesn't
+# depend on what was trained before
+def getMaxEpochs(label: str, maxEpochs: int, reproducible: bool = False) -> int:
+    return maxEpochs if reproducible else getEpochs(label, maxEpochs)
+
+# Returns how long training label is expected to take, in seconds
+def getExpectedTime(label: str, maxEpochs: int) -> float | None:
+    stats = loadStats(label)
+    if stats is None:
+        return None
+    return stats["secondsPerEpoch"] * getEpochs(label, maxEpochs)
+
+# Orders symbols slowest first, so the slowest symbols don't end up starting last in the pool.
+# Symbols without stats go first since they'll run for the full maxEpochs
+def orderSymbols(symbols: list[str], maxEpochs: int) -> list[str]:
+    def sortKey(symbol: str) -> float:
+        expectedTime = getExpectedTime(symbol, maxEpochs)
+        return float("inf") if expectedTime is None else expectedTime
+    return sorted(symbols, key=sortKey, reverse=True)
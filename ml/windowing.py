@@ -0,0 +1,18 @@
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Returns every window of timesteps consecutive values as a read-only (n, timesteps, 1) view of values.
+# Window k is values[k:k + timesteps], so nothing is copied no matter how many windows there are.
+def slidingWindows(values: numpy.ndarray, timesteps: int) -> numpy.ndarray:
+    values = numpy.asarray(values).reshape(-1)
+
+    if len(values) < timesteps:
+        return numpy.empty((0, timesteps, 1), dtype=values.dtype)
+
+    windows = sliding_window_view(values, timesteps) # Already read-only
+    return windows[:, :, numpy.newaxis]
+
+# Returns (xTrain, yTrain), where xTrain[k] is the timesteps values before yTrain[k]
+def trainingWindows(values: numpy.ndarray, timesteps: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    values = numpy.asarray(values).reshape(-1)
+    return (slidingWindows(values[:-1], timesteps), values[timesteps:])
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+import psutil
+
+from sheets import log
+
+# Kills this worker if its RAM usage goes over ramLimitMb. The pool sees it as a broken worker and retries its item
+def watchRam(ramLimitMb: int) -> None:
+    process = psutil.Process()
+    while True:
+        ramUsage = process.memory_info().rss / 1024 ** 2
+        if ramUsage > ramLimitMb:
+            log("Worker " + multiprocessing.current_process().name + " is using " + str(round(ramUsage)) + \
+                " mb of RAM, over the limit of " + str(ramLimitMb) + " mb! Exiting...")
+            os._exit(1)
+        time.sleep(1)
+
+def initWorker(threads: int, ramLimitMb: int | None, setup: Callable | None, setupArgs: tuple) -> None:
+    # Limit how many threads TensorFlow and NumPy use so workers don't fight over cores.
+    # TensorFlow reads these when it's imported, so workers that only predict with NumPy never have to import it
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["OPENBLAS_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    # If TensorFlow was already imported, set the limits directly
+    if "tensorflow" in sys.modules:
+        tensorflow = sys.modules["tensorflow"]
+        try:
+            tensorflow.config.threading.set_intra_op_parallelism_threads(threads)
+            tensorflow.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError as e:
+            log("Could not limit TensorFlow threads: " + str(e))
+
+    if ramLimitMb is not None:
+        threading.Thread(target=watchRam, args=(ramLimitMb, ), daemon=True).start()
+
+    if setup is not None:
+        setup(*setupArgs)
+
+# Runs function(item) for each item in a pool of workerCount processes and returns {item: result}.
+# Each worker only handles 1 item so its memory is freed afterwards. If a worker crashes or runs out of RAM, the
+# items that didn't finish are retried in a new pool up to retries times. Items that still fail are left out of the results.
+# setup(*setupArgs) is run in each worker when it starts, for state that has to be copied over from this process
+def runPool(function: Callable, items: list, workerCount: int, threads: int = 1, ramLimitMb: int | None = None, \
+    retries: int = 1, setup: Callable | None = None, setupArgs: tuple = ()) -> dict:
+    results = {}
+    pending = list(items)
+
+    # Spawn works everywhere and doesn't copy TensorFlow's state from this process
+    context = multiprocessing.get_context("spawn")
+
+    for attempt in range(retries + 1):
+        if len(pending) == 0:
+            break
+
+        if attempt > 0:
+            log("Retrying " + str(len(pending)) + " items in a new pool: " + str(pending))
+
+        failed = []
+        with ProcessPoolExecutor(max_workers=min(workerCount, len(pending)), mp_context=context, \
+            initializer=initWorker, initargs=(threads, ramLimitMb, setup, setupArgs), max_tasks_per_child=1) as pool:
+            futures = {pool.submit(function, item): item for item in pending}
+
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    results[item] = future.result()
+                except BrokenProcessPool:
+                    log("Worker for " + str(item) + " stopped unexpectedly!")
+                    failed.append(item)
+                except Exception as e:
+                    log("Error in worker for " + str(item) + ": " + str(e))
+                    failed.append(item)
+
+        pending = failed
+
+    return results
@@ -0,0 +1,205 @@
+from __future__ import annotations
+import asyncio
+import random
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable
+import accountstate
+from api import getTradingClient, prepareBuyOrder, prepareSellOrder
+from sheets import log
+
+if TYPE_CHECKING:
+    from alpaca.trading.requests import MarketOrderRequest
+    from alpaca.broker.client import Order
+
+# Submits orders to Alpaca with rate limiting and retries. placeOrders prepares a whole batch of orders from the cached
+# account and quotes, then submits them concurrently.
+# Every order gets a client order id before its first attempt, and retries reuse it, so Alpaca rejects a retry of an
+# order it already received instead of placing it twice.
+# api.getTradingClient turns off alpaca-py's own retries, so these limits and backoffs are the only ones
+
+requestsPerMinute = 200 # Alpaca's limit for the whole account
+burst = 20 # How many requests can be sent at once before the limit kicks in
+
+# Each endpoint also has its own limit, so retries of one kind of request can't use up the whole account's limit
+endpointRequestsPerMinute = {"submit_order": 150, "get_order_by_client_id": 60}
+
+maxRetries = 4
+backoffBase = 0.25 # Seconds
+backoffCap = 8.0
+retryStatuses = (429, 500, 502, 503, 504)
+
+maxConcurrentOrders = 10
+
+class TokenBucket:
+    def __init__(self, perMinute: float, capacity: float):
+        self.rate = perMinute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updateTime = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Takes a token and returns how many seconds to wait before using it. Tokens can go negative, so requests that
+    # arrive together are spaced out instead of all waking at the same time
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updateTime) * self.rate)
+            self.updateTime = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+accountBucket = TokenBucket(requestsPerMinute, burst)
+endpointBuckets = {endpoint: TokenBucket(perMinute, burst) for endpoint, perMinute in endpointRequestsPerMinute.items()}
+
+# Returns how long to wait before sending a request to endpoint
+def reserve(endpoint: str) -> float:
+    wait = accountBucket.reserve()
+    if endpoint in endpointBuckets:
+        wait = max(wait, endpointBuckets[endpoint].reserve())
+    return wait
+
+# Random wait between 0 and an exponentially growing limit, so retries from many orders don't line up
+def getBackoff(attempt: int) -> float:
+    return random.uniform(0, min(backoffCap, backoffBase * 2 ** attempt))
+
+def makeClientOrderId(symbol: str, side: str) -> str:
+    return "algotrader-" + symbol.replace("/", "") + "-" + side + "-" + uuid.uuid4().hex[:16]
+
+def getStatus(error: Exception) -> int | None:
+    try:
+        return getattr(error, "status_code", None)
+    except Exception:
+        return None
+
+def isRetryable(error: Exception) -> bool:
+    import requests
+
+    status = getStatus(error)
+    if status is not None:
+        return status in retryStatuses
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+# Alpaca rejects orders that reuse a client order id with a 422
+def isDuplicate(error: Exception) -> bool:
+    return getStatus(error) == 422 and "client_order_id" in str(error)
+
+# Returns the order with orderData's client order id, or None if Alpaca never received it
+def findOrder(orderData: MarketOrderRequest) -> Order | None:
+    time.sleep(reserve("get_order_by_client_id"))
+    try:
+        return getTradingClient().get_order_by_client_id(orderData.client_order_id)
+    except Exception as e:
+        if getStatus(e) == 404:
+            return None
+        raise
+
+# Calls onRetry, returning None if it fails in a way that might go away, so the call is retried anyway
+def checkBeforeRetry(endpoint: str, onRetry: Callable):
+    try:
+        return onRetry()
+    except Exception as e:
+        if not isRetryable(e):
+            raise
+        log("Error checking " + endpoint + " before retrying, retrying anyway: " + str(e))
+        return None
+
+# Calls function, retrying failures that might go away. onRetry is called before each retry and can return a result to
+# use instead of retrying
+def callWithRetries(endpoint: str, function: Callable, args: tuple = (), onRetry: Callable | None = None):
+    for attempt in range(maxRetries + 1):
+        time.sleep(reserve(endpoint))
+        try:
+            return function(*args)
+        except Exception as e:
+            if attempt == maxRetries or not isRetryable(e):
+                raise
+            log("Error calling " + endpoint + ", retrying: " + str(e))
+
+        time.sleep(getBackoff(attempt))
+        if onRetry is not None:
+            result = checkBeforeRetry(endpoint, onRetry)
+            if result is not None:
+                return result
+
+async def callWithRetriesAsync(endpoint: str, function: Callable, args: tuple = (), onRetry: Callable | None = None):
+    for attempt in range(maxRetries + 1):
+        await asyncio.sleep(reserve(endpoint))
+        try:
+            return await asyncio.to_thread(function, *args)
+        except Exception as e:
+            if attempt == maxRetries or not isRetryable(e):
+                raise
+            log("Error calling " + endpoint + ", retrying: " + str(e))
+
+        await asyncio.sleep(getBackoff(attempt))
+        if onRetry is not None:
+            result = await asyncio.to_thread(checkBeforeRetry, endpoint, onRetry)
+            if result is not None:
+                return result
+
+def submit(orderData: MarketOrderRequest) -> Order:
+    try:
+        return getTradingClient().submit_order(orderData)
+    except Exception as e:
+        # An earlier attempt got through even though it failed here
+        if isDuplicate(e):
+            order = findOrder(orderData)
+            if order is not None:
+                return order
+        raise
+
+# Submits an order, retrying if it fails. A failed attempt may still have been received, so it's looked up by its
+# client order id before being sent again
+def submitOrder(orderData: MarketOrderRequest) -> Order:
+    return callWithRetries("submit_order", submit, (orderData, ), lambda: findOrder(orderData))
+
+async def submitOrderAsync(orderData: MarketOrderRequest) -> Order:
+    return await callWithRetriesAsync("submit_order", submit, (orderData, ), lambda: findOrder(orderData))
+
+# orders is {symbol: shares} and side is "buy" or "sell". Returns {symbol: order id} of the orders that were placed
+async def placeOrdersAsync(orders: dict[str, float], side: str) -> dict[str, str]:
+    # Preparing only reads the cached account and quotes, so it's done one at a time. Buys are sized with the buying
+    # power left after the orders before them
+    prepared = {} # Key: symbol, Value: (order data, price)
+    balance = accountstate.getBuyingPower() if side == "buy" else None
+    for symbol, shares in orders.items():
+        try:
+            if side == "buy":
+                result = prepareBuyOrder(symbol, shares, balance)
+                if result is not None:
+                    balance -= float(result[0].qty) * result[1]
+            else:
+                orderData = prepareSellOrder(symbol, shares)
+                result = (orderData, None) if orderData is not None else None
+        except Exception as e:
+            log("Error preparing " + side + " order for " + symbol + ": " + str(e))
+            result = None
+
+        if result is not None:
+            prepared[symbol] = result
+
+    semaphore = asyncio.Semaphore(maxConcurrentOrders)
+    async def place(symbol: str, orderData: MarketOrderRequest, price: float | None) -> str | None:
+        async with semaphore:
+            try:
+                order = await submitOrderAsync(orderData)
+            except Exception as e:
+                log("Error placing " + side + " order for " + symbol + ": " + str(e))
+                return None
+
+        if price is not None:
+            accountstate.reserve(order.id, float(orderData.qty), price)
+        return str(order.id)
+
+    orderIds = await asyncio.gather(*[place(symbol, orderData, price) for symbol, (orderData, price) in prepared.items()])
+
+    placed = {symbol: orderId for symbol, orderId in zip(prepared, orderIds) if orderId is not None}
+    log("Placed " + str(len(placed)) + " of " + str(len(orders)) + " " + side + " orders")
+    return placed
+
+def placeOrders(orders: dict[str, float], side: str) -> dict[str, str]:
+    if len(orders) == 0:
+        return {}
+    return asyncio.run(placeOrdersAsync(orders, side))
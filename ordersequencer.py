@@ -0,0 +1,88 @@
+from __future__ import annotations
+import time
+import accountstate
+import marketdata
+from api import getTradingClient
+from orderexecution import callWithRetries, placeOrders
+from sheets import log
+
+# Places sell orders, then places each buy order as soon as the sells' fills have freed up enough buying power, instead
+# of waiting a fixed time. Fills come from the trade stream through accountstate, so api.startStreamProcess has to be
+# running for buys to go out straight away. Without it, or if no update has come from it in pollRefreshSeconds, order
+# statuses and the account are polled every pollRefreshSeconds instead
+
+timeoutSeconds = 600 # Buys that still can't be afforded after this long are placed with whatever buying power there is
+checkSeconds = 0.5 # How often to check for fills
+pollRefreshSeconds = 15
+
+doneEvents = ("fill", "canceled", "expired", "rejected", "done_for_day")
+doneStatuses = ("filled", "canceled", "expired", "rejected", "done_for_day")
+
+# Returns whether every sell order has finished, filled or not
+def sellsDone(sellIds: dict[str, str]) -> bool:
+    return all(accountstate.orderStates.get(orderId, ("new", 0.0))[0] in doneEvents for orderId in sellIds)
+
+# Checks each unfinished sell order's status with a request, for when the stream isn't running
+def pollSells(sellIds: dict[str, str]) -> None:
+    for orderId in sellIds:
+        state = accountstate.orderStates.get(orderId, ("new", 0.0))
+        if state[0] in doneEvents:
+            continue
+
+        order = callWithRetries("get_order_by_id", getTradingClient().get_order_by_id, (orderId, ))
+        status = str(getattr(order.status, "value", order.status))
+        filledQty = float(order.filled_qty or 0)
+        accountstate.orderStates[orderId] = ("fill" if status == "filled" else status if status in doneStatuses \
+            else "partial_fill" if filledQty > 0 else state[0], filledQty)
+    accountstate.refresh()
+
+# sellOrders and buyOrders are {symbol: shares}. Returns {symbol: order id} of the buy orders that were placed
+def runSequence(sellOrders: dict[str, float], buyOrders: dict[str, float], timeout: float = timeoutSeconds) \
+    -> dict[str, str]:
+    startTime = time.time()
+
+    log("Selling " + str(sellOrders) + "...")
+    sellIds = {orderId: symbol for symbol, orderId in placeOrders(sellOrders, "sell").items()} # Key: order id
+
+    waitingBuys = dict(buyOrders)
+    buyIds = {}
+    lastPoll = time.time()
+
+    while len(waitingBuys) > 0:
+        # Getting the buying power applies the fills that have come in
+        buyingPower = accountstate.getBuyingPower()
+        done = sellsDone(sellIds)
+        timedOut = time.time() - startTime > timeout
+        if timedOut and not done:
+            unfilled = [symbol for orderId, symbol in sellIds.items() \
+                if accountstate.orderStates.get(orderId, ("new", 0.0))[0] not in doneEvents]
+            log("Timed out waiting for sell orders to fill: " + str(unfilled) + ". Placing the remaining buys...")
+
+        # Place every buy that can be afforded now together. Once the sells are done or it's timed out, place the
+        # rest, and they'll be sized down to the buying power there is
+        affordable = {}
+        for symbol, shares in waitingBuys.items():
+            cost = shares * marketdata.getAsk(symbol)
+            if cost <= buyingPower or done or timedOut:
+                affordable[symbol] = shares
+                buyingPower -= cost
+
+        if len(affordable) > 0:
+            log("Buying " + str(affordable) + "...")
+            buyIds.update(placeOrders(affordable, "buy"))
+            for symbol in affordable:
+                del waitingBuys[symbol]
+
+        if len(waitingBuys) == 0 or done or timedOut:
+            break
+
+        time.sleep(checkSeconds)
+        # The stream may have died or never connected, so it only counts while updates are coming from it
+        lastUpdate = max(accountstate.lastUpdateTime, startTime)
+        streaming = accountstate.updateQueue is not None and time.time() - lastUpdate <= pollRefreshSeconds
+        if not streaming and time.time() - lastPoll > pollRefreshSeconds:
+            pollSells(sellIds)
+            lastPoll = time.time()
+
+    log("Order sequence finished in " + str(round(time.time() - startTime, 1)) + " seconds")
+    return buyIds
@@ -0,0 +1,205 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import random
+import sys
+import threading
+import time
+from typing import Callable
+import env
+
+# Streams crypto quotes from Alpaca's websocket into an in-memory book of the latest bid/ask for each pair, and calls
+# subscribers whenever a pair's bid or ask changes, so prices can be acted on as soon as they move instead of polling.
+# Only the stream's thread writes to the book, and each pair's entry is replaced with a new tuple instead of being
+# changed, so other threads can read entries by pair without a lock. quotes has the same shape as cryptoquotes'
+# snapshots, so it can be passed anywhere a snapshot is used.
+# StandInServer speaks the same protocol locally, for trying the stream out without Alpaca
+
+class QuoteStream:
+    def __init__(self, pairs: list[str], depth: int = 0, url: str | None = None):
+        self.pairs = list(pairs)
+        self.depth = depth # Order book levels to keep on each side. 0 only keeps the best bid and ask
+        self.url = url # None uses Alpaca's
+
+        self.quotes: dict[str, tuple[float, float]] = {} # Key: pair, Value: (bid, ask)
+        self.books: dict[str, tuple[tuple, tuple]] = {} # Key: pair, Value: ((bid, size)..., (ask, size)...)
+        self.levels: dict[str, tuple[dict, dict]] = {} # Key: pair, Value: ({bid: size}, {ask: size}). Stream only
+
+        self.subscribers: list[Callable[[str, float, float], None]] = []
+        self.stats = {"messages": 0, "changes": 0, "errors": 0}
+        self.ready = threading.Event() # Set once every pair has a quote
+
+        self.stream = None
+        self.thread: threading.Thread | None = None
+
+    # callback(pair, bid, ask) is called from the stream's thread whenever a pair's bid or ask changes, so it should
+    # return quickly
+    def subscribe(self, callback: Callable[[str, float, float], None]) -> None:
+        self.subscribers.append(callback)
+
+    def publish(self, pair: str, bid: float, ask: float) -> None:
+        self.stats["changes"] += 1
+        for callback in self.subscribers:
+            try:
+                callback(pair, bid, ask)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print("Error in quote subscriber: " + str(e))
+
+    def setQuote(self, pair: str, bid: float, ask: float) -> None:
+        if self.quotes.get(pair) == (bid, ask):
+            return
+        self.quotes[pair] = (bid, ask)
+        if not self.ready.is_set() and len(self.quotes) >= len(self.pairs):
+            self.ready.set()
+        self.publish(pair, bid, ask)
+
+    async def onQuote(self, message: dict) -> None:
+        self.stats["messages"] += 1
+        self.setQuote(message["S"], float(message["bp"]), float(message["ap"]))
+
+    async def onOrderbook(self, message: dict) -> None:
+        self.stats["messages"] += 1
+        pair = message["S"]
+
+        # Reset messages have the whole book, the others only the levels that changed, with size 0 for removed levels
+        if message.get("r", False) or pair not in self.levels:
+            self.levels[pair] = ({}, {})
+        (bids, asks) = self.levels[pair]
+        for (side, updates) in ((bids, message.get("b", [])), (asks, message.get("a", []))):
+            for level in updates:
+                if level["s"] == 0:
+                    side.pop(level["p"], None)
+                else:
+                    side[level["p"]] = level["s"]
+
+        topBids = tuple(heapq.nlargest(self.depth, bids.items()))
+        topAsks = tuple(heapq.nsmallest(self.depth, asks.items()))
+        self.books[pair] = (topBids, topAsks)
+        if len(topBids) > 0 and len(topAsks) > 0:
+            self.setQuote(pair, float(topBids[0][0]), float(topAsks[0][0]))
+
+    # Starts streaming in a background thread
+    def start(self) -> None:
+        from alpaca.data.live.crypto import CryptoDataStream
+
+        self.stream = CryptoDataStream(env.alpacaId, env.alpacaSecret, raw_data=True, url_override=self.url)
+        self.stream.subscribe_quotes(self.onQuote, *self.pairs)
+        if self.depth > 0:
+            self.stream.subscribe_orderbooks(self.onOrderbook, *self.pairs)
+
+        self.thread = threading.Thread(target=self.stream.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.stream is not None:
+            self.stream.stop()
+            self.thread.join(timeout=10)
+
+    # Returns whether every pair had a quote within timeout seconds
+    def waitForQuotes(self, timeout: float | None = None) -> bool:
+        return self.ready.wait(timeout)
+
+# Websocket server that acts like Alpaca's crypto data stream. Quotes sent with publish go to every connection
+# subscribed to the pair
+class StandInServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.server = None
+        self.stopped: asyncio.Event | None = None
+        self.connections: dict = {} # Key: connection, Value: set of subscribed pairs
+        self.started = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        return "ws://" + self.host + ":" + str(self.port)
+
+    async def handle(self, connection) -> None:
+        import msgpack
+
+        await connection.send(msgpack.packb([{"T": "success", "msg": "connected"}]))
+        subscribed = set()
+        try:
+            async for raw in connection:
+                message = msgpack.unpackb(raw)
+                if message.get("action") == "auth":
+                    await connection.send(msgpack.packb([{"T": "success", "msg": "authenticated"}]))
+                elif message.get("action") == "subscribe":
+                    subscribed.update(message.get("quotes", []) + message.get("orderbooks", []))
+                    self.connections[connection] = subscribed
+                    await connection.send(msgpack.packb([{"T": "subscription", "quotes": message.get("quotes", []), \
+                        "orderbooks": message.get("orderbooks", [])}]))
+        finally:
+            self.connections.pop(connection, None)
+
+    async def serve(self) -> None:
+        from websockets.asyncio.server import serve
+
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        async with serve(self.handle, self.host, self.port) as self.server:
+            self.port = self.server.sockets[0].getsockname()[1]
+            self.started.set()
+            await self.stopped.wait()
+
+    def start(self) -> StandInServer:
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(), ), daemon=True)
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join(timeout=10)
+
+    async def send(self, messages: list[dict]) -> None:
+        import msgpack
+
+        for connection, subscribed in list(self.connections.items()):
+            toSend = [message for message in messages if message["S"] in subscribed]
+            if len(toSend) > 0:
+                await connection.send(msgpack.packb(toSend))
+
+    # Sends quotes, a {pair: (bid, ask)} dict, as one message. Can be called from any thread
+    def publish(self, quotes: dict[str, tuple[float, float]]) -> None:
+        messages = [{"T": "q", "S": pair, "bp": bid, "bs": 1.0, "ap": ask, "as": 1.0} \
+            for pair, (bid, ask) in quotes.items()]
+        asyncio.run_coroutine_threadsafe(self.send(messages), self.loop).result()
+
+    # Sends order book levels, lists of (price, size), for pair. reset replaces the whole book
+    def publishOrderbook(self, pair: str, bids: list[tuple[float, float]], asks: list[tuple[float, float]], \
+        reset: bool = False) -> None:
+        message = {"T": "o", "S": pair, "b": [{"p": price, "s": size} for price, size in bids], \
+            "a": [{"p": price, "s": size} for price, size in asks], "r": reset}
+        asyncio.run_coroutine_threadsafe(self.send([message]), self.loop).result()
+
+# Publishes random walk quotes for pairs every interval seconds, starting from prices, a {pair: price} dict
+def runRandomWalk(server: StandInServer, prices: dict[str, float], interval: float = 0.1, spread: float = 0.0005) \
+    -> None:
+    while True:
+        pair = random.choice(list(prices))
+        prices[pair] *= 1 + random.gauss(0, 0.0005)
+        server.publish({pair: (prices[pair] * (1 - spread), prices[pair] * (1 + spread))})
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    # python quotestream.py standin [port]: Runs a stand-in server with random walk quotes
+    # python quotestream.py [url] <pair>...: Prints every quote change, from url if it starts with ws
+    if len(sys.argv) > 1 and sys.argv[1] == "standin":
+        server = StandInServer(port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765).start()
+        print("Stand-in server running at", server.url)
+        runRandomWalk(server, {"BTC/USD": 60000.0, "ETH/USD": 3000.0, "ETH/BTC": 0.05})
+    else:
+        url = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1].startswith("ws") else None
+        pairs = [pair for pair in sys.argv[1:] if not pair.startswith("ws")] or ["BTC/USD"]
+        stream = QuoteStream(pairs, url=url)
+        stream.subscribe(lambda pair, bid, ask: print(pair, "Bid:", bid, "Ask:", ask))
+        stream.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stream.stop()
@@ -0,0 +1,210 @@
+from __future__ import annotations
+import asyncio
+import json
+import statistics
+import sys
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Callable, Iterator
+
+import accountstate
+import api
+import assetindex
+
+if TYPE_CHECKING:
+    from alpaca.trading.models import TradeUpdate
+
+# Records trade updates from the Alpaca stream to a file and plays them back through api.updateHandler, so the
+# fill -> next order path can be tested and profiled without a live stream.
+# Each line of a recording is {"t": time received, "d": the trade update, "s": shared data at the time}
+
+class Recorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, data: TradeUpdate, sharedData=None) -> None:
+        entry = {"t": time.time(), "d": data.model_dump(mode="json", exclude_none=True)}
+        if sharedData is not None:
+            entry["s"] = dict(sharedData)
+
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self.lock:
+            with open(self.path, "a") as file:
+                file.write(line)
+
+# Yields (time received, trade update, shared data or None) for each line of a recording
+def loadUpdates(path: str) -> Iterator[tuple[float, TradeUpdate, dict | None]]:
+    from alpaca.trading.models import TradeUpdate
+
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip() == "":
+                continue
+            entry = json.loads(line)
+            yield (entry["t"], TradeUpdate.model_validate(entry["d"]), entry.get("s"))
+
+# What FakeTradingClient raises for symbols it doesn't have, like Alpaca's 404
+class NotFoundError(Exception):
+    status_code = 404
+
+# Stands in for Alpaca's TradingClient. Orders are kept in submittedOrders instead of being sent anywhere
+class FakeTradingClient:
+    def __init__(self, buyingPower: float = 1000.0, equity: float | None = None, \
+        positions: dict[str, float] | None = None, assets: set[str] | None = None):
+        self.buyingPower = buyingPower
+        self.equity = equity if equity is not None else buyingPower
+        self.positions = positions or {} # Key: symbol, Value: shares
+        self.assets = assets # Symbols get_asset knows about. None knows about every symbol
+        self.submittedOrders = []
+
+    def get_account(self):
+        return SimpleNamespace(buying_power=str(self.buyingPower), equity=str(self.equity))
+
+    def get_all_positions(self):
+        return [SimpleNamespace(symbol=symbol, qty=str(qty)) for symbol, qty in self.positions.items()]
+
+    def get_all_assets(self, *args, **kwargs):
+        return [SimpleNamespace(symbol=symbol, tradable=True, fractionable=True) for symbol in self.assets or []]
+
+    def get_asset(self, symbol: str):
+        if self.assets is not None and symbol not in self.assets:
+            raise NotFoundError("asset not found for " + symbol)
+        return SimpleNamespace(symbol=symbol, tradable=True, fractionable=True)
+
+    # Returns the orders that haven't finished, like the default GetOrdersRequest does
+    def get_orders(self, *args, **kwargs):
+        return [order for order in self.submittedOrders if order.status in ("new", "accepted", "partially_filled")]
+
+    def cancel_orders(self):
+        return []
+
+    def submit_order(self, orderData):
+        order = SimpleNamespace(id=uuid.uuid4(), symbol=orderData.symbol, qty=orderData.qty, side=orderData.side, \
+            client_order_id=getattr(orderData, "client_order_id", None), submitted_at=time.time(), status="new", \
+            filled_qty=0)
+        self.submittedOrders.append(order)
+        return order
+
+    def get_order_by_id(self, orderId):
+        return next(order for order in self.submittedOrders if str(order.id) == str(orderId))
+
+    def get_order_by_client_id(self, clientId: str):
+        return next(order for order in self.submittedOrders if order.client_order_id == clientId)
+
+class ReplayReport:
+    def __init__(self):
+        self.rows: list[dict] = [] # One per event
+
+    def add(self, data: TradeUpdate, latency: float, ordersSubmitted: int) -> None:
+        self.rows.append({
+            "event": str(data.event.value if hasattr(data.event, "value") else data.event),
+            "symbol": data.order.symbol,
+            "latency": latency,
+            "orders": ordersSubmitted
+        })
+
+    def getSummary(self) -> dict:
+        latencies = sorted(row["latency"] for row in self.rows)
+        if len(latencies) == 0:
+            return {"events": 0}
+        return {
+            "events": len(latencies),
+            "orders": sum(row["orders"] for row in self.rows),
+            "mean": statistics.mean(latencies),
+            "median": statistics.median(latencies),
+            "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+            "max": latencies[-1]
+        }
+
+    def print(self) -> None:
+        for row in self.rows:
+            print(row["event"].ljust(16), row["symbol"].ljust(12), str(round(row["latency"] * 1000, 3)).rjust(10), \
+                "ms", "Orders: " + str(row["orders"]))
+
+        summary = self.getSummary()
+        print("Events:", summary["events"])
+        if summary["events"] > 0:
+            print("Orders submitted:", summary["orders"])
+            print("Handler latency (ms) - Mean:", round(summary["mean"] * 1000, 3), "Median:", \
+                round(summary["median"] * 1000, 3), "P95:", round(summary["p95"] * 1000, 3), "Max:", \
+                round(summary["max"] * 1000, 3))
+
+# Plays a recording back through api.updateHandler with client in place of the real TradingClient. speed multiplies
+# how fast time passes between events, and None plays them as fast as possible. sharedData defaults to the shared
+# data recorded with each event. cryptoPairs is {"PAY/RECEIVE": price}, used instead of fetching prices
+async def replayAsync(path: str, speed: float | None = None, callbacks: list[Callable] | None = None, \
+    sharedData: dict | None = None, client: FakeTradingClient | None = None, \
+    cryptoPairs: dict[str, float] | None = None) -> ReplayReport:
+    client = client if client is not None else FakeTradingClient()
+    report = ReplayReport()
+
+    previousClient = api.tradingClient
+    previousPair = api.getCryptoPair
+    previousCallbacks = api.tradeCallbacks
+    previousSharedData = api.sharedData
+    api.tradingClient = client
+    accountstate.invalidate()
+    assetindex.invalidate()
+    api.tradeCallbacks = list(callbacks or [])
+    if cryptoPairs is not None:
+        api.getCryptoPair = lambda paySymbol, receiveSymbol, tryFlip=True, fresh=False: \
+            cryptoPairs.get(paySymbol + "/" + receiveSymbol, \
+            1 / cryptoPairs[receiveSymbol + "/" + paySymbol] if receiveSymbol + "/" + paySymbol in cryptoPairs else None)
+
+    try:
+        firstTime = None
+        startTime = time.perf_counter()
+        for (receivedTime, data, recordedSharedData) in loadUpdates(path):
+            # Wait until the event's time, sped up by speed
+            if firstTime is None:
+                firstTime = receivedTime
+            if speed is not None:
+                delay = (receivedTime - firstTime) / speed - (time.perf_counter() - startTime)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            api.sharedData = sharedData if sharedData is not None else recordedSharedData
+            orderCount = len(client.submittedOrders)
+
+            handlerStart = time.perf_counter()
+            await api.updateHandler(data)
+            report.add(data, time.perf_counter() - handlerStart, len(client.submittedOrders) - orderCount)
+    finally:
+        api.tradingClient = previousClient
+        api.getCryptoPair = previousPair
+        api.tradeCallbacks = previousCallbacks
+        api.sharedData = previousSharedData
+
+        # Don't leave the replay's orders in the account state
+        accountstate.reservations.clear()
+        accountstate.orderStates.clear()
+        accountstate.snapshotFilled.clear()
+        accountstate.invalidate()
+        assetindex.invalidate()
+
+    return report
+
+def replay(path: str, speed: float | None = None, **kwargs) -> ReplayReport:
+    return asyncio.run(replayAsync(path, speed, **kwargs))
+
+if __name__ == "__main__":
+    # python replay.py record <path>: Records the live paper trading stream to path
+    # python replay.py <path> [speed] [triangle]: Replays path, through triangle/main's callback if triangle is given
+    if len(sys.argv) < 2:
+        print("Usage: python replay.py record <path> | python replay.py <path> [speed] [triangle]")
+        exit()
+
+    if sys.argv[1] == "record":
+        api.initStream([], None, sys.argv[2])
+        exit()
+
+    callbacks = []
+    if "triangle" in sys.argv:
+        from triangle.main import tradeCallback
+        callbacks.append(tradeCallback)
+
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] != "triangle" else None
+    replay(sys.argv[1], speed, callbacks=callbacks).print()
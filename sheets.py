@@ -2,42 +2,53 @@ from datetime import datetime
 import os.path
 from uuid import UUID
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.exceptions import RefreshError
-from googleapiclient.discovery import build
 import psutil
 import platform
 
-from env import sheetsId
+import env
 from ml.stocklist import stocklist
 
-# try:
-#     # If modifying these scopes, delete the file token.json.
-#     SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-
-#     creds = None
-#     # The file token.json stores the user's access and refresh tokens, and is
-#     # created automatically when the authorization flow completes for the first
-#     # time.
-#     if os.path.exists('token.json'):
-#         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-#     # If there are no (valid) credentials available, let the user log in.
-#     if not creds or not creds.valid:
-#         if creds and creds.expired and creds.refresh_token:
-#             creds.refresh(Request())
-#         else:
-#             flow = InstalledAppFlow.from_client_secrets_file('sheetscreds.json', SCOPES)
-#             creds = flow.run_local_server(port=0)
-#         # Save the credentials for the next run
-#         with open('token.json', 'w') as token:
-#             token.write(creds.to_json())
-
-#     service = build('sheets', 'v4', credentials=creds)
-# except RefreshError:
-#     print("Error refreshing sheets token. Try deleting token.json and reauthorizing the application. Exiting...")
-#     exit()
+service = None
+
+# The Google client libraries take a while to import, so they're only imported once the sheets service is needed
+def getService():
+    global service
+    if service is not None:
+        return service
+
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.exceptions import RefreshError
+    from googleapiclient.discovery import build
+
+    try:
+        # If modifying these scopes, delete the file token.json.
+        SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+        creds = None
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if os.path.exists('token.json'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file('sheetscreds.json', SCOPES)
+                creds = flow.run_local_server(port=0)
+            # Save the credentials for the next run
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+
+        service = build('sheets', 'v4', credentials=creds)
+    except RefreshError:
+        print("Error refreshing sheets token. Try deleting token.json and reauthorizing the application. Exiting...")
+        exit()
+
+    return service
 
 def log(msg: str, waitForRam: bool = True) -> None:
     print(msg)
@@ -80,7 +91,7 @@ def insertRowAtTop(sheetId: str) -> None:
         ]
     }
 
-    request = service.spreadsheets().batchUpdate(spreadsheetId=sheetsId, body=requestBody)
+    request = getService().spreadsheets().batchUpdate(spreadsheetId=env.sheetsId, body=requestBody)
     request.execute()
 
 def sort(sheetId: str, sortCol: int) -> None:
@@ -108,7 +119,7 @@ def sort(sheetId: str, sortCol: int) -> None:
         ]
     }
 
-    request = service.spreadsheets().batchUpdate(spreadsheetId=sheetsId, body=requestBody)
+    request = getService().spreadsheets().batchUpdate(spreadsheetId=env.sheetsId, body=requestBody)
     request.execute()
 
 def write(range: str, values: list[list[str]]) -> None:
@@ -120,14 +131,14 @@ def write(range: str, values: list[list[str]]) -> None:
         "values": values
     }
 
-    request = service.spreadsheets().values().update(spreadsheetId=sheetsId, range=range, \
+    request = getService().spreadsheets().values().update(spreadsheetId=env.sheetsId, range=range, \
         valueInputOption="USER_ENTERED", body=requestBody)
     request.execute()
 
 def read(range: str) -> list[list[str]]:
     return
 
-    res = service.spreadsheets().values().get(spreadsheetId=sheetsId, range=range).execute()
+    res = getService().spreadsheets().values().get(spreadsheetId=env.sheetsId, range=range).execute()
     return res.get('values', [])
 
 def logTransaction(symbol: str, id: UUID, event: str, shares: float | str, price: float | str) -> None:
@@ -1,30 +1,39 @@
+from __future__ import annotations
 from multiprocessing.managers import DictProxy
 from time import sleep
-from alpaca.common import RawData
-from alpaca.trading.enums import OrderSide
 from multiprocessing import Manager
+import threading
+import time
+from typing import TYPE_CHECKING
+
+# Alpaca is only imported once a trade update comes in
+if TYPE_CHECKING:
+    from alpaca.common import RawData
 
 import sys
 sys.path.append('../AlgoTrader')
-from api import buyCrypto, getCryptoPair, startStreamProcess, tradeCallbacks
+from api import buyCrypto, startStreamProcess, tradeCallbacks
+import assetindex
+import cryptoquotes
 
-def getTriangle(firstSymbol: str, secondSymbol: str) -> float | None:
+# snapshot is the cryptoquotes snapshot that every triangle in a cycle is compared with
+def getTriangle(firstSymbol: str, secondSymbol: str, snapshot: dict[str, tuple[float, float]]) -> float | None:
     # Get the entry pair
-    entryPair = getCryptoPair(firstSymbol, "USD")
+    entryPair = cryptoquotes.getPair(firstSymbol, "USD", snapshot=snapshot)
     if(entryPair is None):
         print("Entry pair is None")
         return None
     # print("Entry: USD to", firstSymbol, ":", entryPair) 
     
     # Get the middle pair
-    middlePair = getCryptoPair(firstSymbol, secondSymbol)
+    middlePair = cryptoquotes.getPair(firstSymbol, secondSymbol, snapshot=snapshot)
     if(middlePair is None):
         print("Middle pair is None")
         return None
     # print("Middle:", firstSymbol, "to", secondSymbol, ":", middlePair)
     
     # Get the exit pair
-    exitPair = getCryptoPair(secondSymbol, "USD")
+    exitPair = cryptoquotes.getPair(secondSymbol, "USD", snapshot=snapshot)
     if(exitPair is None):
         print("Exit pair is None")
         return None
@@ -34,18 +43,37 @@ def getTriangle(firstSymbol: str, secondSymbol: str) -> float | None:
     return 1 / entryPair * middlePair * exitPair
 
 # Returns (pair, triangle) or None
-def getOptimalTriangle(firstSymbol: str, secondSymbol: str) -> tuple[tuple[str, str], float] | None:
-    triangle = getTriangle(firstSymbol, secondSymbol)
+def getOptimalTriangle(firstSymbol: str, secondSymbol: str, snapshot: dict[str, tuple[float, float]], \
+    tryReverse: bool = True) -> tuple[tuple[str, str], float] | None:
+    triangle = getTriangle(firstSymbol, secondSymbol, snapshot)
 
     if(triangle is None):
         return None
     
     # print("Triangle:", firstSymbol, secondSymbol, ":", triangle)
-    if triangle > 1:
+    if triangle > 1 or not tryReverse:
+        return (firstSymbol, secondSymbol), triangle
+
+    # The quotes don't change within a snapshot, so only go the other way once
+    reverse = getOptimalTriangle(secondSymbol, firstSymbol, snapshot, False)
+    if reverse is None or reverse[1] < triangle:
         return (firstSymbol, secondSymbol), triangle
-    return getOptimalTriangle(secondSymbol, firstSymbol)
+    return reverse
+
+# Returns every pair the triangles need, in the direction it's listed in
+def getQuotePairs() -> list[str]:
+    symbols = set(pairs.keys())
+    quotePairs = []
+    for firstSymbol, partners in pairs.items():
+        symbols.update(partners)
+        for secondSymbol in partners:
+            quotePairs.append(assetindex.getPairDirection(firstSymbol, secondSymbol))
+    quotePairs += [assetindex.getPairDirection(symbol, "USD") for symbol in symbols]
+    return list(dict.fromkeys(pair[0] for pair in quotePairs if pair is not None))
 
 def tradeCallback(data: RawData, transactionOrder: DictProxy):
+    from alpaca.trading.enums import OrderSide
+
     symbol = data.order.symbol
     event = data.event
 
@@ -55,59 +83,144 @@ def tradeCallback(data: RawData, transactionOrder: DictProxy):
 
     if event == "fill":
         print("Transaction Order:", transactionOrder)
-        if baseSymbol in transactionOrder:
-            nextSymbol = transactionOrder[baseSymbol]
+        nextSymbol = transactionOrder.get(baseSymbol)
+        if nextSymbol is not None:
             print("Next symbol:", nextSymbol)
 
-            buyCrypto(nextSymbol, baseSymbol)
+            placeLeg(nextSymbol, baseSymbol, transactionOrder)
         else:
             print("No more transactions to make")
+            transactionOrder.pop(cycleKey, None)
+    elif event in ("canceled", "expired", "rejected") and "/" in symbol:
+        print("Order " + str(event) + ", ending the cycle")
+        transactionOrder.pop(cycleKey, None)
 
-def updateTransactionOrder():
-    print("Updating transaction order...")
+# Buys buySymbol with paySymbol as the next leg of the cycle, ending the cycle if the order can't be placed
+def placeLeg(buySymbol: str, paySymbol: str, transactionOrder: DictProxy) -> None:
+    try:
+        orderId = buyCrypto(buySymbol, paySymbol)
+    except Exception as e:
+        print("Error placing order: " + str(e))
+        orderId = None
 
-    global transactionOrder
-    triangles = {}
+    if orderId is None:
+        print("Couldn't buy", buySymbol, "with", paySymbol + ", ending the cycle")
+        transactionOrder.pop(cycleKey, None)
+    else:
+        transactionOrder[cycleKey] = time.time()
 
+# Returns {(firstSymbol, secondSymbol): triangle} with the best direction of every triangle
+def getTriangles(snapshot: dict[str, tuple[float, float]]) -> dict[tuple[str, str], float]:
+    triangles = {}
     for firstSymbol, partners in pairs.items():
         for secondSymbol in partners:
-            triangle = getOptimalTriangle(firstSymbol, secondSymbol)
+            triangle = getOptimalTriangle(firstSymbol, secondSymbol, snapshot)
             if(triangle is not None):
                 # print(triangle)
                 triangles[triangle[0]] = triangle[1]
             # else:
                 # print("No triangle found for", firstSymbol, secondSymbol)
+    return triangles
 
-    # Find the best triangle
+# Returns the best triangle that makes more than the fees, or None
+def getBestTriangle(triangles: dict[tuple[str, str], float]) -> tuple[str, str] | None:
+    if len(triangles) == 0:
+        return None
     bestTriangle = max(triangles, key=triangles.get)
 
-    # Remove all triangles with profits less than 0.25% (this is the fee for the trade)
+    # Only triangles with profits over 0.25% (this is the fee for the trade) are worth trading
     # See herer: https://docs.alpaca.markets/docs/crypto-fees
-    triangles = {k: v for k, v in triangles.items() if v > 1.0025}
+    return bestTriangle if triangles[bestTriangle] > 1.0025 else None
 
+def setTransactionOrder(triangles: dict[tuple[str, str], float]) -> None:
     global transactionOrder
-    if len(triangles) == 0:
+    bestTriangle = getBestTriangle(triangles)
+    if bestTriangle is None:
         print("No profitable triangles found")
-        print("Best triangle:", bestTriangle)
+        if len(triangles) > 0:
+            print("Best triangle:", max(triangles, key=triangles.get))
 
         # Set everything in transaction to point to USD and delete USD
         for key in transactionOrder.keys():
-            transactionOrder[key] = "USD"
+            if key != cycleKey:
+                transactionOrder[key] = "USD"
         if "USD" in transactionOrder:
             del transactionOrder["USD"]
         
         return
 
-    print("Triangles:", triangles)
+    print("Triangles:", {k: v for k, v in triangles.items() if v > 1.0025})
     print("Best triangle:", bestTriangle, ":", triangles[bestTriangle])
 
-    # print("Best triangle:", bestTriangle, ":", triangles[bestTriangle])
-
     # print("Transaction order before:", transactionOrder)
     transactionOrder["USD"] = bestTriangle[0]
     transactionOrder[bestTriangle[0]] = bestTriangle[1]
     transactionOrder[bestTriangle[1]] = "USD"
 
+def updateTransactionOrder():
+    print("Updating transaction order...")
+
+    # Fetch every pair's quote in one request and compare all the triangles with it
+    cryptoquotes.refreshQuotes()
+    setTransactionOrder(getTriangles(cryptoquotes.quotes))
+
+# transactionOrder[cycleKey] is when the running cycle last placed an order. It's set when a cycle starts and removed
+# by the stream process once the cycle ends, so only one cycle runs at a time. Cycles that haven't placed an order in
+# cycleTimeoutSeconds are taken to have stopped without it being removed, like when the stream process died
+cycleKey = "cycle"
+cycleTimeoutSeconds = 600
+
+# Streaming mode keeps every triangle up to date from the quote stream, and only recalculates the triangles that use a
+# pair when its quote changes. Cycles keep going in the stream process while there's a profitable triangle, and once
+# one has ended, startCycle starts a new one when there's a profitable triangle
+class TriangleWatcher:
+    def __init__(self, stream):
+        self.stream = stream
+        self.triangles = getTriangles(stream.quotes)
+        self.bestTriangle = getBestTriangle(self.triangles)
+
+        self.lock = threading.Lock()
+
+        # Key: pair, Value: every (firstSymbol, secondSymbol) whose triangle uses it
+        self.trianglesByPair: dict[str, list[tuple[str, str]]] = {}
+        for firstSymbol, partners in pairs.items():
+            for secondSymbol in partners:
+                for (buySymbol, paySymbol) in ((firstSymbol, "USD"), (firstSymbol, secondSymbol), (secondSymbol, "USD")):
+                    direction = assetindex.getPairDirection(buySymbol, paySymbol)
+                    if direction is not None:
+                        self.trianglesByPair.setdefault(direction[0], []).append((firstSymbol, secondSymbol))
+
+    def onQuote(self, pair: str, bid: float, ask: float) -> None:
+        for (firstSymbol, secondSymbol) in self.trianglesByPair.get(pair, []):
+            self.triangles.pop((firstSymbol, secondSymbol), None)
+            self.triangles.pop((secondSymbol, firstSymbol), None)
+            triangle = getOptimalTriangle(firstSymbol, secondSymbol, self.stream.quotes)
+            if triangle is not None:
+                self.triangles[triangle[0]] = triangle[1]
+
+        # Only change the transaction order when the best triangle changes
+        bestTriangle = getBestTriangle(self.triangles)
+        if bestTriangle != self.bestTriangle:
+            self.bestTriangle = bestTriangle
+            setTransactionOrder(self.triangles)
+            if bestTriangle is not None:
+                self.startCycle()
+
+    # Places the first leg of a cycle if there's a profitable triangle and no cycle is running. Placing orders takes
+    # requests, so it's done in a new thread instead of the stream's
+    def startCycle(self) -> None:
+        with self.lock:
+            if self.bestTriangle is None or time.time() - transactionOrder.get(cycleKey, 0.0) < cycleTimeoutSeconds:
+                return
+            # Read once, since setTransactionOrder can remove it at any time
+            symbol = transactionOrder.get("USD")
+            if symbol is None:
+                return
+            transactionOrder[cycleKey] = time.time()
+
+        print("Starting cycle:", self.bestTriangle)
+        threading.Thread(target=placeLeg, args=(symbol, "USD", transactionOrder), daemon=True).start()
+
 if __name__ == "__main__":
     # Init manager
     manager = Manager()
@@ -122,6 +235,33 @@ if __name__ == "__main__":
         "USDC": ("AAVE", "AVAX", "BAT", "BCH", "BTC", "CRV", "DOT", "ETH", "GRT", "LINK", "LTC", "MKR", "SHIB", "UNI", "XTZ")
     }
 
+    # python main.py stream [url]: Watches quotes from the websocket instead of polling every minute. url is a
+    # quotestream.StandInServer to use instead of Alpaca's
+    if "stream" in sys.argv:
+        import quotestream
+
+        url = next((arg for arg in sys.argv if arg.startswith("ws")), None)
+        stream = quotestream.QuoteStream(getQuotePairs(), url=url)
+        stream.start()
+        print("Waiting for quotes for", len(stream.pairs), "pairs...")
+        if not stream.waitForQuotes(30):
+            # Triangles without every quote are left out until their quotes come in
+            print("No quotes yet for:", [pair for pair in stream.pairs if pair not in stream.quotes])
+
+        watcher = TriangleWatcher(stream)
+        setTransactionOrder(watcher.triangles)
+        stream.subscribe(watcher.onQuote)
+
+        watcher.startCycle()
+        while True:
+            sleep(60)
+            # In case the last cycle ended without the best triangle changing since
+            watcher.startCycle()
+            print("Transaction order:", transactionOrder, "Quote changes:", stream.stats["changes"])
+
+    cryptoquotes.setUniverse(getQuotePairs())
+    print("Watching", len(cryptoquotes.universe), "pairs")
+
     isFirstTime = True
     while True:
         updateTransactionOrder()